@@ -0,0 +1,88 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+Benchmark of process and thread backends of FunctorPool and FunctorMap on workloads that release GIL (zlib,
+hashlib) and on pure Python workload that holds it.
+
+Usage:
+    python benchmarks/functor_pool_backends.py [number of items] [number of workers]
+
+:author:     Martin Dočekal
+"""
+import hashlib
+import multiprocessing
+import sys
+import time
+import zlib
+
+from windpyutils.parallel.own_proc_pools import FunctorPool, FunctorWorker
+from windpyutils.parallel.pools import FunctorMap
+
+BLOCK = bytes(range(256)) * 256
+
+
+def compress(inp: int) -> int:
+    return len(zlib.compress(BLOCK, 6))
+
+
+def sha256(inp: int) -> bytes:
+    return hashlib.sha256(BLOCK * 16).digest()
+
+
+def pure_python(inp: int) -> int:
+    return sum(i * i for i in range(2000))
+
+
+WORKLOADS = {
+    "zlib": compress,
+    "sha256": sha256,
+    "pure_python": pure_python,
+}
+
+
+class WorkloadWorker(FunctorWorker):
+    def __init__(self, workload: str):
+        super().__init__()
+        self.workload = workload
+        self.f = None
+
+    def begin(self):
+        self.f = WORKLOADS[self.workload]
+
+    def __call__(self, inp: int):
+        return self.f(inp)
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(multiprocessing.cpu_count(), 2)
+
+    print(f"items: {items}, workers: {workers}")
+    print(f"{'workload':<14}{'backend':<10}{'FunctorPool items/s':>22}{'FunctorMap items/s':>22}")
+
+    for workload, f in WORKLOADS.items():
+        start = time.perf_counter()
+        for i in range(items):
+            f(i)
+        print(f"{workload:<14}{'serial':<10}{items / (time.perf_counter() - start):>22.0f}{'':>22}")
+
+        for backend in FunctorPool.BACKENDS:
+            with FunctorPool([WorkloadWorker(workload) for _ in range(workers)], backend=backend,
+                             transport="queue") as pool:
+                pool.until_all_ready()
+                start = time.perf_counter()
+                for _ in pool.imap(range(items), 10):
+                    pass
+                pool_duration = time.perf_counter() - start
+
+            with FunctorMap(f, workers=workers, backend=backend) as fm:
+                start = time.perf_counter()
+                for _ in fm(range(items), 10):
+                    pass
+                map_duration = time.perf_counter() - start
+
+            print(f"{workload:<14}{backend:<10}{items / pool_duration:>22.0f}{items / map_duration:>22.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+Benchmark of small item throughput of FunctorPool with different transports.
+
+Usage:
+    python benchmarks/functor_pool_transport.py [number of items] [number of workers]
+
+:author:     Martin Dočekal
+"""
+import multiprocessing
+import sys
+import time
+
+from windpyutils.parallel.own_proc_pools import FunctorPool, FunctorWorker
+
+
+class DoubleWorker(FunctorWorker):
+    def __call__(self, inp: int) -> int:
+        return inp * 2
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(multiprocessing.cpu_count(), 2)
+
+    print(f"items: {items}, workers: {workers}")
+    print(f"{'transport':<10}{'method':<16}{'chunk_size':>12}{'items/s':>14}")
+
+    for transport in FunctorPool.TRANSPORTS:
+        for method in ("imap", "imap_unordered"):
+            for chunk_size in (1, 100):
+                with FunctorPool([DoubleWorker() for _ in range(workers)], transport=transport) as pool:
+                    pool.until_all_ready()
+                    start = time.perf_counter()
+                    for _ in getattr(pool, method)(range(items), chunk_size):
+                        pass
+                    duration = time.perf_counter() - start
+
+                print(f"{transport:<10}{method:<16}{chunk_size:>12}{items / duration:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+Benchmark of writing into TextFileStorage, which uses global lock and index in manager process, and into
+SegmentedTextFileStorage, which writes own index segment in each process, from workers of FunctorPool. It also
+measures reading of all stored items back in the main process.
+
+Usage:
+    python benchmarks/segmented_storage.py [number of items] [number of workers]
+
+:author:     Martin Dočekal
+"""
+import multiprocessing
+import sys
+import tempfile
+import time
+
+from windpyutils.parallel.own_proc_pools import FunctorPool, FunctorWorker
+from windpyutils.parallel.storage import TextFileStorage, SegmentedTextFileStorage
+
+
+class StoringWorker(FunctorWorker):
+    def __init__(self, storage: TextFileStorage):
+        super().__init__()
+        self.storage = storage
+
+    def begin(self):
+        self.storage.open()
+
+    def end(self):
+        self.storage.close()
+
+    def __call__(self, inp: int) -> int:
+        self.storage[inp] = f"item number {inp}"
+        return inp
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(multiprocessing.cpu_count(), 2)
+
+    print(f"items: {items}, workers: {workers}")
+    print(f"{'storage':<28}{'write items/s':>16}{'read items/s':>16}")
+
+    for storage_cls in [TextFileStorage, SegmentedTextFileStorage]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = storage_cls(tmp_dir)
+            with FunctorPool([StoringWorker(storage) for _ in range(workers)], transport="queue") as pool:
+                pool.until_all_ready()
+                start = time.perf_counter()
+                for _ in pool.imap(range(items), 100):
+                    pass
+            # the shutdown is included as workers flush their data on close
+            write_duration = time.perf_counter() - start
+
+            storage.reader_only = True
+            with storage:
+                start = time.perf_counter()
+                for i in range(items):
+                    storage[i]
+                read_duration = time.perf_counter() - start
+
+            storage.flush()
+
+        print(f"{storage_cls.__name__:<28}{items / write_duration:>16.0f}{items / read_duration:>16.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+Benchmark of serializers of chunks on end-to-end imap throughput of FunctorPool and FunctorMap for various payload
+shapes. Workers return the received items, so each payload travels to workers and back.
+
+Usage:
+    python benchmarks/serializers.py [number of items] [number of workers] [chunk size]
+
+:author:     Martin Dočekal
+"""
+import json
+import multiprocessing
+import sys
+import time
+
+from windpyutils.parallel.own_proc_pools import FunctorPool, FunctorWorker
+from windpyutils.parallel.pools import FunctorMap
+from windpyutils.parallel.serializers import PickleSerializer, MsgpackSerializer, CodecSerializer, msgpack
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def json_encode(chunk) -> bytes:
+    return json.dumps(chunk).encode()
+
+
+def echo(inp):
+    return inp
+
+
+def payloads():
+    """
+    Payload shapes with flags whether they are plain data (for msgpack) and JSON serializable.
+    Bytearrays and NumPy arrays are sent out-of-band by pickle protocol 5.
+    """
+    yield "ints", lambda i: i, True, True
+    yield "strings", lambda i: f"item number {i} " * 4, True, True
+    yield "records", lambda i: {"id": i, "name": f"name {i}", "scores": [i * 0.5, i * 0.25], "tags": ["a", "b"]}, \
+        True, True
+    yield "bytes_64kB", lambda i: bytes(65536), True, False
+    yield "bytearray_1MB", lambda i: bytearray(2 ** 20), False, False
+    if numpy is not None:
+        yield "numpy_1MB", lambda i: numpy.zeros(2 ** 17), False, False
+
+
+def serializers(plain: bool, json_serializable: bool):
+    """
+    Serializers with shared memory thresholds of FunctorPool. FunctorMap does not use shared memory.
+    """
+    yield "default", None, None
+    yield "pickle5", PickleSerializer(), None
+    if not plain:
+        # out-of-band buffers of work and results are sent through shared memory
+        yield "pickle5_shared_mem", PickleSerializer(), 65536
+    yield "pickle5_in_band", PickleSerializer(out_of_band=False), None
+    if plain and msgpack is not None:
+        yield "msgpack", MsgpackSerializer(), None
+    if json_serializable:
+        yield "json", CodecSerializer(json_encode, json.loads), None
+
+
+class EchoWorker(FunctorWorker):
+    def __call__(self, inp):
+        return inp
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(multiprocessing.cpu_count(), 2)
+    chunk_size = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    print(f"items: {items}, workers: {workers}, chunk size: {chunk_size}")
+    print(f"{'payload':<20}{'serializer':<20}{'FunctorPool items/s':>22}{'FunctorMap items/s':>22}")
+
+    for payload, create, plain, json_serializable in payloads():
+        data = [create(i) for i in range(items)]
+        for name, serializer, shared_memory_threshold in serializers(plain, json_serializable):
+            with FunctorPool([EchoWorker() for _ in range(workers)], transport="queue", serializer=serializer,
+                             shared_memory_threshold=shared_memory_threshold) as pool:
+                pool.until_all_ready()
+                start = time.perf_counter()
+                for _ in pool.imap(data, chunk_size):
+                    pass
+                pool_duration = time.perf_counter() - start
+
+            map_throughput = "-"
+            if shared_memory_threshold is None:
+                with FunctorMap(echo, workers=workers, serializer=serializer) as fm:
+                    start = time.perf_counter()
+                    for _ in fm(data, chunk_size):
+                        pass
+                    map_throughput = f"{items / (time.perf_counter() - start):.0f}"
+
+            print(f"{payload:<20}{name:<20}{items / pool_duration:>22.0f}{map_throughput:>22}")
+
+
+if __name__ == '__main__':
+    main()
@@ -20,7 +20,7 @@ setup_args = dict(
     author='Martin Dočekal',
     keywords=['utils', 'general usage'],
     url='https://github.com/mdocekal/windPyUtils',
-    python_requires='>=3.7',
+    python_requires='>=3.8',
     install_requires=[]
 )
 
@@ -9,6 +9,8 @@ import json
 import multiprocessing
 import os
 import random
+import subprocess
+import sys
 import unittest
 from dataclasses import dataclass
 from io import StringIO
@@ -17,7 +19,8 @@ from unittest import TestCase
 
 from windpyutils.files import RandomLineAccessFile, MapAccessFile, MemoryMappedRandomLineAccessFile, \
     MutableRandomLineAccessFile, MutableMemoryMappedRandomLineAccessFile, TmpPool, JsonRecord, Record, RecordFile, \
-    MemoryMappedRecordFile, MutableRecordFile, MutableMemoryMappedRecordFile, CSVRecord, TSVRecord, FilePool
+    MemoryMappedRecordFile, MutableRecordFile, MutableMemoryMappedRecordFile, CSVRecord, TSVRecord, FilePool, \
+    PartitionedWriter, external_sort
 from windpyutils.parallel.own_proc_pools import FunctorPool, FunctorWorker
 
 path_to_this_script_file = os.path.dirname(os.path.realpath(__file__))
@@ -113,6 +116,20 @@ class TestRandomLineAccessFile(unittest.TestCase):
             self.assertSequenceEqual([10, 15, 20], [int(x) for x in lines[[10, 15, 20]]])
         self.assertFalse(self.lines_file.dirty)
 
+    def test_sorted_view(self):
+        view = self.lines_file.sorted_view(lambda x: -int(x))
+        self.assertIsInstance(view, type(self.lines_file))
+        self.assertTrue(view.closed)
+        self.assertFalse(self.lines_file.dirty)
+        with view:
+            self.assertEqual([str(i) for i in reversed(range(1000))], list(view))
+            self.assertEqual("999", view[0])
+
+        with self.lines_file as lines, lines.sorted_view(str, reverse=True) as view:
+            self.assertEqual(sorted((str(i) for i in range(1000)), reverse=True), list(view))
+            self.assertFalse(lines.closed)
+            self.assertEqual("0", lines[0])
+
 
 class TestRandomLineAccessFileFromKnownIndex(TestRandomLineAccessFile):
     def setUp(self) -> None:
@@ -400,6 +417,98 @@ class TestTmpPoolMultProc(TestCase):
                 self.assertFalse(os.path.isfile(p))
 
 
+class TestTmpPoolOwnDir(TestCase):
+    def test_create(self):
+        paths = []
+        with TmpPool(TMP_DIR, own_dir=True) as pool:
+            for _ in range(10):
+                paths.append(pool.create())
+                self.assertTrue(os.path.isfile(paths[-1]))
+                self.assertEqual(pool.directory, str(Path(paths[-1]).parent))
+
+            self.assertEqual(10, len(pool))
+            self.assertSequenceEqual(paths, list(pool))
+
+        self.assertEqual(0, len(pool))
+        self.assertSequenceEqual([], list(pool))
+        self.assertFalse(os.path.isdir(pool.directory))
+
+        for p in paths:
+            self.assertFalse(os.path.isfile(p))
+
+    def test_directory_created_on_enter(self):
+        before = set(os.listdir(TMP_DIR))
+        pool = TmpPool(TMP_DIR, own_dir=True)
+        self.assertIsNone(pool.directory)
+        self.assertSetEqual(before, set(os.listdir(TMP_DIR)))
+        self.assertEqual(0, len(pool))
+        with self.assertRaises(RuntimeError):
+            pool.create()
+
+        with pool:
+            self.assertTrue(os.path.isdir(pool.directory))
+        self.assertSetEqual(before, set(os.listdir(TMP_DIR)))
+
+    def test_remove(self):
+        with TmpPool(own_dir=True) as pool:
+            for _ in range(10):
+                p = pool.create()
+                pool.remove(p)
+                self.assertFalse(os.path.isfile(p))
+            self.assertEqual(0, len(pool))
+
+    def test_flush(self):
+        paths = []
+        with TmpPool(own_dir=True) as pool:
+            for _ in range(10):
+                paths.append(pool.create())
+            pool.flush()
+            self.assertEqual(0, len(pool))
+            for p in paths:
+                self.assertFalse(os.path.isfile(p))
+
+    def test_size(self):
+        with TmpPool(own_dir=True) as pool:
+            self.assertEqual(0, pool.size())
+            for i in range(1, 4):
+                with open(pool.create(), "w") as f:
+                    f.write("x" * i * 10)
+            self.assertEqual(60, pool.size())
+
+    def test_cleanup(self):
+        with TmpPool(own_dir=True) as pool:
+            paths = []
+            for i in range(3):
+                paths.append(pool.create())
+                with open(paths[-1], "w") as f:
+                    f.write("x" * 10)
+                os.utime(paths[-1], ns=(i * 1_000_000_000, i * 1_000_000_000))
+
+            self.assertEqual(0, pool.cleanup(quota=30))
+            self.assertEqual(20, pool.cleanup(quota=15))
+            self.assertSequenceEqual(paths[2:], list(pool))
+            self.assertEqual(0, pool.cleanup(min_free=0))
+
+
+class TestTmpPoolOwnDirMultProc(TestCase):
+    def test_create(self):
+        if multiprocessing.cpu_count() <= 1:
+            self.skipTest("Not enough cpus.")
+        paths = []
+
+        with TmpPool(own_dir=True) as pool, \
+                FunctorPool([CreateTmpFileWorker(pool) for _ in range(multiprocessing.cpu_count())]) as proc_pool:
+            for p in proc_pool.imap(None for _ in range(multiprocessing.cpu_count() * 10)):
+                paths.append(p)
+                self.assertTrue(os.path.isfile(p))
+
+            self.assertEqual(len(paths), len(set(paths)))
+            self.assertEqual(sorted(paths), list(pool))
+
+        for p in paths:
+            self.assertFalse(os.path.isfile(p))
+
+
 @dataclass
 class OwnJsonRecord(JsonRecord):
     mass: float
@@ -541,6 +650,14 @@ class TestRecordFile(unittest.TestCase):
         self.assertTrue(self.record_file.dirty)
 
 
+class TestRecordFileSortedView(unittest.TestCase):
+    def test_sorted_view(self):
+        with RecordFile(file_with_line_numbers, IntRecord).sorted_view(lambda r: r.num % 10) as view:
+            gt = sorted(range(1000), key=lambda x: x % 10)
+            self.assertEqual(gt, [r.num for r in view])
+            self.assertEqual(gt[1], view[1].num)
+
+
 class TestRecordFileFromKnownIndex(TestRecordFile):
     def setUp(self) -> None:
         offset = 0
@@ -703,6 +820,168 @@ class TestFilePool(TestCase):
             self.assertEqual("file 3", self.pool[self.paths_to_files[2]].read().rstrip("\n"))
 
 
+class TestExternalSort(TestCase):
+    def setUp(self) -> None:
+        self.numbers = list(range(1000))
+        random.Random(42).shuffle(self.numbers)
+        self.unsorted_path = os.path.join(TMP_DIR, "unsorted.txt")
+        self.sorted_path = os.path.join(TMP_DIR, "sorted.txt")
+        self.index_path = os.path.join(TMP_DIR, "sorted.index")
+        with open(self.unsorted_path, "w") as f:
+            for n in self.numbers:
+                print(json.dumps({"mass": n, "velocity": n % 10}), file=f)
+
+    def tearDown(self) -> None:
+        for f in os.listdir(TMP_DIR):
+            if f != "placeholder":
+                os.remove(os.path.join(TMP_DIR, f))
+
+    def check_output(self, gt, offsets):
+        with RecordFile(self.sorted_path, OwnJsonRecord) as records:
+            self.assertEqual(gt, [(r.mass, r.velocity) for r in records])
+
+        with RecordFile(self.sorted_path, OwnJsonRecord, offsets) as records:
+            self.assertEqual(gt, [(r.mass, r.velocity) for r in records[:]])
+
+    def test_sort(self):
+        offsets = external_sort(RandomLineAccessFile(self.unsorted_path), self.sorted_path,
+                                key=lambda line: json.loads(line)["mass"], run_size=99, tmp_dir=TMP_DIR,
+                                index_path=self.index_path)
+        self.check_output([(n, n % 10) for n in range(1000)], offsets)
+        self.assertEqual(offsets, RandomLineAccessFile.read_index_from_file(self.index_path))
+        self.assertSequenceEqual(["placeholder", "sorted.index", "sorted.txt", "unsorted.txt"],
+                                 sorted(os.listdir(TMP_DIR)))
+
+    def test_sort_records_stable(self):
+        offsets = external_sort(RecordFile(self.unsorted_path, OwnJsonRecord), self.sorted_path,
+                                key=lambda r: r.velocity, run_size=99)
+        gt = sorted([(n, n % 10) for n in self.numbers], key=lambda x: x[1])
+        self.check_output(gt, offsets)
+
+    def test_sort_reverse(self):
+        offsets = external_sort(RecordFile(self.unsorted_path, OwnJsonRecord), self.sorted_path,
+                                key=lambda r: r.velocity, run_size=99, reverse=True)
+        gt = sorted([(n, n % 10) for n in self.numbers], key=lambda x: x[1], reverse=True)
+        self.check_output(gt, offsets)
+
+    def test_sort_parallel(self):
+        if multiprocessing.cpu_count() <= 1:
+            self.skipTest("Not enough cpus.")
+        with RecordFile(self.unsorted_path, OwnJsonRecord) as records:
+            offsets = external_sort(records, self.sorted_path, key=lambda r: r.mass, run_size=99, workers=2)
+        self.check_output([(n, n % 10) for n in range(1000)], offsets)
+
+    def test_import_without_pools(self):
+        res = subprocess.run([sys.executable, "-c", "import sys, windpyutils.files; "
+                                                    "print('windpyutils.parallel.own_proc_pools' in sys.modules)"],
+                             cwd=os.path.dirname(path_to_this_script_file), capture_output=True, text=True, check=True)
+        self.assertEqual("False", res.stdout.strip())
+
+
+class TestPartitionedWriter(TestCase):
+    def setUp(self) -> None:
+        self.paths = [os.path.join(TMP_DIR, f"partition_{i}.txt") for i in range(3)]
+
+    def tearDown(self) -> None:
+        for f in os.listdir(TMP_DIR):
+            if f != "placeholder":
+                os.remove(os.path.join(TMP_DIR, f))
+
+    def write_and_check(self, writer: PartitionedWriter):
+        with writer:
+            for i in range(1000):
+                writer.write(i % 3, str(i), key=i)
+
+        for p, path in enumerate(self.paths):
+            with open(path) as f:
+                self.assertEqual([str(i) for i in range(p, 1000, 3)], f.read().splitlines())
+
+    def test_write(self):
+        self.write_and_check(PartitionedWriter(self.paths, flush_threshold=100))
+
+    def test_write_background_flush(self):
+        self.write_and_check(PartitionedWriter(self.paths, flush_threshold=100, background_flush=True))
+
+    def test_write_not_opened(self):
+        with self.assertRaises(RuntimeError):
+            PartitionedWriter(self.paths).write(0, "line")
+
+    def test_write_invalid_partition(self):
+        with PartitionedWriter(self.paths) as writer:
+            for partition in [-1, 3]:
+                with self.assertRaises(ValueError):
+                    writer.write(partition, "line")
+
+    def test_write_line_with_line_ending(self):
+        with PartitionedWriter(self.paths, index=True) as writer:
+            with self.assertRaises(ValueError):
+                writer.write(0, "first\nsecond")
+            self.assertEqual(0, writer.write(0, "line\n"))
+            self.assertListEqual([0], writer.line_offsets(0))
+
+        with PartitionedWriter(self.paths, line_ending="|") as writer:
+            with self.assertRaises(ValueError):
+                writer.write(0, "first|second")
+
+    def test_write_custom_line_ending(self):
+        with PartitionedWriter(self.paths, index=True, line_ending="\r\n") as writer:
+            self.assertEqual(0, writer.write(0, "x"))
+            self.assertEqual(3, writer.write(0, "y\r\n"))
+            self.assertEqual(6, writer.write(0, "z"))
+            for line in ["first\rsecond", "first\nsecond", "first\r\nsecond", "line\r"]:
+                with self.assertRaises(ValueError):
+                    writer.write(0, line)
+
+        self.assertListEqual([0, 3, 6], writer.line_offsets(0))
+        with open(self.paths[0], "rb") as f:
+            self.assertEqual(b"x\r\ny\r\nz\r\n", f.read())
+
+    def test_reopen(self):
+        writer = PartitionedWriter(self.paths, index=True)
+        with writer:
+            for line in ["a", "b"]:
+                writer.write(0, line, key=line)
+
+        with writer:
+            self.assertEqual(0, writer.write(0, "c", key="c"))
+
+        self.assertListEqual([0], writer.line_offsets(0))
+        self.assertDictEqual({"c": 0}, writer.mapping(0))
+        with open(self.paths[0], "rb") as f:
+            self.assertEqual(b"c\n", f.read())
+
+    def test_index_not_activated(self):
+        writer = PartitionedWriter(self.paths)
+        with self.assertRaises(RuntimeError):
+            writer.line_offsets(0)
+        with self.assertRaises(RuntimeError):
+            writer.mapping(0)
+
+    def test_line_offsets(self):
+        writer = PartitionedWriter(self.paths, flush_threshold=100, background_flush=True, index=True)
+        self.write_and_check(writer)
+
+        for p, path in enumerate(self.paths):
+            with RandomLineAccessFile(path, writer.line_offsets(p)) as lines:
+                self.assertEqual([str(i) for i in range(p, 1000, 3)], list(lines[i] for i in range(len(lines))))
+
+            index_path = path + ".index"
+            writer.save_line_offsets(p, index_path)
+            self.assertEqual(writer.line_offsets(p), RandomLineAccessFile.read_index_from_file(index_path))
+
+    def test_mapping(self):
+        writer = PartitionedWriter(self.paths, flush_threshold=100, index=True)
+        self.write_and_check(writer)
+
+        for p, path in enumerate(self.paths):
+            with MapAccessFile(path, writer.mapping(p)) as mapped_file:
+                for i in range(p, 1000, 3):
+                    self.assertEqual(str(i), mapped_file[i].rstrip("\n"))
+
+            index_path = path + ".index"
+            writer.save_mapping(p, index_path)
+            self.assertEqual(writer.mapping(p), MapAccessFile.load_mapping(index_path, int))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,17 +4,27 @@ Created on 04.12.21
 
 :author:     Martin Dočekal
 """
+import asyncio
+import json
 import multiprocessing
 import os
+import pickle
+import queue
+import signal
+import tempfile
 import time
 import unittest
 import math
 from multiprocessing.context import BaseContext
 from multiprocessing.queues import Queue
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
+from windpyutils.parallel.chunks import AdaptiveChunkSize
 from windpyutils.parallel.own_proc_pools import FunctorPool, FunctorWorker, BaseFunctorWorker, FunctorWorkerFactory, \
-    FactoryFunctorPool
+    FactoryFunctorPool, SharedMemoryChunk, WorkerError, FunctorPipeline, SharedData, PriorityScheduler, \
+    DeadlineExpiredError, resident_memory
+from windpyutils.parallel.pool_metrics import PoolMetrics
+from windpyutils.parallel.serializers import PickleSerializer, CodecSerializer
 
 context_fork = multiprocessing.get_context("fork")
 context_spawn = multiprocessing.get_context("spawn")
@@ -126,6 +136,31 @@ class MockFunctorWorkerFactory(FunctorWorkerFactory):
         return w
 
 
+class MockLeakingWorker(FunctorWorker):
+    def __init__(self, max_rss: Optional[int] = None):
+        super().__init__(max_rss=max_rss)
+        self.leak = []
+        self.end_called = multiprocessing.Event()
+
+    def __call__(self, inp: int) -> int:
+        self.leak.append(b"x" * 2 ** 20)
+        return inp * 2
+
+    def end(self):
+        self.end_called.set()
+
+
+class MockLeakingWorkerFactory(FunctorWorkerFactory):
+    def __init__(self, max_rss: Optional[int] = None):
+        self.created_workers = []
+        self.max_rss = max_rss
+
+    def create(self) -> BaseFunctorWorker:
+        w = MockLeakingWorker(self.max_rss)
+        self.created_workers.append(w)
+        return w
+
+
 class ForkMockWorkerLargeData(BaseMockWorkerLargeData, context_fork.Process):
     def __init__(self, max_chunks_per_worker: float = math.inf):
         super().__init__(context_fork, max_chunks_per_worker)
@@ -142,6 +177,9 @@ class ForkServerMockWorkerLargeData(BaseMockWorkerLargeData, context_forkserver.
 
 
 class TestFunctorPool(unittest.TestCase):
+    transport = "manager"
+    backend = "process"
+
     def setUp(self) -> None:
         self.workers = [MockWorker() for _ in range(2)]
         self.context = multiprocessing.get_context()
@@ -153,7 +191,7 @@ class TestFunctorPool(unittest.TestCase):
                 self.assertFalse(w.begin_called.is_set())
                 self.assertFalse(w.end_called.is_set())
 
-            with FunctorPool(self.workers, self.context) as pool:
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend) as pool:
                 for i, w in enumerate(self.workers):
                     self.assertEqual(i, w.wid)
                     self.assertIsNotNone(w.work_queue)
@@ -168,7 +206,7 @@ class TestFunctorPool(unittest.TestCase):
     def test_imap(self):
         if os.cpu_count() > 1:
             data = [i for i in range(10000)]
-            with FunctorPool(self.workers, self.context) as pool:
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend) as pool:
                 results = list(pool.imap(data))
 
             self.assertListEqual([i * 2 for i in data], results)
@@ -182,7 +220,7 @@ class TestFunctorPool(unittest.TestCase):
     def test_imap_unordered(self):
         if os.cpu_count() > 1:
             data = [i for i in range(10000)]
-            with FunctorPool(self.workers, self.context) as pool:
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend) as pool:
                 results = list(pool.imap_unordered(data))
 
             self.assertListEqual([i * 2 for i in data], sorted(results))
@@ -198,7 +236,7 @@ class TestFunctorPool(unittest.TestCase):
             self.workers = [self._large_worker_class() for _ in range(2)]
             data = [i for i in range(10000)]
             
-            with FunctorPool(self.workers, self.context) as pool:
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend) as pool:
                 results = list(x[-1] for x in pool.imap(data))
                 self.assertListEqual([i * 2 for i in data], results)
 
@@ -213,7 +251,7 @@ class TestFunctorPool(unittest.TestCase):
             self.workers = [self._large_worker_class() for _ in range(2)]
             data = [i for i in range(10000)]
 
-            with FunctorPool(self.workers, self.context) as pool:
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend) as pool:
                 results = sorted(x[-1] for x in pool.imap_unordered(data))
                 self.assertListEqual([i * 2 for i in data], results)
 
@@ -228,7 +266,7 @@ class TestFunctorPool(unittest.TestCase):
             for w in self.workers:
                 self.assertFalse(w.begin_called.is_set())
                 self.assertFalse(w.end_called.is_set())
-            with FunctorPool(self.workers, self.context) as pool:
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend) as pool:
 
                 pool.until_all_ready()
                 for w in self.workers:
@@ -244,7 +282,7 @@ class TestFunctorPool(unittest.TestCase):
     def test_map_chunk_size(self):
         if os.cpu_count() > 1:
             data = [i for i in range(10000)]
-            with FunctorPool(self.workers, self.context) as fm:
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend) as fm:
                 results = list(fm.imap(data, chunk_size=250))
                 self.assertListEqual(results, [i * 2 for i in data])
 
@@ -258,7 +296,7 @@ class TestFunctorPool(unittest.TestCase):
         if os.cpu_count() > 1:
             data = [i for i in range(10000)]
 
-            with FunctorPool(self.workers, self.context) as fm:
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend) as fm:
                 results = list(fm.imap(data, chunk_size=700))
                 self.assertListEqual(results, [i * 2 for i in data])
 
@@ -268,6 +306,90 @@ class TestFunctorPool(unittest.TestCase):
         else:
             self.skipTest("This test can only be run on the multi cpu device.")
 
+    def test_map_adaptive_chunk_size(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(10000)]
+            chunk_size = AdaptiveChunkSize(target_time=0.01)
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend) as fm:
+                results = list(fm.imap(data, chunk_size=chunk_size))
+                self.assertListEqual(results, [i * 2 for i in data])
+            self.assertGreater(chunk_size.size, 1)
+
+            for w in self.workers:
+                self.assertTrue(w.begin_called.is_set())
+                self.assertTrue(w.end_called.is_set())
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_imap_unordered_adaptive_chunk_size(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(10000)]
+            chunk_size = AdaptiveChunkSize(target_time=0.01)
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend) as fm:
+                results = list(fm.imap_unordered(data, chunk_size=chunk_size))
+                self.assertListEqual(sorted(results), [i * 2 for i in data])
+            self.assertGreater(chunk_size.size, 1)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_imap_metrics(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(10000)]
+            metrics = PoolMetrics(callback=lambda x: None, interval=0.01)
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend,
+                             metrics=metrics) as fm:
+                results = list(fm.imap(data, chunk_size=100))
+                self.assertListEqual(results, [i * 2 for i in data])
+
+            snapshot = metrics.snapshot()
+            self.assertEqual(100, snapshot["chunks_sent"])
+            self.assertEqual(100, snapshot["chunks_received"])
+            self.assertEqual(10000, snapshot["items_received"])
+            self.assertEqual(100, sum(w["chunks"] for w in snapshot["workers"].values()))
+            for w in snapshot["workers"].values():
+                self.assertIsNotNone(w["begin_time"])
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_imap_affinity(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(10000)]
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend,
+                             affinity=lambda x: x // 100) as fm:
+                results = list(fm.imap(data, chunk_size=30))
+                self.assertListEqual(results, [i * 2 for i in data])
+
+            for w in self.workers:
+                self.assertTrue(w.begin_called.is_set())
+                self.assertTrue(w.end_called.is_set())
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_imap_unordered_affinity(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(10000)]
+            with FunctorPool(self.workers, self.context, transport=self.transport, backend=self.backend,
+                             affinity=lambda x: x % 3) as fm:
+                results = list(fm.imap_unordered(data, chunk_size=30))
+                self.assertListEqual(sorted(results), [i * 2 for i in data])
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_affinity_stealing(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(200)]
+            metrics = PoolMetrics()
+            workers = [MockWorker(wait=0.001) for _ in range(2)]
+            # all the work goes to a single worker, so the other one must steal it
+            with FunctorPool(workers, transport=self.transport, backend=self.backend, affinity=lambda x: 0,
+                             metrics=metrics) as fm:
+                results = list(fm.imap(data, chunk_size=5))
+                self.assertListEqual(results, [i * 2 for i in data])
+
+            self.assertGreater(metrics.snapshot()["stolen_chunks"], 0)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
 
 class TestForkFunctorPool(TestFunctorPool):
     def setUp(self) -> None:
@@ -290,7 +412,389 @@ class TestForkServerFunctorPool(TestFunctorPool):
         self.context = context_forkserver
 
 
+class TestQueueTransportFunctorPool(TestFunctorPool):
+    transport = "queue"
+
+
+class TestQueueTransportForkFunctorPool(TestForkFunctorPool):
+    transport = "queue"
+
+
+class TestQueueTransportSpawnFunctorPool(TestSpawnFunctorPool):
+    transport = "queue"
+
+
+class TestQueueTransportForkServerFunctorPool(TestForkServerFunctorPool):
+    transport = "queue"
+
+
+class TestThreadFunctorPool(TestFunctorPool):
+    backend = "thread"
+
+
+class MockRaisingWorker(FunctorWorker):
+    def __call__(self, inp: int) -> int:
+        if inp == 13:
+            raise SystemExit(1)
+        return inp * 2
+
+
+class TestThreadBackend(unittest.TestCase):
+    """
+    Threads do not need multiple cpus.
+    """
+
+    def setUp(self) -> None:
+        self.data = [i for i in range(1000)]
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            FunctorPool([MockWorker()], backend="unknown")
+
+    def test_imap(self):
+        workers = [MockWorker() for _ in range(2)]
+        with FunctorPool(workers, backend="thread") as pool:
+            self.assertIsNone(pool._manager)
+            self.assertIsInstance(pool._work_queue, queue.Queue)
+            for w in workers:
+                self.assertIsNone(w.exitcode)
+                self.assertTrue(w.is_alive())
+            self.assertListEqual([i * 2 for i in self.data], list(pool.imap(self.data, chunk_size=10)))
+            self.assertListEqual([i * 2 for i in self.data], sorted(pool.imap_unordered(self.data, chunk_size=10)))
+
+        for w in workers:
+            self.assertTrue(w.begin_called.is_set())
+            self.assertTrue(w.end_called.is_set())
+            self.assertEqual(0, w.exitcode)
+            self.assertFalse(w.is_alive())
+
+    def test_factory_replacement(self):
+        factory = MockFunctorWorkerFactory(max_chunks_per_worker=10)
+        with FactoryFunctorPool(2, factory, backend="thread") as pool:
+            self.assertListEqual([i * 2 for i in self.data], list(pool.imap(self.data, chunk_size=10)))
+        self.assertGreater(len(factory.created_workers), 2)
+
+    def test_crash(self):
+        workers = [MockRaisingWorker() for _ in range(2)]
+        with FunctorPool(workers, backend="thread", max_retries=0) as pool:
+            pool.LIVENESS_INTERVAL = 0.01
+            results = list(pool.imap(range(100), chunk_size=10))
+
+        self.assertListEqual([i * 2 for i in range(100) if not 10 <= i < 20], results)
+        self.assertListEqual([1], list(pool.poisoned))
+        self.assertIn(1, [w.exitcode for w in workers])
+
+    def test_standby(self):
+        factory = MockFunctorWorkerFactory(max_chunks_per_worker=10)
+        with FactoryFunctorPool(2, factory, backend="thread", standby=1) as pool:
+            standby = pool._standby[0]
+            self.assertTrue(standby.begin_called.wait(10))
+            self.assertListEqual([i * 2 for i in self.data], list(pool.imap(self.data, chunk_size=10)))
+            self.assertIsNot(standby, pool._standby[0])
+            self.assertTrue(standby.activate.is_set())
+
+        # initial workers, standby and its refill for each replacement
+        self.assertGreater(len(factory.created_workers), 3)
+        for w in factory.created_workers:
+            self.assertTrue(w.end_called.is_set())
+            self.assertEqual(0, w.exitcode)
+
+    def test_standby_unused(self):
+        factory = MockFunctorWorkerFactory()
+        with FactoryFunctorPool(2, factory, backend="thread", standby=2) as pool:
+            self.assertListEqual([i * 2 for i in self.data], list(pool.imap(self.data, chunk_size=10)))
+        self.assertEqual(4, len(factory.created_workers))
+        for w in factory.created_workers:
+            self.assertTrue(w.end_called.is_set())
+
+    def test_standby_affinity(self):
+        with self.assertRaises(ValueError):
+            FactoryFunctorPool(2, MockFunctorWorkerFactory(), backend="thread", standby=1, affinity=lambda x: x)
+
+    def test_max_rss_ignored(self):
+        factory = MockLeakingWorkerFactory(0)
+        with FactoryFunctorPool(2, factory, backend="thread", prespawn=True) as pool:
+            self.assertListEqual([i * 2 for i in range(10)], list(pool.imap(range(10))))
+        self.assertEqual(2, len(factory.created_workers))
+
+    def test_serializer_ignored(self):
+        workers = [MockWorker() for _ in range(2)]
+        with FunctorPool(workers, backend="thread", serializer=PickleSerializer()) as pool:
+            self.assertIsNone(pool.serializer)
+            self.assertListEqual([i * 2 for i in self.data], list(pool.imap(self.data, chunk_size=10)))
+        for w in workers:
+            self.assertIsNone(w.serializer)
+
+    def test_pipeline(self):
+        stages = [[MockWorker() for _ in range(2)], [MockAddWorker(1) for _ in range(2)]]
+        with FunctorPipeline(stages, backend="thread") as pipeline:
+            self.assertListEqual([i * 2 + 1 for i in self.data], list(pipeline.imap(self.data, chunk_size=10)))
+
+
+class TestResidentMemory(unittest.TestCase):
+    def test_resident_memory(self):
+        if not os.path.exists("/proc/self/statm"):
+            self.skipTest("This test can only be run on the system with /proc.")
+        before = resident_memory()
+        self.assertGreater(before, 0)
+        data = b"x" * 50 * 2 ** 20
+        self.assertGreater(resident_memory(), before + 40 * 2 ** 20)
+        del data
+
+
+class TestInvalidTransportFunctorPool(unittest.TestCase):
+    def test_invalid_transport(self):
+        with self.assertRaises(ValueError):
+            FunctorPool([MockWorker()], transport="unknown")
+
+
+class MockWorkerBlob(FunctorWorker):
+    def __call__(self, inp: int) -> Tuple[int, pickle.PickleBuffer]:
+        return inp * 2, pickle.PickleBuffer(bytearray([inp % 256]) * 10000)
+
+
+class MockBytesWorker(FunctorWorker):
+    def __call__(self, inp: memoryview) -> bytes:
+        return bytes(inp) * 2
+
+
+class TestSharedMemoryChunk(unittest.TestCase):
+    def test_write_small(self):
+        chunk = [1, 2, 3]
+        self.assertIs(chunk, SharedMemoryChunk.write(chunk, 1000))
+
+    def test_write_read(self):
+        chunk = [(i, pickle.PickleBuffer(bytearray([i]) * 10000)) for i in range(5)]
+        descriptor = SharedMemoryChunk.write(chunk, 1000)
+        self.assertIsInstance(descriptor, SharedMemoryChunk)
+        self.assertListEqual([10000] * 5, descriptor.buffers_lens)
+
+        descriptor = pickle.loads(pickle.dumps(descriptor))
+        res = descriptor.read()
+        self.assertListEqual(list(range(5)), [x[0] for x in res])
+        for i, (_, blob) in enumerate(res):
+            self.assertIsInstance(blob, memoryview)
+            self.assertEqual(bytes([i]) * 10000, bytes(blob))
+
+        with self.assertRaises(FileNotFoundError):
+            descriptor.read()
+
+    def test_unlink(self):
+        descriptor = SharedMemoryChunk.write([b"a" * 10000], 1000)
+        descriptor.unlink()
+        with self.assertRaises(FileNotFoundError):
+            descriptor.read()
+
+
+class TestSharedMemoryFunctorPool(unittest.TestCase):
+    def test_imap(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            for transport in FunctorPool.TRANSPORTS:
+                with FunctorPool([MockWorkerBlob() for _ in range(2)], transport=transport,
+                                 shared_memory_threshold=1000) as pool:
+                    results = list(pool.imap(data, chunk_size=10))
+
+                self.assertListEqual([i * 2 for i in data], [x[0] for x in results])
+                for i, (_, blob) in enumerate(results):
+                    self.assertEqual(bytes([i % 256]) * 10000, bytes(blob))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+
+def json_encode(chunk) -> bytes:
+    return json.dumps(chunk).encode()
+
+
+class TestSerializerFunctorPool(unittest.TestCase):
+    def setUp(self) -> None:
+        self.data = [i for i in range(1000)]
+
+    def test_imap(self):
+        if os.cpu_count() > 1:
+            for transport in FunctorPool.TRANSPORTS:
+                for serializer in [PickleSerializer(), CodecSerializer(json_encode, json.loads)]:
+                    with FunctorPool([MockWorker() for _ in range(2)], transport=transport,
+                                     serializer=serializer) as pool:
+                        for p in pool.procs:
+                            self.assertIs(serializer, p.serializer)
+                        self.assertListEqual([i * 2 for i in self.data], list(pool.imap(self.data, chunk_size=10)))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_out_of_band(self):
+        if os.cpu_count() > 1:
+            with FunctorPool([MockWorkerBlob() for _ in range(2)], serializer=PickleSerializer()) as pool:
+                results = list(pool.imap(self.data, chunk_size=10))
+
+            self.assertListEqual([i * 2 for i in self.data], [x[0] for x in results])
+            for i, (_, blob) in enumerate(results):
+                self.assertEqual(bytes([i % 256]) * 10000, bytes(blob))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_shared_memory(self):
+        if os.cpu_count() > 1:
+            with FunctorPool([MockWorkerBlob() for _ in range(2)], serializer=PickleSerializer(),
+                             shared_memory_threshold=100000) as pool:
+                results = list(pool.imap(self.data, chunk_size=5))
+
+            self.assertListEqual([i * 2 for i in self.data], [x[0] for x in results])
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_work_through_shared_memory(self):
+        if os.cpu_count() > 1:
+            data = [bytes([i % 256]) * 1000 for i in range(100)]
+            for transport in FunctorPool.TRANSPORTS:
+                with FunctorPool([MockBytesWorker() for _ in range(2)], transport=transport,
+                                 serializer=PickleSerializer(), shared_memory_threshold=1000) as pool:
+                    results = list(pool.imap([pickle.PickleBuffer(x) for x in data], chunk_size=5))
+                    self.assertListEqual([x * 2 for x in data], results)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "shared memory segments are not listed in /dev/shm")
+    def test_work_through_shared_memory_abandoned(self):
+        if os.cpu_count() > 1:
+            data = [pickle.PickleBuffer(bytes([i % 256]) * 1000) for i in range(100)]
+            before = set(os.listdir("/dev/shm"))
+            # workers stop after the first chunk, so the chunks that wait in the work queue are never received
+            with FunctorPool([MockBytesWorker(max_chunks_per_worker=1) for _ in range(2)], transport="queue",
+                             serializer=PickleSerializer(), shared_memory_threshold=1000) as pool:
+                results = pool.imap(data, chunk_size=1)
+                self.assertEqual(bytes(data[0]) * 2, next(results))
+                results.close()
+                for p in pool.procs:
+                    p.join()
+                self.assertNotEqual({}, pool._segments)
+
+            self.assertDictEqual({}, pool._segments)
+            self.assertSetEqual(set(), {n for n in set(os.listdir("/dev/shm")) - before if n.startswith("psm_")})
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_pipeline(self):
+        if os.cpu_count() > 1:
+            stages = [[MockWorker() for _ in range(2)], [MockAddWorker(1) for _ in range(2)]]
+            with FunctorPipeline(stages, serializer=CodecSerializer(json_encode, json.loads)) as pipeline:
+                self.assertListEqual([i * 2 + 1 for i in self.data], list(pipeline.imap(self.data, chunk_size=10)))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_factory_fault_tolerance(self):
+        if os.cpu_count() > 1:
+            factory = MockCrashingWorkerFactory(500)
+            with FactoryFunctorPool(2, factory, max_retries=2, serializer=PickleSerializer()) as pool:
+                pool.LIVENESS_INTERVAL = 0.1
+                self.assertListEqual([i * 2 for i in self.data], list(pool.imap(self.data, chunk_size=10)))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+
+class TestSharedData(unittest.TestCase):
+    def setUp(self) -> None:
+        self.data = {"offsets": [0, 10, 20], "blob": pickle.PickleBuffer(bytearray(range(256)) * 100)}
+
+    def check(self, handle: SharedData):
+        handle = pickle.loads(pickle.dumps(handle))
+        data = handle.load()
+        self.assertIs(data, handle.load())
+        self.assertListEqual([0, 10, 20], data["offsets"])
+        self.assertIsInstance(data["blob"], memoryview)
+        self.assertTrue(data["blob"].readonly)
+        self.assertEqual(bytes(range(256)) * 100, bytes(data["blob"]))
+        self.assertIsNone(pickle.loads(pickle.dumps(handle))._data)
+
+        handle.unlink()
+        handle.unlink()
+        # loaded data are still usable
+        self.assertEqual(bytes(range(256)) * 100, bytes(data["blob"]))
+        with self.assertRaises(FileNotFoundError):
+            pickle.loads(pickle.dumps(handle)).load()
+
+    def test_shared_memory(self):
+        handle = SharedData.publish(self.data)
+        self.assertIsNotNone(handle.name)
+        self.assertListEqual([25600], handle.buffers_lens)
+        self.check(handle)
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            handle = SharedData.publish(self.data, os.path.join(tmp_dir, "data.shared"))
+            self.assertTrue(os.path.isfile(handle.path))
+            self.check(handle)
+            self.assertFalse(os.path.exists(handle.path))
+
+
+class MockSharedDataWorker(FunctorWorker):
+    def __init__(self):
+        super().__init__()
+        self.table = None
+
+    def begin(self):
+        self.table = self.shared_data["table"].load()
+
+    def __call__(self, inp: int) -> int:
+        return self.table[inp % len(self.table)]
+
+
+class MockSharedDataWorkerFactory(FunctorWorkerFactory):
+    def create(self) -> BaseFunctorWorker:
+        return MockSharedDataWorker()
+
+
+class TestSharedDataFunctorPool(unittest.TestCase):
+    def setUp(self) -> None:
+        self.data = [i for i in range(1000)]
+        self.table = pickle.PickleBuffer(bytes(range(100, 200)))
+
+    def test_shared_memory(self):
+        if os.cpu_count() > 1:
+            for transport in FunctorPool.TRANSPORTS:
+                with FunctorPool([MockSharedDataWorker() for _ in range(2)], transport=transport,
+                                 shared_data={"table": self.table}) as pool:
+                    handle = pool.shared_data["table"]
+                    self.assertListEqual([100 + i % 100 for i in self.data], list(pool.imap(self.data, 10)))
+
+                with self.assertRaises(FileNotFoundError):
+                    pickle.loads(pickle.dumps(handle)).load()
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_file(self):
+        if os.cpu_count() > 1:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                with FactoryFunctorPool(2, MockSharedDataWorkerFactory(), shared_data={"table": self.table},
+                                        shared_data_dir=tmp_dir) as pool:
+                    self.assertEqual(1, len(os.listdir(tmp_dir)))
+                    self.assertListEqual([100 + i % 100 for i in self.data], list(pool.imap(self.data, 10)))
+
+                self.assertListEqual([], os.listdir(tmp_dir))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_not_entered(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pool = FunctorPool([MockSharedDataWorker() for _ in range(2)], shared_data={"table": self.table},
+                               shared_data_dir=tmp_dir)
+            self.assertDictEqual({}, pool.shared_data)
+            self.assertListEqual([], os.listdir(tmp_dir))
+
+    def test_failed_publish(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pool = FunctorPool([MockSharedDataWorker() for _ in range(2)],
+                               shared_data={"table": self.table, "unpicklable": lambda x: x}, shared_data_dir=tmp_dir)
+            with self.assertRaises(Exception):
+                with pool:
+                    ...
+            self.assertDictEqual({}, pool.shared_data)
+            self.assertListEqual([], os.listdir(tmp_dir))
+
+
 class TestFactoryFunctorPool(unittest.TestCase):
+    transport = "manager"
+
     def setUp(self) -> None:
         self.workers = 2
         self.factory = MockFunctorWorkerFactory()
@@ -299,7 +803,7 @@ class TestFactoryFunctorPool(unittest.TestCase):
     def test_init(self):
         if os.cpu_count() > 1:
 
-            with FactoryFunctorPool(self.workers, self.factory, self.context):
+            with FactoryFunctorPool(self.workers, self.factory, self.context, transport=self.transport):
                 self.assertEqual(2, len(self.factory.created_workers))
                 for i, w in enumerate(self.factory.created_workers):
                     self.assertEqual(i, w.wid)
@@ -316,7 +820,7 @@ class TestFactoryFunctorPool(unittest.TestCase):
     def test_imap(self):
         if os.cpu_count() > 1:
             data = [i for i in range(10000)]
-            with FactoryFunctorPool(self.workers, self.factory, None) as pool:
+            with FactoryFunctorPool(self.workers, self.factory, None, transport=self.transport) as pool:
                 results = list(pool.imap(data))
 
             self.assertListEqual([i * 2 for i in data], results)
@@ -332,7 +836,7 @@ class TestFactoryFunctorPool(unittest.TestCase):
             self.factory.worker_cls = MockWorkerLargeData
             data = [i for i in range(10000)]
 
-            with FactoryFunctorPool(self.workers, self.factory, self.context) as pool:
+            with FactoryFunctorPool(self.workers, self.factory, self.context, transport=self.transport) as pool:
                 results = list(x[-1] for x in pool.imap(data))
                 self.assertListEqual([i * 2 for i in data], results)
 
@@ -345,7 +849,7 @@ class TestFactoryFunctorPool(unittest.TestCase):
     def test_map_chunk_size(self):
         if os.cpu_count() > 1:
             data = [i for i in range(10000)]
-            with FactoryFunctorPool(self.workers, self.factory, self.context) as fm:
+            with FactoryFunctorPool(self.workers, self.factory, self.context, transport=self.transport) as fm:
                 results = list(fm.imap(data, chunk_size=250))
                 self.assertListEqual(results, [i * 2 for i in data])
 
@@ -359,7 +863,7 @@ class TestFactoryFunctorPool(unittest.TestCase):
         if os.cpu_count() > 1:
             data = [i for i in range(10000)]
 
-            with FactoryFunctorPool(self.workers, self.factory, self.context) as fm:
+            with FactoryFunctorPool(self.workers, self.factory, self.context, transport=self.transport) as fm:
                 results = list(fm.imap(data, chunk_size=700))
                 self.assertListEqual(results, [i * 2 for i in data])
 
@@ -375,7 +879,7 @@ class TestFactoryFunctorPool(unittest.TestCase):
             data = [i for i in range(10000)]
             self.factory.max_chunks_per_worker = 10
             self.factory.wait = 0.001
-            with FactoryFunctorPool(self.workers, self.factory, self.context) as fm:
+            with FactoryFunctorPool(self.workers, self.factory, self.context, transport=self.transport) as fm:
                 results = list(x[-1] for x in fm.imap(data, 100))
                 self.assertListEqual(results, [i * 2 for i in data])
 
@@ -389,6 +893,619 @@ class TestFactoryFunctorPool(unittest.TestCase):
         else:
             self.skipTest("This test can only be run on the multi cpu device.")
 
+    def test_replace_metrics(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            self.factory.max_chunks_per_worker = 10
+            metrics = PoolMetrics()
+            with FactoryFunctorPool(self.workers, self.factory, self.context, transport=self.transport,
+                                    metrics=metrics) as fm:
+                results = list(fm.imap(data, 10))
+                self.assertListEqual(results, [i * 2 for i in data])
+
+            self.assertGreater(metrics.snapshot()["replacements"], 0)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_replace_affinity(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            self.factory.max_chunks_per_worker = 10
+            with FactoryFunctorPool(self.workers, self.factory, self.context, transport=self.transport,
+                                    affinity=lambda x: x // 50) as fm:
+                results = list(fm.imap(data, 10))
+                self.assertListEqual(results, [i * 2 for i in data])
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_standby(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            self.factory.max_chunks_per_worker = 10
+            with FactoryFunctorPool(self.workers, self.factory, transport=self.transport, standby=2) as pool:
+                standby = list(pool._standby)
+                for w in standby:
+                    self.assertTrue(w.begin_called.wait(10))
+                self.assertListEqual([i * 2 for i in data], list(pool.imap(data, 10)))
+                for w in standby:
+                    self.assertIn(w, self.factory.created_workers)
+                    self.assertNotIn(w, pool._standby)
+
+            self.assertListEqual([], pool._standby)
+            for w in self.factory.created_workers:
+                self.assertTrue(w.end_called.is_set())
+                self.assertEqual(0, w.exitcode)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_max_rss(self):
+        if os.cpu_count() > 1:
+            for prespawn in [False, True]:
+                factory = MockLeakingWorkerFactory(resident_memory() + 20 * 2 ** 20)
+                data = [i for i in range(300)]
+                with FactoryFunctorPool(self.workers, factory, transport=self.transport, prespawn=prespawn) as pool:
+                    self.assertListEqual([i * 2 for i in data], list(pool.imap(data)))
+
+                self.assertGreater(len(factory.created_workers), self.workers)
+                self.assertListEqual([], pool._retiring)
+                for w in factory.created_workers:
+                    self.assertTrue(w.end_called.is_set())
+                    self.assertEqual(0, w.exitcode)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+
+class MockCrashingWorker(FunctorWorker):
+    def __init__(self, crash_on: int, crashed, always: bool = False):
+        super().__init__()
+        self.crash_on = crash_on
+        self.crashed = crashed
+        self.always = always
+
+    def __call__(self, inp: int) -> int:
+        if inp == self.crash_on and (self.always or not self.crashed.is_set()):
+            self.crashed.set()
+            os._exit(1)
+        return inp * 2
+
+
+class MockCrashingWorkerFactory(FunctorWorkerFactory):
+    def __init__(self, crash_on: int, always: bool = False):
+        self.crash_on = crash_on
+        self.crashed = multiprocessing.Event()
+        self.always = always
+
+    def create(self) -> BaseFunctorWorker:
+        return MockCrashingWorker(self.crash_on, self.crashed, self.always)
+
+
+class MockCountingCrashingWorker(MockCrashingWorker):
+    def __init__(self, crash_on: int, crashed, processed):
+        super().__init__(crash_on, crashed)
+        self.processed = processed
+
+    def __call__(self, inp: int) -> int:
+        res = super().__call__(inp)
+        time.sleep(0.001)  # gives the feeder thread time to send the results
+        with self.processed.get_lock():
+            self.processed.value += 1
+        return res
+
+
+class MockCountingCrashingWorkerFactory(MockCrashingWorkerFactory):
+    def __init__(self, crash_on: int):
+        super().__init__(crash_on)
+        self.processed = multiprocessing.Value("q", 0)
+
+    def create(self) -> BaseFunctorWorker:
+        return MockCountingCrashingWorker(self.crash_on, self.crashed, self.processed)
+
+
+class KillOnPutQueue:
+    """
+    Wraps results queue and kills the worker process in the middle of putting results into it.
+    """
+
+    def __init__(self, results_queue, killed):
+        self.results_queue = results_queue
+        self.killed = killed
+
+    def put(self, obj, block=True, timeout=None):
+        if not self.killed.is_set():
+            self.killed.set()
+            os.kill(os.getpid(), signal.SIGKILL)
+        self.results_queue.put(obj, block, timeout)
+
+
+class MockKilledOnPutWorker(FunctorWorker):
+    def __init__(self, killed):
+        super().__init__()
+        self.killed = killed
+
+    def begin(self):
+        self.results_queue = KillOnPutQueue(self.results_queue, self.killed)
+
+    def __call__(self, inp: int) -> int:
+        return inp * 2
+
+
+class MockKilledOnPutWorkerFactory(FunctorWorkerFactory):
+    def __init__(self):
+        self.killed = multiprocessing.Event()
+
+    def create(self) -> BaseFunctorWorker:
+        return MockKilledOnPutWorker(self.killed)
+
+
+class TestFaultTolerantFunctorPool(unittest.TestCase):
+    transport = "manager"
+
+    def test_crash_retry(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            metrics = PoolMetrics()
+            factory = MockCrashingWorkerFactory(500)
+            with FactoryFunctorPool(2, factory, transport=self.transport, metrics=metrics, max_retries=2) as pool:
+                pool.LIVENESS_INTERVAL = 0.1
+                results = list(pool.imap(data, chunk_size=10))
+
+            self.assertListEqual([i * 2 for i in data], results)
+            self.assertDictEqual({}, pool.poisoned)
+            self.assertEqual(1, metrics.snapshot()["crashes"])
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_crash_resends_only_lost_chunks(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            factory = MockCountingCrashingWorkerFactory(500)
+            with FactoryFunctorPool(2, factory, work_queue_maxsize=50, transport=self.transport,
+                                    max_retries=2) as pool:
+                pool.LIVENESS_INTERVAL = 0.1
+                results = list(pool.imap(data, chunk_size=10))
+
+            self.assertListEqual([i * 2 for i in data], results)
+            # chunks waiting in the work queue or processed by the other worker are not sent again
+            self.assertLess(factory.processed.value, len(data) + 50)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_killed_while_putting_results(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            metrics = PoolMetrics()
+            with FactoryFunctorPool(2, MockKilledOnPutWorkerFactory(), transport=self.transport, metrics=metrics,
+                                    max_retries=2) as pool:
+                pool.LIVENESS_INTERVAL = 0.1
+                results = list(pool.imap(data, chunk_size=10))
+
+            self.assertListEqual([i * 2 for i in data], results)
+            self.assertEqual(1, metrics.snapshot()["crashes"])
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_poisoned(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            factory = MockCrashingWorkerFactory(13, always=True)
+            with FactoryFunctorPool(2, factory, transport=self.transport, max_retries=1) as pool:
+                pool.LIVENESS_INTERVAL = 0.1
+                results = list(pool.imap(data, chunk_size=10))
+
+            self.assertListEqual([i * 2 for i in data if not 10 <= i < 20], results)
+            self.assertDictEqual({1: list(range(10, 20))}, pool.poisoned)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_crash_without_replacement(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            crashed = multiprocessing.Event()
+            workers = [MockCrashingWorker(500, crashed) for _ in range(2)]
+            with FunctorPool(workers, transport=self.transport, max_retries=2) as pool:
+                pool.LIVENESS_INTERVAL = 0.1
+                results = sorted(pool.imap_unordered(data, chunk_size=10))
+
+            self.assertListEqual([i * 2 for i in data], results)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_all_dead(self):
+        if os.cpu_count() > 1:
+            crashed = multiprocessing.Event()
+            workers = [MockCrashingWorker(5, crashed, always=True) for _ in range(2)]
+            with self.assertRaises(RuntimeError):
+                with FunctorPool(workers, transport=self.transport, max_retries=5) as pool:
+                    pool.LIVENESS_INTERVAL = 0.1
+                    list(pool.imap(range(10)))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+
+class TestQueueTransportFaultTolerantFunctorPool(TestFaultTolerantFunctorPool):
+    transport = "queue"
+
+
+class MockErrorWorker(FunctorWorker):
+    def __call__(self, inp: int) -> int:
+        if inp % 100 == 7:
+            raise ValueError(f"bad item {inp}")
+        return inp * 2
+
+
+class UnpicklableError(Exception):
+    def __init__(self, lock):
+        super().__init__(lock)
+        self.lock = lock
+
+
+class TestWorkerError(unittest.TestCase):
+    def test_from_exception(self):
+        try:
+            raise ValueError("bad")
+        except ValueError as e:
+            error = WorkerError.from_exception(e, 3, 5)
+
+        self.assertIsInstance(error.exception, ValueError)
+        self.assertIn("raise ValueError(\"bad\")", error.traceback)
+        self.assertEqual(3, error.chunk_index)
+        self.assertEqual(5, error.item_index)
+        self.assertIn("chunk 3 at item 5", str(error))
+
+        unpickled = pickle.loads(pickle.dumps(error))
+        self.assertIsInstance(unpickled.exception, ValueError)
+        self.assertEqual(error.traceback, unpickled.traceback)
+        self.assertEqual(3, unpickled.chunk_index)
+        self.assertEqual(5, unpickled.item_index)
+
+    def test_unpicklable(self):
+        try:
+            raise UnpicklableError(multiprocessing.Lock())
+        except UnpicklableError as e:
+            error = WorkerError.from_exception(e, 0, 0)
+
+        self.assertIsInstance(error.exception, RuntimeError)
+        self.assertIsInstance(pickle.loads(pickle.dumps(error)), WorkerError)
+
+
+class TestErrorPolicyFunctorPool(unittest.TestCase):
+    transport = "manager"
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            FunctorPool([MockErrorWorker()], error_policy="unknown")
+
+    def test_raise(self):
+        if os.cpu_count() > 1:
+            with FunctorPool([MockErrorWorker() for _ in range(2)], transport=self.transport) as pool:
+                with self.assertRaises(WorkerError) as context:
+                    list(pool.imap(range(1000), chunk_size=10))
+                self.assertIsInstance(context.exception.exception, ValueError)
+                self.assertEqual(7, context.exception.item_index)
+                self.assertIn("ValueError", context.exception.traceback)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_skip(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            metrics = PoolMetrics()
+            with FunctorPool([MockErrorWorker() for _ in range(2)], transport=self.transport, error_policy="skip",
+                             metrics=metrics) as pool:
+                results = list(pool.imap(data, chunk_size=10))
+
+            self.assertListEqual([i * 2 for i in data if i % 100 != 7], results)
+            self.assertEqual(10, metrics.snapshot()["errors"])
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_sentinel(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            with FunctorPool([MockErrorWorker() for _ in range(2)], transport=self.transport,
+                             error_policy="sentinel") as pool:
+                results = list(pool.imap(data, chunk_size=10))
+
+            self.assertEqual(len(data), len(results))
+            for i, r in zip(data, results):
+                if i % 100 == 7:
+                    self.assertIsInstance(r, WorkerError)
+                    self.assertEqual(i // 10, r.chunk_index)
+                    self.assertEqual(7, r.item_index)
+                else:
+                    self.assertEqual(i * 2, r)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+
+class TestQueueTransportErrorPolicyFunctorPool(TestErrorPolicyFunctorPool):
+    transport = "queue"
+
+
+async def async_range(n: int):
+    for i in range(n):
+        await asyncio.sleep(0)
+        yield i
+
+
+class TestAsyncFunctorPool(unittest.IsolatedAsyncioTestCase):
+    transport = "manager"
+
+    def setUp(self) -> None:
+        if os.cpu_count() <= 1:
+            self.skipTest("This test can only be run on the multi cpu device.")
+        self.data = [i for i in range(1000)]
+
+    async def test_aimap(self):
+        with FunctorPool([MockWorker() for _ in range(2)], transport=self.transport) as pool:
+            results = [x async for x in pool.aimap(self.data, chunk_size=10)]
+        self.assertListEqual([i * 2 for i in self.data], results)
+
+    async def test_aimap_async_iterable(self):
+        with FunctorPool([MockWorker() for _ in range(2)], transport=self.transport) as pool:
+            results = [x async for x in pool.aimap(async_range(len(self.data)), chunk_size=10, max_pending=5)]
+        self.assertListEqual([i * 2 for i in self.data], results)
+
+    async def test_aimap_unordered(self):
+        with FunctorPool([MockWorker() for _ in range(2)], transport=self.transport) as pool:
+            results = [x async for x in pool.aimap_unordered(async_range(len(self.data)), chunk_size=10)]
+        self.assertListEqual([i * 2 for i in self.data], sorted(results))
+
+    async def test_aimap_does_not_block_loop(self):
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker_task = asyncio.create_task(ticker())
+        with FunctorPool([MockWorker(wait=0.01) for _ in range(2)], transport=self.transport) as pool:
+            results = [x async for x in pool.aimap(range(50))]
+        ticker_task.cancel()
+
+        self.assertListEqual([i * 2 for i in range(50)], results)
+        self.assertGreater(ticks, 5)
+
+    async def test_aimap_error(self):
+        with FunctorPool([MockErrorWorker() for _ in range(2)], transport=self.transport) as pool:
+            with self.assertRaises(WorkerError):
+                [x async for x in pool.aimap(async_range(100), chunk_size=10)]
+
+    async def test_aimap_factory(self):
+        with FactoryFunctorPool(2, MockFunctorWorkerFactory(), transport=self.transport) as pool:
+            results = [x async for x in pool.aimap(self.data, chunk_size=10)]
+        self.assertListEqual([i * 2 for i in self.data], results)
+
+
+class TestQueueTransportAsyncFunctorPool(TestAsyncFunctorPool):
+    transport = "queue"
+
+
+class MockAddWorker(FunctorWorker):
+    def __init__(self, add: int, wait: Optional[float] = None):
+        super().__init__()
+        self.add = add
+        self.wait = wait
+
+    def __call__(self, inp: int) -> int:
+        if self.wait is not None:
+            time.sleep(self.wait)
+        return inp + self.add
+
+
+class TestFunctorPipeline(unittest.TestCase):
+    transport = "manager"
+
+    def setUp(self) -> None:
+        self.data = [i for i in range(1000)]
+
+    def test_invalid_stages(self):
+        with self.assertRaises(ValueError):
+            FunctorPipeline([])
+        with self.assertRaises(ValueError):
+            FunctorPipeline([[MockWorker()], []])
+
+    def test_queues(self):
+        stages = [[MockWorker() for _ in range(2)], [MockAddWorker(1) for _ in range(3)], [MockAddWorker(2)]]
+        pipeline = FunctorPipeline(stages, transport=self.transport, stage_queue_maxsize=2.0)
+
+        for p in stages[0]:
+            self.assertIs(pipeline._work_queue, p.work_queue)
+            self.assertIs(pipeline._stage_queues[0], p.results_queue)
+        for p in stages[1]:
+            self.assertIs(pipeline._stage_queues[0], p.work_queue)
+            self.assertIs(pipeline._stage_queues[1], p.results_queue)
+        self.assertIs(pipeline._stage_queues[1], stages[2][0].work_queue)
+        self.assertIs(pipeline._results_queue, stages[2][0].results_queue)
+
+    def test_imap(self):
+        if os.cpu_count() > 1:
+            stages = [[MockWorker() for _ in range(2)], [MockAddWorker(1, wait=0.0001) for _ in range(3)],
+                      [MockAddWorker(2)]]
+            with FunctorPipeline(stages, transport=self.transport) as pipeline:
+                self.assertListEqual([i * 2 + 3 for i in self.data], list(pipeline.imap(self.data, chunk_size=10)))
+                # could be used again
+                self.assertListEqual([i * 2 + 3 for i in range(10)], list(pipeline.imap(range(10))))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_imap_unordered(self):
+        if os.cpu_count() > 1:
+            stages = [[MockWorker() for _ in range(2)], [MockAddWorker(1) for _ in range(2)]]
+            with FunctorPipeline(stages, transport=self.transport) as pipeline:
+                results = list(pipeline.imap_unordered(self.data, chunk_size=10))
+            self.assertListEqual([i * 2 + 1 for i in self.data], sorted(results))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_single_stage(self):
+        if os.cpu_count() > 1:
+            with FunctorPipeline([[MockWorker() for _ in range(2)]], transport=self.transport) as pipeline:
+                self.assertListEqual([i * 2 for i in self.data], list(pipeline.imap(self.data, chunk_size=10)))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_only_last_stage_reports(self):
+        if os.cpu_count() > 1:
+            metrics = PoolMetrics()
+            stages = [[MockWorker() for _ in range(2)], [MockAddWorker(1) for _ in range(2)]]
+            with FunctorPipeline(stages, transport=self.transport, metrics=metrics) as pipeline:
+                list(pipeline.imap(self.data, chunk_size=10))
+
+            self.assertSetEqual({p.wid for p in stages[1]} & set(metrics.workers), set(metrics.workers))
+            self.assertEqual(len(self.data), metrics.snapshot()["items_received"])
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_shared_memory(self):
+        if os.cpu_count() > 1:
+            stages = [[MockWorker() for _ in range(2)], [MockAddWorker(1) for _ in range(2)]]
+            with FunctorPipeline(stages, transport=self.transport, shared_memory_threshold=0) as pipeline:
+                self.assertListEqual([i * 2 + 1 for i in self.data], list(pipeline.imap(self.data, chunk_size=10)))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_errors(self):
+        if os.cpu_count() > 1:
+            stages = [[MockErrorWorker() for _ in range(2)], [MockAddWorker(1) for _ in range(2)]]
+            with FunctorPipeline(stages, transport=self.transport, error_policy="sentinel") as pipeline:
+                results = list(pipeline.imap(self.data, chunk_size=10))
+
+            for i, r in zip(self.data, results):
+                if i % 100 == 7:
+                    self.assertIsInstance(r, WorkerError)
+                else:
+                    self.assertEqual(i * 2 + 1, r)
+
+            stages = [[MockErrorWorker() for _ in range(2)], [MockAddWorker(1) for _ in range(2)]]
+            with FunctorPipeline(stages, transport=self.transport) as pipeline:
+                with self.assertRaises(WorkerError):
+                    list(pipeline.imap(self.data, chunk_size=10))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+
+class TestQueueTransportFunctorPipeline(TestFunctorPipeline):
+    transport = "queue"
+
+
+class TestQueueTransportFactoryFunctorPool(TestFactoryFunctorPool):
+    transport = "queue"
+
+
+class TestPriorityScheduler(unittest.TestCase):
+    """
+    Uses thread backend, so it does not need multiple cpus.
+    """
+
+    def test_submit(self):
+        with FunctorPool([MockWorker() for _ in range(2)], backend="thread") as pool, \
+                PriorityScheduler(pool) as scheduler:
+            futures = [scheduler.submit(i, priority=i % 3) for i in range(100)]
+            self.assertListEqual([i * 2 for i in range(100)], [f.result() for f in futures])
+
+    def test_priority_order(self):
+        order = []
+        with FunctorPool([MockWorker()], work_queue_maxsize=1, backend="thread") as pool:
+            scheduler = PriorityScheduler(pool)
+            futures = [scheduler.submit(i, priority=10) for i in range(10)]
+            futures += [scheduler.submit(i, priority=0) for i in range(100, 103)]
+            futures.append(scheduler.submit(50, priority=5))
+            for f in futures:
+                f.add_done_callback(lambda f: order.append(f.result()))
+            with scheduler:
+                ...
+
+        self.assertListEqual([200, 202, 204, 100] + [i * 2 for i in range(10)], order)
+
+    def test_deadline(self):
+        metrics = PoolMetrics()
+        with FunctorPool([MockWorker()], backend="thread", metrics=metrics) as pool:
+            scheduler = PriorityScheduler(pool)
+            expired = scheduler.submit(1, priority=0, deadline=time.monotonic() - 1)
+            in_time = scheduler.submit(2, priority=0, deadline=time.monotonic() + 60)
+            bulk = scheduler.submit(3, priority=10)
+            with scheduler:
+                ...
+
+        with self.assertRaises(DeadlineExpiredError):
+            expired.result()
+        self.assertEqual(4, in_time.result())
+        self.assertEqual(6, bulk.result())
+
+        snapshot = metrics.snapshot()
+        self.assertDictEqual({0: 1}, snapshot["priority_dropped"])
+        self.assertEqual(1, snapshot["priority_wait"][0]["count"])
+        self.assertEqual(1, snapshot["priority_wait"][10]["count"])
+
+    def test_cancel(self):
+        with FunctorPool([MockWorker()], backend="thread") as pool:
+            scheduler = PriorityScheduler(pool)
+            cancelled = scheduler.submit(1)
+            other = scheduler.submit(2)
+            self.assertTrue(cancelled.cancel())
+            with scheduler:
+                ...
+
+        self.assertTrue(cancelled.cancelled())
+        self.assertEqual(4, other.result())
+
+    def test_sentinel(self):
+        with FunctorPool([MockErrorWorker() for _ in range(2)], backend="thread", error_policy="sentinel") as pool, \
+                PriorityScheduler(pool) as scheduler:
+            futures = [scheduler.submit(i) for i in range(20)]
+            with self.assertRaises(WorkerError) as context:
+                futures[7].result()
+            self.assertIsInstance(context.exception.exception, ValueError)
+            self.assertListEqual([i * 2 for i in range(20) if i != 7],
+                                 [f.result() for i, f in enumerate(futures) if i != 7])
+
+    def test_skip(self):
+        with FunctorPool([MockErrorWorker() for _ in range(2)], backend="thread", error_policy="skip") as pool, \
+                PriorityScheduler(pool) as scheduler:
+            futures = [scheduler.submit(i) for i in range(20)]
+            with self.assertRaises(RuntimeError):
+                futures[7].result()
+            self.assertEqual(16, futures[8].result())
+
+    def test_raise(self):
+        with FunctorPool([MockErrorWorker() for _ in range(2)], backend="thread") as pool, \
+                PriorityScheduler(pool) as scheduler:
+            futures = [scheduler.submit(i) for i in range(20)]
+            with self.assertRaises(WorkerError):
+                futures[7].result()
+
+        for f in futures:
+            self.assertTrue(f.done())
+        with self.assertRaises(RuntimeError):
+            scheduler.submit(1)
+
+    def test_closed(self):
+        with FunctorPool([MockWorker()], backend="thread") as pool:
+            with PriorityScheduler(pool) as scheduler:
+                f = scheduler.submit(1)
+            self.assertEqual(2, f.result())
+            with self.assertRaises(RuntimeError):
+                scheduler.submit(1)
+
+    def test_factory_replacement(self):
+        factory = MockFunctorWorkerFactory(max_chunks_per_worker=10)
+        with FactoryFunctorPool(2, factory, backend="thread") as pool, PriorityScheduler(pool) as scheduler:
+            futures = [scheduler.submit(i, priority=i % 3) for i in range(100)]
+            self.assertListEqual([i * 2 for i in range(100)], [f.result(timeout=60) for f in futures])
+        self.assertGreater(len(factory.created_workers), 2)
+
+    def test_process(self):
+        if os.cpu_count() > 1:
+            with FunctorPool([MockWorker() for _ in range(2)], transport="queue") as pool, \
+                    PriorityScheduler(pool) as scheduler:
+                futures = [scheduler.submit(i, priority=-i) for i in range(100)]
+                self.assertListEqual([i * 2 for i in range(100)], [f.result() for f in futures])
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,41 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+
+:author:     Martin Dočekal
+"""
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from windpyutils.parallel.backends import is_free_threaded, resolve_backend
+
+
+class TestBackends(unittest.TestCase):
+
+    def test_is_free_threaded(self):
+        with mock.patch.object(sys, "_is_gil_enabled", lambda: False, create=True):
+            self.assertTrue(is_free_threaded())
+        with mock.patch.object(sys, "_is_gil_enabled", lambda: True, create=True):
+            self.assertFalse(is_free_threaded())
+
+    def test_without_gil_check(self):
+        with mock.patch("windpyutils.parallel.backends.sys", SimpleNamespace()):
+            self.assertFalse(is_free_threaded())
+
+    def test_resolve_backend(self):
+        self.assertEqual("process", resolve_backend("process"))
+        self.assertEqual("thread", resolve_backend("thread"))
+        with mock.patch.object(sys, "_is_gil_enabled", lambda: False, create=True):
+            self.assertEqual("thread", resolve_backend("auto"))
+        with mock.patch.object(sys, "_is_gil_enabled", lambda: True, create=True):
+            self.assertEqual("process", resolve_backend("auto"))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            resolve_backend("unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+
+:author:     Martin Dočekal
+"""
+import unittest
+
+from windpyutils.parallel.chunks import AdaptiveChunkSize, chunking
+
+
+class TestAdaptiveChunkSize(unittest.TestCase):
+
+    def test_init(self):
+        self.assertEqual(1, AdaptiveChunkSize().size)
+        self.assertEqual(10, AdaptiveChunkSize(initial_size=10).size)
+        self.assertEqual(5, AdaptiveChunkSize(initial_size=10, max_size=5).size)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            AdaptiveChunkSize(target_time=0)
+        with self.assertRaises(ValueError):
+            AdaptiveChunkSize(min_size=0)
+        with self.assertRaises(ValueError):
+            AdaptiveChunkSize(min_size=10, max_size=5)
+        with self.assertRaises(ValueError):
+            AdaptiveChunkSize(max_growth=1)
+        with self.assertRaises(ValueError):
+            AdaptiveChunkSize(smoothing=0)
+
+    def test_grow(self):
+        chunk_size = AdaptiveChunkSize(target_time=0.1)
+        chunk_size.update(1, 0.01)
+        self.assertEqual(2, chunk_size.size)
+        chunk_size.update(2, 0.02)
+        self.assertEqual(4, chunk_size.size)
+        chunk_size.update(4, 0.04)
+        self.assertEqual(8, chunk_size.size)
+        chunk_size.update(8, 0.08)
+        self.assertEqual(10, chunk_size.size)
+        chunk_size.update(10, 0.1)
+        self.assertEqual(10, chunk_size.size)
+
+    def test_shrink(self):
+        chunk_size = AdaptiveChunkSize(target_time=0.1, initial_size=100)
+        chunk_size.update(100, 10)
+        self.assertEqual(50, chunk_size.size)
+        chunk_size.update(50, 5)
+        self.assertEqual(25, chunk_size.size)
+
+    def test_limits(self):
+        chunk_size = AdaptiveChunkSize(target_time=0.1, initial_size=4, min_size=3, max_size=6)
+        chunk_size.update(4, 0)
+        self.assertEqual(6, chunk_size.size)
+        chunk_size.update(6, 60)
+        self.assertEqual(3, chunk_size.size)
+
+    def test_waiting_workers(self):
+        chunk_size = AdaptiveChunkSize(target_time=0.1, initial_size=10)
+        chunk_size.update(10, 0.1, wait_time=0.5)
+        self.assertEqual(20, chunk_size.size)
+
+    def test_empty_chunk(self):
+        chunk_size = AdaptiveChunkSize(initial_size=10)
+        chunk_size.update(0, 1)
+        self.assertEqual(10, chunk_size.size)
+
+
+class TestChunking(unittest.TestCase):
+
+    def test_fixed(self):
+        self.assertListEqual([[0, 1, 2], [3, 4, 5], [6]], list(chunking(range(7), 3)))
+        self.assertListEqual([], list(chunking([], 3)))
+
+    def test_key(self):
+        self.assertListEqual(
+            [[0, 2], [1, 3, 5], [7, 9], [4]],
+            list(chunking([0, 2, 1, 3, 5, 7, 9, 4], 3, key=lambda x: x % 2))
+        )
+
+    def test_adaptive(self):
+        chunk_size = AdaptiveChunkSize(initial_size=2)
+        chunks = []
+        for ch in chunking(range(10), chunk_size):
+            chunks.append(ch)
+            chunk_size.size += 1
+
+        self.assertListEqual([[0, 1], [2, 3, 4], [5, 6, 7, 8], [9]], chunks)
+
+
+if __name__ == '__main__':
+    unittest.main()
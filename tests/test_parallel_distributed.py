@@ -0,0 +1,225 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+
+:author:     Martin Dočekal
+"""
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import unittest
+from typing import List, Optional, Tuple
+
+from windpyutils.parallel.distributed import DistributedFunctorPool, WorkerAgent, WorkBroker, _broker_dict
+from windpyutils.parallel.own_proc_pools import FunctorWorker, FunctorWorkerFactory, BaseFunctorWorker, WorkerError
+from windpyutils.parallel.pool_metrics import PoolMetrics
+from windpyutils.parallel.serializers import PickleSerializer
+
+AUTHKEY = b"test"
+
+
+class MockWorker(FunctorWorker):
+    def __init__(self, wait: Optional[float] = None, kill_agent: bool = False,
+                 max_chunks_per_worker: float = float("inf")):
+        super().__init__(max_chunks_per_worker)
+        self.wait = wait
+        self.kill_agent = kill_agent
+
+    def __call__(self, inp: int) -> int:
+        if self.kill_agent:
+            os.kill(os.getppid(), signal.SIGKILL)
+            os._exit(1)
+        if self.wait is not None:
+            time.sleep(self.wait)
+        if inp < 0:
+            raise ValueError("negative")
+        return inp * 2
+
+
+class MockWorkerFactory(FunctorWorkerFactory):
+    def __init__(self, wait: Optional[float] = None, kill_agent: bool = False,
+                 max_chunks_per_worker: float = float("inf")):
+        self.wait = wait
+        self.kill_agent = kill_agent
+        self.max_chunks_per_worker = max_chunks_per_worker
+
+    def create(self) -> BaseFunctorWorker:
+        return MockWorker(self.wait, self.kill_agent, self.max_chunks_per_worker)
+
+
+def run_agent(address: Tuple[str, int], factory: FunctorWorkerFactory, workers: int, results, **kwargs):
+    results.put(WorkerAgent(address, AUTHKEY, factory, workers, heartbeat_interval=0.1, reconnect_interval=0.1,
+                            **kwargs).run())
+
+
+def serve_ready_broker(address: Tuple[str, int]):
+    _broker_dict("config")["ready"] = True
+    WorkBroker(address, AUTHKEY).get_server().serve_forever()
+
+
+class LocalAgents:
+    """
+    Harness that runs agents in processes on localhost.
+    """
+
+    def __init__(self, address: Tuple[str, int], agents: int = 2, workers: int = 2,
+                 factory: Optional[FunctorWorkerFactory] = None, **kwargs):
+        self.results = multiprocessing.Queue()
+        self.procs = [
+            multiprocessing.Process(target=run_agent,
+                                    args=(address, MockWorkerFactory() if factory is None else factory, workers,
+                                          self.results),
+                                    kwargs=kwargs)
+            for _ in range(agents)
+        ]
+
+    def __enter__(self) -> "LocalAgents":
+        for p in self.procs:
+            p.start()
+        return self
+
+    def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
+        for p in self.procs:
+            p.join(timeout=30)
+            if p.exitcode is None:
+                p.kill()
+                p.join()
+
+    def served(self) -> List[int]:
+        """
+        Number of served pools of agents that finished.
+        """
+        return [self.results.get(timeout=30) for p in self.procs if p.exitcode == 0]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TestDistributedFunctorPool(unittest.TestCase):
+
+    def test_imap(self):
+        if os.cpu_count() > 1:
+            data = list(range(1000))
+            metrics = PoolMetrics()
+            address = ("127.0.0.1", free_port())
+            # slow workers, so every one of them gets some chunks
+            with LocalAgents(address, factory=MockWorkerFactory(wait=0.001)) as agents:
+                with DistributedFunctorPool(address, AUTHKEY, metrics=metrics) as pool:
+                    self.assertTrue(pool.wait_for_workers(4, timeout=30))
+                    self.assertListEqual([x * 2 for x in data], list(pool.imap(data, chunk_size=10)))
+                    self.assertListEqual([x * 2 for x in data], sorted(pool.imap_unordered(data, chunk_size=10)))
+
+            self.assertListEqual([1, 1], agents.served())
+            self.assertEqual(4, len(metrics.snapshot()["workers"]))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_error_policy(self):
+        if os.cpu_count() > 1:
+            address = ("127.0.0.1", free_port())
+            with LocalAgents(address, agents=1):
+                with DistributedFunctorPool(address, AUTHKEY, error_policy="sentinel") as pool:
+                    results = list(pool.imap([1, -1, 2]))
+
+            self.assertEqual(2, results[0])
+            self.assertIsInstance(results[1], WorkerError)
+            self.assertEqual(4, results[2])
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_serializer(self):
+        if os.cpu_count() > 1:
+            address = ("127.0.0.1", free_port())
+            with LocalAgents(address, agents=1):
+                with DistributedFunctorPool(address, AUTHKEY, serializer=PickleSerializer()) as pool:
+                    self.assertListEqual([x * 2 for x in range(100)], list(pool.imap(range(100), chunk_size=10)))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_agent_before_broker(self):
+        if os.cpu_count() > 1:
+            address = ("127.0.0.1", free_port())
+            with LocalAgents(address, agents=1) as agents:
+                time.sleep(0.5)
+                with DistributedFunctorPool(address, AUTHKEY) as pool:
+                    self.assertListEqual([x * 2 for x in range(100)], list(pool.imap(range(100))))
+
+            self.assertListEqual([1], agents.served())
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_persistent_agent(self):
+        if os.cpu_count() > 1:
+            address = ("127.0.0.1", free_port())
+            with LocalAgents(address, agents=1, persistent=True, reconnect_timeout=2) as agents:
+                for _ in range(2):
+                    with DistributedFunctorPool(address, AUTHKEY) as pool:
+                        self.assertListEqual([x * 2 for x in range(100)], list(pool.imap(range(100))))
+
+            self.assertListEqual([2], agents.served())
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_connect_to_restarted_broker(self):
+        # proxies share one connection per broker address and thread, the agent relies on it being closed when
+        # all proxies of the lost broker are released
+        if os.cpu_count() > 1:
+            address = ("127.0.0.1", free_port())
+            agent = WorkerAgent(address, AUTHKEY, MockWorkerFactory(), 1, reconnect_interval=0.1, reconnect_timeout=10)
+            for _ in range(2):
+                broker = multiprocessing.get_context("spawn").Process(target=serve_ready_broker, args=(address,))
+                broker.start()
+                try:
+                    connection = agent._connect()
+                    self.assertIsNotNone(connection)
+                    self.assertTrue(connection[1]["ready"])
+                    del connection
+                finally:
+                    broker.kill()
+                    broker.join()
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_reconnect_timeout(self):
+        agent = WorkerAgent(("127.0.0.1", free_port()), AUTHKEY, MockWorkerFactory(), 1, reconnect_interval=0.1,
+                            reconnect_timeout=0.3)
+        self.assertEqual(0, agent.run())
+
+    def test_dead_agent(self):
+        if os.cpu_count() > 1:
+            data = list(range(200))
+            metrics = PoolMetrics()
+            address = ("127.0.0.1", free_port())
+            with LocalAgents(address, agents=1, workers=1, factory=MockWorkerFactory(kill_agent=True)), \
+                    LocalAgents(address, agents=1, factory=MockWorkerFactory(wait=0.01)):
+                with DistributedFunctorPool(address, AUTHKEY, metrics=metrics, max_retries=1,
+                                            agent_timeout=1) as pool:
+                    pool.LIVENESS_INTERVAL = 0.1
+                    self.assertTrue(pool.wait_for_workers(3, timeout=30))
+                    self.assertListEqual([x * 2 for x in data], list(pool.imap(data, chunk_size=10)))
+
+            self.assertDictEqual({}, pool.poisoned)
+            self.assertGreaterEqual(metrics.snapshot()["crashes"], 1)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_replace_workers(self):
+        if os.cpu_count() > 1:
+            data = list(range(100))
+            address = ("127.0.0.1", free_port())
+            with LocalAgents(address, agents=1, factory=MockWorkerFactory(max_chunks_per_worker=2)) as agents:
+                with DistributedFunctorPool(address, AUTHKEY) as pool:
+                    self.assertListEqual([x * 2 for x in data], list(pool.imap(data, chunk_size=10)))
+
+            self.assertListEqual([1], agents.served())
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+
+if __name__ == '__main__':
+    unittest.main()
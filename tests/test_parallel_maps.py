@@ -4,10 +4,17 @@ Created on 23.09.20
 
 :author:     Martin Dočekal
 """
+import itertools
 import os
 import unittest
 
-from windpyutils.parallel.maps import mul_p_map
+from windpyutils.parallel import maps
+from windpyutils.parallel.maps import mul_p_map, mul_p_imap, close_persistent_pools
+from windpyutils.parallel.serializers import PickleSerializer
+
+
+def double(x: int) -> int:
+    return x * 2
 
 
 class TestMulPMap(unittest.TestCase):
@@ -30,6 +37,99 @@ class TestMulPMap(unittest.TestCase):
         else:
             self.skipTest("This test can only be run on the multi cpu device.")
 
+    def test_mul_pmap_thread(self):
+        data = [i for i in range(1000)]
+        self.assertListEqual([i * 2 for i in data], mul_p_map(lambda x: x * 2, data, 2, backend="thread"))
+
+    def test_mul_pmap_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            mul_p_map(lambda x: x * 2, [1], 2, backend="unknown")
+
+    def test_mul_pmap_chunk_size(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            self.assertListEqual([i * 2 for i in data], mul_p_map(lambda x: x * 2, data, 2, chunk_size=100))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_mul_pmap_serializer(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            self.assertListEqual([i * 2 for i in data],
+                                 mul_p_map(double, data, 2, chunk_size=10, serializer=PickleSerializer()))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+
+class TestMulPIMap(unittest.TestCase):
+    def tearDown(self) -> None:
+        close_persistent_pools()
+
+    def test_streaming(self):
+        results = mul_p_imap(double, iter(range(1000)), 2, chunk_size=10, backend="thread")
+        self.assertNotIsInstance(results, list)
+        self.assertListEqual([i * 2 for i in range(1000)], list(results))
+
+    def test_infinite(self):
+        results = mul_p_imap(double, itertools.count(), 2, chunk_size=10, backend="thread", max_in_flight=2)
+        self.assertListEqual([i * 2 for i in range(1000)], list(itertools.islice(results, 1000)))
+        results.close()
+
+    def test_persistent(self):
+        for backend in ["thread", "process"] if os.cpu_count() > 1 else ["thread"]:
+            self.assertListEqual([i * 2 for i in range(100)], mul_p_map(double, range(100), 2, backend=backend,
+                                                                        persistent=True))
+            fm = maps._persistent_pools[(double, 2, backend)]
+            self.assertListEqual([i * 2 for i in range(50)], mul_p_map(double, range(50), 2, backend=backend,
+                                                                       persistent=True))
+            self.assertIs(fm, maps._persistent_pools[(double, 2, backend)])
+
+        close_persistent_pools()
+        self.assertDictEqual({}, maps._persistent_pools)
+
+    def test_persistent_abandoned(self):
+        results = mul_p_imap(double, range(1000), 2, chunk_size=10, backend="thread", persistent=True)
+        self.assertEqual(0, next(results))
+        fm = maps._persistent_pools[(double, 2, "thread")]
+        results.close()
+
+        # results of the abandoned call are dropped
+        self.assertListEqual([i * 2 for i in range(100)], mul_p_map(double, range(100), 2, backend="thread",
+                                                                    persistent=True))
+        self.assertIs(fm, maps._persistent_pools[(double, 2, "thread")])
+
+    def test_persistent_in_use(self):
+        results = mul_p_imap(double, range(100), 2, backend="thread", persistent=True)
+        self.assertEqual(0, next(results))
+        # the persistent pool is shared by both calls
+        self.assertListEqual([i * 2 for i in range(100)], mul_p_map(double, range(100), 2, backend="thread",
+                                                                    persistent=True))
+        self.assertListEqual([i * 2 for i in range(1, 100)], list(results))
+        self.assertEqual(1, len(maps._persistent_pools))
+
+    def test_persistent_evicted(self):
+        close_persistent_pools()
+        results = mul_p_imap(double, range(100), 2, backend="thread", persistent=True)
+        self.assertEqual(0, next(results))
+        in_use = maps._persistent_pools[(double, 2, "thread")]
+
+        pools = []
+        for i in range(maps.MAX_PERSISTENT_POOLS + 2):
+            self.assertListEqual([i] * 10, mul_p_map(lambda x: i, range(10), 2, backend="thread", persistent=True))
+            pools.append(next(reversed(maps._persistent_pools.values())))
+
+        self.assertEqual(maps.MAX_PERSISTENT_POOLS, len(maps._persistent_pools))
+        # the pool in use is kept and the least recently used ones are stopped
+        self.assertIn(in_use, maps._persistent_pools.values())
+        for fm in pools[:3]:
+            self.assertNotIn(fm, maps._persistent_pools.values())
+            self.assertFalse(any(p.is_alive() for p in fm.procs))
+        for fm in pools[3:]:
+            self.assertIn(fm, maps._persistent_pools.values())
+
+        self.assertListEqual([i * 2 for i in range(1, 100)], list(results))
+        close_persistent_pools()
+
 
 if __name__ == '__main__':
     unittest.main()
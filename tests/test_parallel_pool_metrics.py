@@ -0,0 +1,148 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+
+:author:     Martin Dočekal
+"""
+import unittest
+
+from windpyutils.parallel.pool_metrics import Histogram, PoolMetrics
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        h = Histogram()
+        self.assertEqual(0, h.count)
+        self.assertIsNone(h.mean)
+        self.assertIsNone(h.quantile(0.5))
+        self.assertDictEqual({
+            "count": 0, "sum": 0.0, "min": None, "max": None, "mean": None, "p50": None, "p90": None, "p99": None
+        }, h.to_dict())
+
+    def test_observe(self):
+        h = Histogram()
+        for v in [0.001, 0.002, 0.003, 1.0]:
+            h.observe(v)
+
+        self.assertEqual(4, h.count)
+        self.assertAlmostEqual(1.006, h.sum)
+        self.assertEqual(0.001, h.min)
+        self.assertEqual(1.0, h.max)
+        self.assertAlmostEqual(1.006 / 4, h.mean)
+
+    def test_quantile(self):
+        h = Histogram()
+        for _ in range(99):
+            h.observe(0.001)
+        h.observe(10.0)
+
+        self.assertGreaterEqual(h.quantile(0.5), 0.001)
+        self.assertLess(h.quantile(0.5), 0.002)
+        self.assertLess(h.quantile(0.99), 0.002)
+        self.assertEqual(10.0, h.quantile(1.0))
+
+    def test_quantile_over_bounds(self):
+        h = Histogram()
+        h.observe(5000.0)
+        self.assertEqual(5000.0, h.quantile(0.5))
+
+
+class TestPoolMetrics(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.metrics = PoolMetrics()
+
+    def test_chunks(self):
+        self.metrics.chunk_sent(10, 0.5)
+        self.metrics.chunk_sent(5, 0.25)
+        self.metrics.chunk_received(0, 10, 1.0, 0.1, 0.0, 2.0)
+        self.metrics.chunk_received(1, 5, 0.5, 0.2, 0.3, stolen=True)
+
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(2, snapshot["chunks_sent"])
+        self.assertEqual(15, snapshot["items_sent"])
+        self.assertEqual(0.75, snapshot["send_blocked_time"])
+        self.assertEqual(2, snapshot["chunks_received"])
+        self.assertEqual(15, snapshot["items_received"])
+        self.assertEqual(2, snapshot["compute"]["count"])
+        self.assertEqual(1.5, snapshot["compute"]["sum"])
+
+        self.assertEqual(2.0, snapshot["workers"][0]["begin_time"])
+        self.assertIsNone(snapshot["workers"][1]["begin_time"])
+        self.assertEqual(10, snapshot["workers"][0]["items"])
+        self.assertEqual(0.3, snapshot["workers"][1]["blocked_time"])
+        self.assertIsNotNone(snapshot["workers"][1]["last_report"])
+        self.assertEqual(1, snapshot["stolen_chunks"])
+        self.assertEqual(0, snapshot["workers"][0]["stolen"])
+        self.assertEqual(1, snapshot["workers"][1]["stolen"])
+
+    def test_pauses(self):
+        self.metrics.paused()
+        self.metrics.paused()
+        self.metrics.resumed()
+        self.metrics.resumed()
+        self.metrics.paused()
+
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(2, snapshot["pauses"])
+        self.assertGreaterEqual(snapshot["paused_time"], 0)
+
+    def test_buffered_replaced_crashed(self):
+        self.metrics.buffered(3)
+        self.metrics.buffered(1)
+        self.metrics.replaced(0)
+        self.metrics.replaced(1)
+        self.metrics.crashed(1)
+        self.metrics.errored(0)
+        self.metrics.errored(3)
+
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(3, snapshot["max_buffered_chunks"])
+        self.assertEqual(2, snapshot["replacements"])
+        self.assertEqual(1, snapshot["crashes"])
+        self.assertEqual(3, snapshot["errors"])
+        self.assertEqual(1, snapshot["workers"][0]["replacements"])
+        self.assertEqual(0, snapshot["workers"][0]["crashes"])
+        self.assertEqual(1, snapshot["workers"][1]["replacements"])
+        self.assertEqual(1, snapshot["workers"][1]["crashes"])
+
+    def test_priorities(self):
+        self.metrics.dispatched(0, 0.5)
+        self.metrics.dispatched(0, 1.5)
+        self.metrics.dispatched(10, 2.0)
+        self.metrics.dropped(10)
+        self.metrics.dropped(10)
+
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(2, snapshot["priority_wait"][0]["count"])
+        self.assertEqual(2.0, snapshot["priority_wait"][0]["sum"])
+        self.assertEqual(1, snapshot["priority_wait"][10]["count"])
+        self.assertDictEqual({10: 2}, snapshot["priority_dropped"])
+
+    def test_stragglers(self):
+        self.assertListEqual([], self.metrics.stragglers())
+        for wid in range(4):
+            self.metrics.chunk_received(wid, 10, 1.0, 0.0, 0.0)
+        self.metrics.chunk_received(4, 10, 5.0, 0.0, 0.0)
+
+        self.assertListEqual([4], self.metrics.stragglers())
+        self.assertListEqual([], self.metrics.stragglers(10))
+
+    def test_callback(self):
+        snapshots = []
+        metrics = PoolMetrics(callback=snapshots.append, interval=0.01)
+        metrics.start()
+        metrics.chunk_received(0, 10, 1.0, 0.0, 0.0)
+        metrics.stop()
+
+        self.assertGreater(len(snapshots), 0)
+        self.assertEqual(10, snapshots[-1]["items_received"])
+
+    def test_without_callback(self):
+        self.metrics.start()
+        self.metrics.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
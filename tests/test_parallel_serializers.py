@@ -0,0 +1,114 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+
+:author:     Martin Dočekal
+"""
+import json
+import os
+import pickle
+import unittest
+
+from windpyutils.parallel import serializers
+from windpyutils.parallel.serializers import SerializedChunk, PickleSerializer, MsgpackSerializer, CodecSerializer
+
+
+def json_encode(chunk):
+    return json.dumps(chunk).encode()
+
+
+class TestSerializedChunk(unittest.TestCase):
+    def test_pickle(self):
+        chunk = SerializedChunk([b"abc", memoryview(b"def")])
+        unpickled = pickle.loads(pickle.dumps(chunk))
+        self.assertListEqual([b"abc", b"def"], unpickled.frames)
+        for f in unpickled.frames:
+            self.assertIsInstance(f, bytes)
+
+    def test_pickle_below_shared_memory_threshold(self):
+        chunk = SerializedChunk([b"abc", memoryview(b"def")], shared_memory_threshold=4)
+        unpickled = pickle.loads(pickle.dumps(chunk))
+        self.assertListEqual([b"abc", b"def"], unpickled.frames)
+
+    @unittest.skipIf(os.name == "nt", "shared memory segments are not persistent on Windows")
+    def test_pickle_shared_memory(self):
+        chunk = SerializedChunk([b"abc", memoryview(b"x" * 1000), bytearray(b"y" * 500)], shared_memory_threshold=1000)
+        pickled = pickle.dumps(chunk)
+        self.assertLess(len(pickled), 1000)
+
+        unpickled = pickle.loads(pickled)
+        self.assertEqual(b"abc", unpickled.frames[0])
+        self.assertIsInstance(unpickled.frames[1], memoryview)
+        self.assertEqual(b"x" * 1000, bytes(unpickled.frames[1]))
+        self.assertEqual(b"y" * 500, bytes(unpickled.frames[2]))
+        # the segment is unlinked when it is loaded, so it can not be loaded again
+        with self.assertRaises(FileNotFoundError):
+            pickle.loads(pickled)
+
+    @unittest.skipIf(os.name == "nt", "shared memory segments are not persistent on Windows")
+    def test_unlink_segments(self):
+        segments = []
+        chunks = [SerializedChunk([b"abc", b"x" * 1000], shared_memory_threshold=1000, segments=segments)
+                  for _ in range(2)]
+        consumed, unconsumed = [pickle.dumps(c) for c in chunks]
+        self.assertEqual(2, len(segments))
+
+        pickle.loads(consumed)
+        serializers.unlink_segments(segments)
+        # the segment of the chunk that was not unpickled is unlinked too
+        with self.assertRaises(FileNotFoundError):
+            pickle.loads(unconsumed)
+
+
+class TestPickleSerializer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.chunk = [1, "two", (3, 4.0), {"five": [6]}, None]
+
+    def test_roundtrip(self):
+        serializer = PickleSerializer()
+        self.assertListEqual(self.chunk, serializer.deserialize(serializer.serialize(self.chunk)))
+
+    def test_out_of_band(self):
+        serializer = PickleSerializer()
+        frames = serializer.dumps([pickle.PickleBuffer(b"x" * 1000), 1])
+        self.assertEqual(2, len(frames))
+        self.assertEqual(1000, frames[1].nbytes)
+
+        chunk = serializer.deserialize(pickle.loads(pickle.dumps(SerializedChunk(frames))))
+        self.assertEqual(b"x" * 1000, bytes(chunk[0]))
+        self.assertEqual(1, chunk[1])
+
+    def test_in_band(self):
+        serializer = PickleSerializer(out_of_band=False)
+        frames = serializer.dumps([pickle.PickleBuffer(b"x" * 1000)])
+        self.assertEqual(1, len(frames))
+        self.assertEqual(b"x" * 1000, bytes(serializer.loads(frames)[0]))
+
+
+class TestMsgpackSerializer(unittest.TestCase):
+    @unittest.skipIf(serializers.msgpack is None, "msgpack is not installed")
+    def test_roundtrip(self):
+        serializer = MsgpackSerializer()
+        chunk = [1, "two", [3, 4.0], {"five": [6]}, None, b"bytes"]
+        self.assertListEqual(chunk, serializer.deserialize(serializer.serialize(chunk)))
+
+    @unittest.skipIf(serializers.msgpack is not None, "msgpack is installed")
+    def test_missing(self):
+        with self.assertRaises(ImportError):
+            MsgpackSerializer()
+
+
+class TestCodecSerializer(unittest.TestCase):
+    def test_roundtrip(self):
+        serializer = CodecSerializer(json_encode, json.loads)
+        chunk = [1, "two", [3, 4.0], {"five": [6]}, None]
+        self.assertEqual([json_encode(chunk)], serializer.dumps(chunk))
+        self.assertListEqual(chunk, serializer.deserialize(serializer.serialize(chunk)))
+
+    def test_pickle(self):
+        serializer = pickle.loads(pickle.dumps(CodecSerializer(json_encode, json.loads)))
+        self.assertListEqual([1, 2], serializer.loads(serializer.dumps([1, 2])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,8 +4,11 @@ Created on 23.09.20
 
 :author:     Martin Dočekal
 """
+import multiprocessing
 import os
 import queue
+import subprocess
+import sys
 import unittest
 
 from windpyutils.parallel.workers import FunRunner
@@ -59,6 +62,34 @@ class TestFunRunner(unittest.TestCase):
         else:
             self.skipTest("This test can only be run on the multi cpu device.")
 
+    def test_own_queues(self):
+        if os.cpu_count() > 1:
+            work_queue = multiprocessing.Queue()
+            results_queue = multiprocessing.Queue()
+            procs = [FunRunner(pf=abs, work_queue=work_queue, results_queue=results_queue) for _ in range(2)]
+            for p in procs:
+                p.start()
+
+            for i in range(10):
+                work_queue.put((i, [-i]))
+            for _ in procs:
+                work_queue.put(None)
+
+            res = sorted(results_queue.get() for _ in range(10))
+            for p in procs:
+                p.join()
+
+            self.assertListEqual([(i, [i]) for i in range(10)], res)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_import_creates_no_queues(self):
+        res = subprocess.run([sys.executable, "-c", "import windpyutils.parallel.workers as w;"
+                                                    "print(w.FunRunner.__dict__['WORK_QUEUE']._queue is None and "
+                                                    "w.FunRunner.__dict__['RESULTS_QUEUE']._queue is None)"],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+        self.assertEqual("True", res.stdout.strip(), res.stderr)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,9 +5,13 @@ Created on 04.12.21
 :author:     Martin Dočekal
 """
 import os
+import threading
+import time
 import unittest
 
+from windpyutils.parallel.chunks import AdaptiveChunkSize
 from windpyutils.parallel.pools import FunctorMap
+from windpyutils.parallel.serializers import PickleSerializer
 
 
 class TestFunctorMap(unittest.TestCase):
@@ -35,6 +39,18 @@ class TestFunctorMap(unittest.TestCase):
         else:
             self.skipTest("This test can only be run on the multi cpu device.")
 
+    def test_map_adaptive_chunk_size(self):
+        if os.cpu_count() > 1:
+            workers = 2
+            data = [i for i in range(10000)]
+            chunk_size = AdaptiveChunkSize(target_time=0.01)
+            with FunctorMap(lambda x: x * 2, workers=workers) as fm:
+                results = list(fm(data, chunk_size=chunk_size))
+                self.assertListEqual(results, [i * 2 for i in data])
+            self.assertGreater(chunk_size.size, 1)
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
     def test_map_all_cpus(self):
         if os.cpu_count() > 1:
             data = [i for i in range(10000)]
@@ -44,6 +60,96 @@ class TestFunctorMap(unittest.TestCase):
         else:
             self.skipTest("This test can only be run on the multi cpu device.")
 
+    def test_map_multiple_calls(self):
+        if os.cpu_count() > 1:
+            with FunctorMap(lambda x: x * 2, workers=2) as fm:
+                first = fm(range(1000), chunk_size=10)
+                second = fm(range(500), chunk_size=7)
+                self.assertEqual(0, next(first))
+                self.assertEqual(0, next(second))
+                self.assertListEqual([i * 2 for i in range(1, 500)], list(second))
+                self.assertListEqual([i * 2 for i in range(1, 1000)], list(first))
+                self.assertListEqual([i * 2 for i in range(100)], list(fm(range(100))))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+    def test_map_serializer(self):
+        if os.cpu_count() > 1:
+            data = [i for i in range(1000)]
+            with FunctorMap(lambda x: x * 2, workers=2, serializer=PickleSerializer()) as fm:
+                self.assertListEqual([i * 2 for i in data], list(fm(data, chunk_size=10)))
+        else:
+            self.skipTest("This test can only be run on the multi cpu device.")
+
+
+class TestThreadFunctorMap(unittest.TestCase):
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            FunctorMap(lambda x: x * 2, workers=2, backend="unknown")
+
+    def test_map(self):
+        data = [i for i in range(10000)]
+        with FunctorMap(lambda x: x * 2, workers=2, backend="thread") as fm:
+            self.assertListEqual([i * 2 for i in data], list(fm(data)))
+            self.assertListEqual([i * 2 for i in data], list(fm(data, chunk_size=AdaptiveChunkSize())))
+
+    def test_max_in_flight(self):
+        read = 0
+
+        def data():
+            nonlocal read
+            for i in range(1000):
+                read += 1
+                yield i
+
+        def straggling(x):
+            if x % 100 == 0:
+                time.sleep(0.05)
+            return x * 2
+
+        with FunctorMap(straggling, workers=2, backend="thread") as fm:
+            for produced, x in enumerate(fm(data(), chunk_size=2, max_in_flight=3)):
+                self.assertEqual(produced * 2, x)
+                # in flight chunks and the one that is read by chunking
+                self.assertLessEqual(read - produced, 4 * 2)
+
+    def test_interleaved_calls(self):
+        with FunctorMap(lambda x: x * 2, workers=2, backend="thread") as fm:
+            first = fm(range(1000), chunk_size=10)
+            second = fm(range(500), chunk_size=7)
+            results = list(zip(first, second))
+            self.assertListEqual([(i * 2, i * 2) for i in range(500)], results)
+            self.assertListEqual([i * 2 for i in range(501, 1000)], list(first))
+
+    def test_concurrent_calls(self):
+        results = [None] * 4
+
+        def run(fm: FunctorMap, t: int):
+            results[t] = list(fm(range(t * 1000, (t + 1) * 1000), chunk_size=3))
+
+        with FunctorMap(lambda x: x * 2, workers=2, backend="thread") as fm:
+            threads = [threading.Thread(target=run, args=(fm, t)) for t in range(len(results))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        for t, r in enumerate(results):
+            self.assertListEqual([i * 2 for i in range(t * 1000, (t + 1) * 1000)], r)
+
+    def test_abandoned_call(self):
+        with FunctorMap(lambda x: x * 2, workers=2, backend="thread") as fm:
+            results = fm(range(1000), chunk_size=10)
+            self.assertEqual(0, next(results))
+            results.close()
+            self.assertListEqual([i * 2 for i in range(100)], list(fm(range(100))))
+            self.assertDictEqual({}, fm._calls)
+
+    def test_invalid_max_in_flight(self):
+        with FunctorMap(lambda x: x * 2, workers=2, backend="thread") as fm:
+            with self.assertRaises(ValueError):
+                list(fm(range(10), max_in_flight=0))
+
 
 if __name__ == '__main__':
     unittest.main()
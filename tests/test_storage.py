@@ -10,7 +10,7 @@ from unittest import TestCase
 
 from windpyutils.parallel.own_proc_pools import FunctorWorker, FunctorPool
 
-from windpyutils.parallel.storage import TextFileStorage
+from windpyutils.parallel.storage import TextFileStorage, ThreadTextFileStorage, SegmentedTextFileStorage
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 TMP_DIR = os.path.join(SCRIPT_DIR, "tmp")
@@ -58,3 +58,119 @@ class TestTextFileStorage(TestCase):
         self.assertEqual(0, len(storage))
 
 
+class TestThreadTextFileStorage(TestTextFileStorage):
+
+    def test_read_after_finished(self):
+        storage = ThreadTextFileStorage(TMP_DIR)
+        with FunctorPool([Worker(storage) for _ in range(4)], backend="thread") as p:
+            for _ in p.imap(range(10_000), 10):
+                pass
+
+        self.assertTrue(storage.is_contiguous())
+        self.assertEqual(10_000, len(storage))
+        self.assertEqual(4, len([f for f in os.listdir(TMP_DIR) if f.startswith("storage_")]))
+        storage.reader_only = True
+        with storage:
+            for i in range(10_000):
+                self.assertEqual(storage[i], str(i))
+
+        storage.flush()
+        self.assertFalse(os.path.isfile(os.path.join(TMP_DIR, "storage_0")))
+        self.assertEqual(0, len(storage))
+
+
+class TestSegmentedTextFileStorage(TestTextFileStorage):
+
+    def test_read_after_finished(self):
+        storage = SegmentedTextFileStorage(TMP_DIR)
+        with FunctorPool([Worker(storage) for _ in range(4)]) as p:
+            for _ in p.imap(range(10_000), 10):
+                pass
+
+        self.assertEqual(4, len([f for f in os.listdir(TMP_DIR) if f.endswith(SegmentedTextFileStorage.INDEX_SUFFIX)]))
+        self.assertTrue(storage.is_contiguous())
+        self.assertEqual(10_000, len(storage))
+        storage.reader_only = True
+        with storage:
+            for i in range(10_000):
+                self.assertEqual(storage[i], str(i))
+
+        storage.flush()
+        self.assertListEqual(["placeholder"], os.listdir(TMP_DIR))
+        self.assertEqual(0, len(storage))
+
+    def test_gaps_and_iter(self):
+        storage = SegmentedTextFileStorage(TMP_DIR)
+        with storage:
+            storage[2] = "two"
+            storage[0] = "zero"
+            storage[5] = "five"
+
+        self.assertEqual(3, len(storage))
+        self.assertFalse(storage.is_contiguous())
+        self.assertListEqual(["zero", "two", "five"], list(storage))
+        with self.assertRaises(IndexError):
+            _ = storage[1]
+        with self.assertRaises(IndexError):
+            _ = storage[100]
+
+        with storage:
+            storage[1] = "one"
+        self.assertEqual("one", storage[1])
+        self.assertFalse(storage.is_contiguous())
+
+        with storage:
+            storage[3] = "three"
+            storage[4] = "four"
+        self.assertTrue(storage.is_contiguous())
+        self.assertListEqual(["zero", "one", "two", "three", "four", "five"], list(storage))
+        storage.flush()
+
+    def test_periodic_flush(self):
+        storage = SegmentedTextFileStorage(TMP_DIR)
+        storage.INDEX_BUFFER_SIZE = storage.INDEX_RECORD.size * 2
+        storage.open()
+        storage[0] = "zero"
+        self.assertEqual(0, len(storage))
+        storage[1] = "one"
+        self.assertEqual(2, len(storage))
+        self.assertEqual("one", storage[1])
+        storage.close()
+        storage.flush()
+
+    def test_duplicate(self):
+        storage = SegmentedTextFileStorage(TMP_DIR)
+        with storage:
+            storage[0] = "zero"
+            storage[0] = "again"  # the writer does not check duplicates
+
+        with self.assertRaises(ValueError):
+            len(storage)
+        storage.flush()
+
+    def test_duplicate_in_other_process(self):
+        storage = SegmentedTextFileStorage(TMP_DIR)
+        with storage:
+            storage[0] = "zero"
+
+        with FunctorPool([Worker(storage)]) as p:
+            self.assertListEqual([0], list(p.imap([0])))
+
+        # the worker has own segment even though it inherited the storage opened by this process
+        self.assertEqual(2, len([f for f in os.listdir(TMP_DIR) if f.endswith(SegmentedTextFileStorage.INDEX_SUFFIX)]))
+        with self.assertRaises(ValueError):
+            _ = storage[0]
+        storage.flush()
+
+    def test_separate_storages(self):
+        first = SegmentedTextFileStorage(TMP_DIR)
+        second = SegmentedTextFileStorage(TMP_DIR)
+        with first, second:
+            first[0] = "first"
+            second[0] = "second"
+
+        self.assertEqual("first", first[0])
+        self.assertEqual("second", second[0])
+        first.flush()
+        self.assertEqual(1, len(second))
+        second.flush()
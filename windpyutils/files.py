@@ -6,18 +6,29 @@ Utils for work with files.
 :author:     Martin Dočekal
 """
 import collections.abc
+import copy
 import csv
+import heapq
 import json
 import mmap
 import multiprocessing
 import os
+import pickle
+import queue
+import shutil
 import tempfile
+import threading
 from abc import ABC, abstractmethod
+from array import array
 from contextlib import nullcontext
 from dataclasses import dataclass, asdict, fields
 from io import StringIO
+from operator import itemgetter
 from typing import Union, Dict, Any, Type, List, Optional, Sequence, MutableSequence, TextIO, Generator, Iterable, \
-    TypeVar, Generic, Mapping, IO
+    TypeVar, Generic, Mapping, IO, Callable, Tuple
+
+from windpyutils.generic import arg_sort
+from windpyutils.typing import Comparable
 
 C = TypeVar('C')  # type of line content
 
@@ -265,6 +276,67 @@ class RandomLineAccessFile(BaseRandomLineAccessFile[str]):
     def closed(self) -> bool:
         return self.file is None
 
+    def _detached_copy(self) -> "RandomLineAccessFile":
+        """
+        Shallow copy of this file that is closed and doesn't share file descriptor with this file.
+
+        :return: closed copy
+        """
+        res = copy.copy(self)
+        res.file = None
+        res._opened_in_process_with_id = None
+        return res
+
+    def sorted_view(self, key: Callable[[C], Comparable], reverse: bool = False) -> "RandomLineAccessFile":
+        """
+        Creates view of this file with lines in order given by key. The file itself is not rewritten, only the line
+        index is permuted.
+
+        Each line is read just once and the keys are kept in compact array when they are numbers.
+
+        Example:
+            >>> with RecordFile("example.jsonl", MyRecord) as records:
+            >>>     view = records.sorted_view(lambda r: r.score)
+            >>> with view:
+            >>>     print(view[0])  # record with the lowest score
+
+        :param key: function that returns key for a line (or for a record in case of record files)
+        :param reverse: True activates descended order
+        :return: new closed object of the same type with permuted line index
+        """
+        opened_here = self.closed
+        if opened_here:
+            self.open()
+
+        try:
+            keys = list(map(key, self))
+        finally:
+            if opened_here:
+                self.close()
+
+        try:
+            keys = array("q", keys)
+        except (TypeError, OverflowError):
+            if all(isinstance(k, float) for k in keys):
+                keys = array("d", keys)
+
+        order = arg_sort(keys, reverse)
+        del keys
+
+        view = self._detached_copy()
+        if isinstance(self, collections.abc.MutableSequence):
+            view._lines = [self._lines[i] for i in order]
+        else:
+            try:
+                view._lines = array("q", (self._lines[i] for i in order))
+            except TypeError:
+                # there is a line content
+                view._lines = [self._lines[i] for i in order]
+
+        # lines are no longer in the order of the file so they can not be read sequentially
+        view._dirty = True
+        return view
+
     def _file_seek(self, offset: int):
         self.reopen_if_needed()
         self.file.seek(offset)
@@ -290,6 +362,11 @@ class MemoryMappedRandomLineAccessFile(RandomLineAccessFile):
             self._opened_in_process_with_id = os.getpid()
         return self
 
+    def _detached_copy(self) -> "MemoryMappedRandomLineAccessFile":
+        res = super()._detached_copy()
+        res.mm = None
+        return res
+
     def close(self):
         if self.file is not None:
             self.mm.close()
@@ -831,24 +908,66 @@ class TmpPool:
         >>> with TmpPool() as pool:
         >>>    pool.create()
         path to created tmp file
+
+    For multiple processes it is recommended to use the pool with own directory (own_dir=True). Each process creates
+    its files in that directory under unique names and the list of files is obtained from the directory itself,
+    so no manager process nor inter-process communication is needed.
+
+    Example:
+        >>> with TmpPool(own_dir=True) as pool:
+        >>>    pool.create()
+        path to created tmp file in pool directory
     """
 
-    def __init__(self, d: Optional[str] = None, multi_proc: bool = False):
+    def __init__(self, d: Optional[str] = None, multi_proc: bool = False, own_dir: bool = False):
         """
         initializes pool
         :param d: directory where the tmp files will be created or the dafault is used
         :param multi_proc: Pass true if you want to use that with multiple processes
+            It is not needed when own_dir is used.
+        :param own_dir: Creates pool specific directory in d and all tmp files are created there.
+            The directory is created when the pool is entered and removed when the pool is closed.
         """
 
         self._d = d
         self._created_files = []
-        self._multi_proc = multi_proc
+        self._use_own_dir = own_dir
+        self._own_dir = None
+        self._own_dir_counter = 0
+        self._multi_proc = multi_proc and not own_dir
         self._manager = None
-        if multi_proc:
+        if self._multi_proc:
             self._manager = multiprocessing.Manager()
 
+    @property
+    def directory(self) -> Optional[str]:
+        """
+        Pool specific directory or None when the pool is not using own directory or was not entered yet.
+        """
+        return self._own_dir
+
+    def _files(self) -> Sequence[str]:
+        """
+        Paths to all files in this pool.
+
+        :return: paths to tmp files
+            When the pool is using own directory, the files are sorted by process and then by creation order.
+        """
+        if not self._use_own_dir:
+            return self._created_files
+
+        if self._own_dir is None:
+            return []
+
+        try:
+            names = os.listdir(self._own_dir)
+        except FileNotFoundError:
+            return []
+
+        return [os.path.join(self._own_dir, n) for n in sorted(names)]
+
     def __len__(self):
-        return len(self._created_files)
+        return len(self._files())
 
     def __getitem__(self, item) -> str:
         """
@@ -857,16 +976,23 @@ class TmpPool:
         :param item: index of tmp file.
         :return: path to tmp file
         """
-        return self._created_files[item]
+        return self._files()[item]
 
     def __enter__(self):
-        if self._multi_proc:
+        if self._use_own_dir:
+            if self._own_dir is None:
+                self._own_dir = tempfile.mkdtemp(prefix="tmp_pool_", dir=self._d)
+            else:
+                os.makedirs(self._own_dir, exist_ok=True)
+        elif self._multi_proc:
             self._manager = multiprocessing.Manager().__enter__()
             self._created_files = self._manager.list()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.flush()
+        if self._own_dir is not None:
+            shutil.rmtree(self._own_dir, ignore_errors=True)
         if self._manager is not None:
             self._manager.__exit__(None, None, None)
 
@@ -874,7 +1000,21 @@ class TmpPool:
         """
         Create tmp file.
         :return: Path to tmp file
-        """
+        :raise RuntimeError: When the pool is using own directory and it was not entered yet.
+        """
+        if self._use_own_dir:
+            if self._own_dir is None:
+                raise RuntimeError("Firstly enter the pool.")
+            while True:
+                # pid makes the name unique among processes and the exclusive mode protects against pid reuse
+                p = os.path.join(self._own_dir, f"{os.getpid()}_{self._own_dir_counter:010d}")
+                self._own_dir_counter += 1
+                try:
+                    with open(p, "x"):
+                        return p
+                except FileExistsError:
+                    pass
+
         tmp = tempfile.NamedTemporaryFile(delete=False, dir=self._d)
         tmp.close()
         self._created_files.append(tmp.name)
@@ -891,20 +1031,69 @@ class TmpPool:
             # already removed
             pass
 
-        self._created_files.remove(p)
+        if not self._use_own_dir:
+            self._created_files.remove(p)
 
     def flush(self):
         """
         Removes all created files from this pool and also the file system.
         """
-        for p in self._created_files:
+        for p in self._files():
             try:
                 os.remove(p)
             except FileNotFoundError:
                 # already removed
                 pass
 
-        self._created_files = self._manager.list() if self._multi_proc else []
+        if not self._use_own_dir:
+            self._created_files = self._manager.list() if self._multi_proc else []
+
+    def size(self) -> int:
+        """
+        Total size of all files in this pool.
+
+        :return: size in bytes
+        """
+        res = 0
+        for p in self._files():
+            try:
+                res += os.path.getsize(p)
+            except FileNotFoundError:
+                # removed in the meantime
+                pass
+        return res
+
+    def cleanup(self, quota: Optional[int] = None, min_free: Optional[int] = None) -> int:
+        """
+        Removes files from this pool, the oldest first, until the pool fits into given quota and there is at least
+        given amount of free space on the disk.
+
+        :param quota: maximal total size of files in this pool in bytes
+        :param min_free: minimal free space in bytes on the disk where the tmp files are created
+        :return: number of freed bytes
+        """
+        files = []
+        for p in self._files():
+            try:
+                st = os.stat(p)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime_ns, p, st.st_size))
+        files.sort()
+
+        total = sum(x[2] for x in files)
+        disk_dir = self._own_dir if self._own_dir is not None else (self._d or tempfile.gettempdir())
+        freed = 0
+
+        for _, p, size in files:
+            over_quota = quota is not None and total - freed > quota
+            low_space = min_free is not None and shutil.disk_usage(disk_dir).free < min_free
+            if not over_quota and not low_space:
+                break
+            self.remove(p)
+            freed += size
+
+        return freed
 
 
 class FilePool(Mapping[str, IO]):
@@ -969,3 +1158,378 @@ class FilePool(Mapping[str, IO]):
             f.close()
 
         self.file_handles = None
+
+
+class PartitionedWriter:
+    """
+    Writer that splits a stream of lines into multiple files (partitions).
+
+    The lines are buffered per partition in memory and each partition is written in one large block when its buffer
+    exceeds given number of bytes. The writing of blocks can be done by a background thread.
+
+    It can also build line offsets index and key->line offset mapping for each partition while writing, so there is
+    no need to index the written files again. See :class:`.RandomLineAccessFile` and :class:`.MapAccessFile`.
+
+    Example:
+        >>> with PartitionedWriter(["part_0.txt", "part_1.txt"], index=True) as writer:
+        >>>     for i, line in enumerate(lines):
+        >>>         writer.write(i % 2, line, key=i)
+        >>> with MapAccessFile("part_0.txt", writer.mapping(0)) as map_file:
+        >>>     print(map_file[0])
+    """
+
+    def __init__(self, files: Sequence[str], flush_threshold: int = 1_048_576, background_flush: bool = False,
+                 index: bool = False, line_ending: str = "\n", encoding: str = "utf-8"):
+        """
+        Creates new partitioned writer.
+
+        :param files: path to file for each partition
+            the index of a path is the partition identifier
+        :param flush_threshold: number of buffered bytes of a partition that triggers its writing
+        :param background_flush: if True the blocks are written by a background thread
+        :param index: if True it will create line offsets index and key->line offset mapping for each partition
+        :param line_ending: line ending that is appended to each written line
+        :param encoding: encoding of written lines
+        """
+        self._files = list(files)
+        self._pool = FilePool(self._files, "wb")
+        self.flush_threshold = flush_threshold
+        self.background_flush = background_flush
+        self.index = index
+        self.line_ending = line_ending
+        self.encoding = encoding
+
+        self._buffers: List[List[bytes]] = [[] for _ in self._files]
+        self._buffered_bytes = [0] * len(self._files)
+        self._written_bytes = [0] * len(self._files)
+        self._line_offsets: List[List[int]] = [[] for _ in self._files]
+        self._mappings: List[Dict[Any, int]] = [{} for _ in self._files]
+
+        self._flush_queue = None
+        self._flush_thread = None
+        self._flush_error = None
+
+    def __enter__(self) -> "PartitionedWriter":
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        """
+        Number of partitions.
+        """
+        return len(self._files)
+
+    @property
+    def closed(self) -> bool:
+        """
+        Flag showing whether this writer is closed.
+        """
+        return self._pool.file_handles is None
+
+    def open(self) -> "PartitionedWriter":
+        """
+        Opens all partition files for writing. The files are truncated, so the offsets and the index start again from
+        the beginning.
+
+        :return: self
+        """
+        if self.closed:
+            self._pool.open()
+            self._buffers = [[] for _ in self._files]
+            self._buffered_bytes = [0] * len(self._files)
+            self._written_bytes = [0] * len(self._files)
+            self._line_offsets = [[] for _ in self._files]
+            self._mappings = [{} for _ in self._files]
+            if self.background_flush:
+                self._flush_queue = queue.Queue(max(len(self._files), 1))
+                self._flush_thread = threading.Thread(target=self._flusher, daemon=True)
+                self._flush_thread.start()
+        return self
+
+    def close(self):
+        """
+        Writes all buffered data and closes all partition files.
+        """
+        if self.closed:
+            return
+
+        try:
+            self.flush()
+        finally:
+            if self._flush_thread is not None:
+                self._flush_queue.put(None)
+                self._flush_thread.join()
+                self._flush_thread = None
+                self._flush_queue = None
+            self._pool.close()
+
+        self._raise_flush_error()
+
+    def write(self, partition: int, line: str, key: Optional[Any] = None) -> int:
+        """
+        Writes line to given partition.
+
+        :param partition: partition identifier
+        :param line: line content
+            Line ending is added automatically. The line might end with the line ending, which is then not added again.
+        :param key: optional key of the line that will be used in key->line offset mapping
+            It is used only when the index is activated.
+        :return: offset of the line in the partition file
+        :raise RuntimeError: When the writer is not opened.
+        :raise ValueError: When the partition does not exist or the line contains line ending.
+        """
+        if self.closed:
+            raise RuntimeError("Firstly open the writer.")
+
+        if not 0 <= partition < len(self._files):
+            raise ValueError(f"The partition {partition} is not in [0, {len(self._files)}).")
+
+        self._raise_flush_error()
+
+        if line.endswith(self.line_ending):
+            line = line[:-len(self.line_ending)]
+        if "\n" in line or "\r" in line or self.line_ending in line:
+            raise ValueError("The line must not contain line ending.")
+
+        data = (line + self.line_ending).encode(self.encoding)
+        offset = self._written_bytes[partition] + self._buffered_bytes[partition]
+
+        if self.index:
+            self._line_offsets[partition].append(offset)
+            if key is not None:
+                self._mappings[partition][key] = offset
+
+        self._buffers[partition].append(data)
+        self._buffered_bytes[partition] += len(data)
+
+        if self._buffered_bytes[partition] >= self.flush_threshold:
+            self._flush_partition(partition)
+
+        return offset
+
+    def flush(self):
+        """
+        Writes buffered data of all partitions to files.
+        """
+        for partition in range(len(self._files)):
+            self._flush_partition(partition)
+
+        if self._flush_thread is not None:
+            self._flush_queue.join()
+
+        for f in self._pool.values():
+            f.flush()
+
+        self._raise_flush_error()
+
+    def _flush_partition(self, partition: int):
+        """
+        Writes buffered data of given partition to its file or passes it to the background thread.
+
+        :param partition: partition identifier
+        """
+        if self._buffered_bytes[partition] == 0:
+            return
+
+        block = b"".join(self._buffers[partition])
+        self._buffers[partition] = []
+        self._written_bytes[partition] += self._buffered_bytes[partition]
+        self._buffered_bytes[partition] = 0
+
+        if self._flush_thread is None:
+            self._pool[self._files[partition]].write(block)
+        else:
+            self._flush_queue.put((partition, block))
+
+    def _flusher(self):
+        """
+        Body of the background thread that writes blocks passed through flush queue.
+        """
+        while True:
+            item = self._flush_queue.get()
+            try:
+                if item is None:
+                    break
+                partition, block = item
+                if self._flush_error is None:
+                    self._pool[self._files[partition]].write(block)
+            except Exception as e:
+                self._flush_error = e
+            finally:
+                self._flush_queue.task_done()
+
+    def _raise_flush_error(self):
+        """
+        Re-raises exception that occurred in background thread.
+        """
+        if self._flush_error is not None:
+            e = self._flush_error
+            self._flush_error = None
+            raise e
+
+    def line_offsets(self, partition: int) -> List[int]:
+        """
+        Line offsets of given partition. It could be used as index for :class:`.RandomLineAccessFile`.
+
+        :param partition: partition identifier
+        :return: line offsets
+        :raise RuntimeError: When the index is not activated.
+        """
+        if not self.index:
+            raise RuntimeError("The index is not activated.")
+        return self._line_offsets[partition]
+
+    def mapping(self, partition: int) -> Dict[Any, int]:
+        """
+        Key->line offset mapping of given partition. It could be used as mapping for :class:`.MapAccessFile`.
+
+        :param partition: partition identifier
+        :return: the mapping
+        :raise RuntimeError: When the index is not activated.
+        """
+        if not self.index:
+            raise RuntimeError("The index is not activated.")
+        return self._mappings[partition]
+
+    def save_line_offsets(self, partition: int, path_to: str):
+        """
+        Saves line offsets of given partition in format that is readable by
+        :meth:`.RandomLineAccessFile.read_index_from_file`.
+
+        :param partition: partition identifier
+        :param path_to: where the index should be saved
+        """
+        with open(path_to, "w") as f:
+            for offset in self.line_offsets(partition):
+                print(offset, file=f)
+
+    def save_mapping(self, partition: int, path_to: str):
+        """
+        Saves key->line offset mapping of given partition in tsv format that is readable by
+        :meth:`.MapAccessFile.load_mapping`.
+
+        :param partition: partition identifier
+        :param path_to: where the mapping should be saved
+        """
+        with open(path_to, "w", newline='') as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["key", "file_line_offset"])
+            for k, offset in self.mapping(partition).items():
+                writer.writerow([k, offset])
+
+
+def _spill_sort_run(items: Iterable[Any], key: Callable[[Any], Comparable], reverse: bool, tmp_pool: TmpPool,
+                    batch_size: int = 1024) -> str:
+    """
+    Sorts given items and saves them as a sorted run into a tmp file.
+
+    The run is saved as a sequence of pickled batches of (key, line) pairs.
+
+    :param items: lines or records of a run
+    :param key: key function
+    :param reverse: True activates descended order
+    :param tmp_pool: pool where the tmp file for the run will be created
+    :param batch_size: number of pairs in one pickled batch
+    :return: path to the run
+    """
+    run = sorted(((key(x), x.save() if isinstance(x, Record) else x) for x in items), key=itemgetter(0),
+                 reverse=reverse)
+    p = tmp_pool.create()
+    with open(p, "wb") as f:
+        for i in range(0, len(run), batch_size):
+            pickle.dump(run[i:i + batch_size], f, protocol=pickle.HIGHEST_PROTOCOL)
+    return p
+
+
+def _read_sort_run(p: str) -> Generator[Tuple[Any, str], None, None]:
+    """
+    Reads sorted run created by :func:`_spill_sort_run`.
+
+    :param p: path to the run
+    :return: generator of (key, line) pairs
+    """
+    with open(p, "rb") as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                break
+            yield from batch
+
+
+def external_sort(source: BaseRandomLineAccessFile, out: str, key: Callable[[Any], Comparable],
+                  run_size: int = 100_000, reverse: bool = False, tmp_dir: Optional[str] = None, workers: int = 0,
+                  index_path: Optional[str] = None) -> List[int]:
+    """
+    Sorts lines of given file that doesn't need to fit into memory.
+
+    The file is read in runs of given size, each run is sorted in memory and saved into a tmp file. At the end
+    all runs are merged into the output file. The sort is stable.
+
+    Example:
+        >>> with RecordFile("example.jsonl", MyRecord) as records:
+        >>>     offsets = external_sort(records, "sorted.jsonl", key=lambda r: r.score)
+        >>> with RecordFile("sorted.jsonl", MyRecord, offsets) as records:
+        >>>     print(records[0])
+
+    :param source: file with lines or records
+        When records are sorted the output contains their saved representation.
+    :param out: path where the sorted file will be saved
+    :param key: function that returns key for a line or record
+    :param run_size: maximal number of lines in one run, it determines the memory consumption
+    :param reverse: True activates descended order
+    :param tmp_dir: directory where the runs will be saved or the default tmp directory is used
+    :param workers: number of parallel processes that are generating runs
+        Values <=0 means that the runs are generated in this process.
+        The source and the key function must be usable in other processes.
+    :param index_path: if not None the line offsets of the output are also saved to this path in format readable by
+        :meth:`.RandomLineAccessFile.read_index_from_file`
+    :return: line offsets of the output file
+    """
+
+    opened_here = source.closed
+    if opened_here:
+        source.open()
+
+    try:
+        with TmpPool(tmp_dir, own_dir=True) as tmp_pool:
+            if workers > 0:
+                # the pools are imported here as they are heavy to import
+                from windpyutils.parallel.own_proc_pools import FunctorPool
+                from windpyutils.parallel.sort_runs import SortRunWorker
+
+                ranges = [(s, min(s + run_size, len(source))) for s in range(0, len(source), run_size)]
+                with FunctorPool([SortRunWorker(source, key, reverse, tmp_pool) for _ in range(workers)]) as pool:
+                    runs = list(pool.imap(ranges))
+            else:
+                runs = []
+                run = []
+                for x in source:
+                    run.append(x)
+                    if len(run) == run_size:
+                        runs.append(_spill_sort_run(run, key, reverse, tmp_pool))
+                        run = []
+                if len(run) > 0:
+                    runs.append(_spill_sort_run(run, key, reverse, tmp_pool))
+                del run
+
+            offsets = []
+            offset = 0
+            with open(out, "wb") as f:
+                for _, line in heapq.merge(*(_read_sort_run(p) for p in runs), key=itemgetter(0), reverse=reverse):
+                    data = (line + "\n").encode("utf-8")
+                    offsets.append(offset)
+                    offset += len(data)
+                    f.write(data)
+    finally:
+        if opened_here:
+            source.close()
+
+    if index_path is not None:
+        with open(index_path, "w") as f:
+            for o in offsets:
+                print(o, file=f)
+
+    return offsets
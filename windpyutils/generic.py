@@ -287,7 +287,8 @@ def arg_sort(elements: Sequence[Comparable], reverse: bool = False) -> List[int]
     :param reverse: True activates descended order
     :return: indices
     """
-    return sorted(range(len(elements)), key=lambda x: elements[x], reverse=reverse)
+    # bound __getitem__ is called directly from C, which is considerably faster than a lambda
+    return sorted(range(len(elements)), key=elements.__getitem__, reverse=reverse)
 
 
 T = TypeVar("T")
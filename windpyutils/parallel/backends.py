@@ -0,0 +1,43 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+Module for selection of backend (processes or threads) of parallel workers.
+
+:author:     Martin Dočekal
+"""
+import sys
+
+BACKENDS = ("process", "thread", "auto")
+"""
+Supported backends of workers.
+    process     each worker runs in its own process
+    thread      each worker runs in a thread of this process, so nothing is pickled
+    auto        threads on free-threaded (no GIL) interpreter, processes otherwise
+"""
+
+
+def is_free_threaded() -> bool:
+    """
+    Whether the interpreter runs without GIL. It is possible only on free-threaded builds of Python 3.13+, which
+    might still enable GIL at runtime (e.g. because of an incompatible extension or PYTHON_GIL=1).
+
+    :return: True when the GIL is disabled
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def resolve_backend(backend: str) -> str:
+    """
+    Resolves backend to the one that should be used.
+
+    :param backend: one of :data:`BACKENDS`
+    :return: process or thread
+    :raise ValueError: when the backend is unknown
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}. Use one of {BACKENDS}.")
+
+    if backend == "auto":
+        return "thread" if is_free_threaded() else "process"
+    return backend
@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+Module for splitting data into chunks that are sent to parallel workers.
+
+:author:     Martin Dočekal
+"""
+import math
+from typing import TypeVar, Iterable, Generator, List, Union, Callable, Hashable, Optional
+
+T = TypeVar('T')
+
+
+class AdaptiveChunkSize:
+    """
+    Chunk size that adapts to measured processing times of chunks.
+
+    It estimates the processing time of a single item and sets the chunk size so that processing of a chunk takes
+    the target time. When workers wait for work longer than they process a chunk, the chunk is too small to
+    outweigh the communication overhead and the size is grown.
+
+    Example:
+        >>> chunk_size = AdaptiveChunkSize(target_time=0.1)
+        >>> chunk_size.size
+        1
+        >>> chunk_size.update(1, 0.01)
+        >>> chunk_size.size
+        2
+
+    :ivar size: actual chunk size
+    :vartype size: int
+    """
+
+    def __init__(self, target_time: float = 0.05, initial_size: int = 1, min_size: int = 1,
+                 max_size: Union[int, float] = math.inf, max_growth: float = 2.0, smoothing: float = 0.5):
+        """
+        :param target_time: desired processing time of a chunk in seconds
+        :param initial_size: chunk size that is used before first measurement
+        :param min_size: minimal chunk size
+        :param max_size: maximal chunk size
+        :param max_growth: the chunk size could grow or shrink at most by this factor per update
+        :param smoothing: weight of new measurement in exponential moving average of item processing time
+        :raise ValueError: when attributes are invalid
+        """
+        if target_time <= 0:
+            raise ValueError("The target time must be positive.")
+        if min_size < 1 or max_size < min_size:
+            raise ValueError("The chunk size limits must satisfy 1 <= min_size <= max_size.")
+        if max_growth <= 1:
+            raise ValueError("The max growth must be greater than one.")
+        if not 0 < smoothing <= 1:
+            raise ValueError("The smoothing must be in (0, 1].")
+
+        self.target_time = target_time
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_growth = max_growth
+        self.smoothing = smoothing
+        self.size = self._clip(initial_size)
+        self._item_time = None
+
+    def _clip(self, size: Union[int, float]) -> int:
+        """
+        Clips chunk size into allowed limits.
+
+        :param size: chunk size
+        :return: clipped chunk size
+        """
+        return int(min(max(size, self.min_size), self.max_size))
+
+    def update(self, chunk_len: int, processing_time: float, wait_time: float = 0.0):
+        """
+        Updates chunk size according to measurement of processed chunk.
+
+        :param chunk_len: number of items in processed chunk
+        :param processing_time: time in seconds a worker spent processing the chunk
+        :param wait_time: time in seconds the worker waited for the chunk in work queue
+        """
+        if chunk_len <= 0:
+            return
+
+        item_time = processing_time / chunk_len
+        if self._item_time is None:
+            self._item_time = item_time
+        else:
+            self._item_time = self.smoothing * item_time + (1 - self.smoothing) * self._item_time
+
+        desired = self.target_time / self._item_time if self._item_time > 0 else math.inf
+        if wait_time > processing_time:
+            desired = max(desired, self.size * self.max_growth)
+
+        desired = min(max(desired, self.size / self.max_growth), self.size * self.max_growth)
+        self.size = self._clip(desired)
+
+
+def chunking(data: Iterable[T], chunk_size: Union[int, AdaptiveChunkSize],
+             key: Optional[Callable[[T], Hashable]] = None) -> Generator[List[T], None, None]:
+    """
+    Splits data into chunks.
+
+    :param data: data for splitting
+    :param chunk_size: size of a chunk
+        In case of adaptive chunk size the actual size is used for each new chunk.
+    :param key: Optional key function. When the key changes a new chunk is started, so all items in a chunk
+        have the same key.
+    :return: generator of chunks
+    """
+    adaptive = isinstance(chunk_size, AdaptiveChunkSize)
+    size = chunk_size.size if adaptive else chunk_size
+
+    ch = []
+    ch_key = None
+    for x in data:
+        if key is not None:
+            x_key = key(x)
+            if len(ch) > 0 and x_key != ch_key:
+                yield ch
+                ch = []
+                if adaptive:
+                    size = chunk_size.size
+            ch_key = x_key
+        ch.append(x)
+        if len(ch) >= size:
+            yield ch
+            ch = []
+            if adaptive:
+                size = chunk_size.size
+    if len(ch) > 0:
+        yield ch
@@ -0,0 +1,466 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+Module with pool which workers run on other machines.
+
+:author:     Martin Dočekal
+"""
+import math
+import multiprocessing
+import queue
+import socket
+import sys
+import threading
+import time
+import uuid
+from multiprocessing.context import BaseContext
+from multiprocessing.managers import SyncManager, DictProxy
+from typing import Tuple, Optional, Dict, Any, List, Callable, TypeVar
+
+from windpyutils.parallel.own_proc_pools import FunctorPool, FunctorWorkerFactory, BaseFunctorWorker
+from windpyutils.parallel.pool_metrics import PoolMetrics
+from windpyutils.parallel.serializers import Serializer
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+_broker_objects = {}
+_broker_objects_lock = threading.Lock()
+
+
+def _broker_object(name: str, create: Callable[[], Any]) -> Any:
+    """
+    Gets object that is shared through the broker or creates it. It is used only in the broker process.
+
+    :param name: name of the object
+    :param create: creates the object when it does not exist yet
+    :return: the object
+    """
+    with _broker_objects_lock:
+        if name not in _broker_objects:
+            _broker_objects[name] = create()
+        return _broker_objects[name]
+
+
+def _broker_queue(name: str, maxsize: int = 0) -> queue.Queue:
+    return _broker_object(name, lambda: queue.Queue(maxsize))
+
+
+def _broker_dict(name: str) -> Dict:
+    return _broker_object(name, dict)
+
+
+class WorkBroker(SyncManager):
+    """
+    Manager that listens on TCP and shares named queues and dictionaries between
+    :class:`DistributedFunctorPool` and :class:`WorkerAgent` processes.
+    The objects are obtained by name, so proxies of them are always created with address and authentication key of
+    the connected manager.
+    """
+
+
+WorkBroker.register("get_queue", callable=_broker_queue)
+WorkBroker.register("get_dict", callable=_broker_dict, proxytype=DictProxy)
+
+
+class RemoteChunkIndex:
+    """
+    Index of the last chunk a remote worker took from the work queue. It is stored in the broker under id of
+    the worker, so the pool is able to send the chunk again when the worker or its agent dies.
+    It has the same interface as shared value that is used by :attr:`BaseFunctorWorker.current_chunk`.
+    """
+
+    def __init__(self, chunks: DictProxy, wid: str):
+        """
+        :param chunks: dictionary in the broker that maps worker id to chunk index
+        :param wid: id of the worker
+        """
+        self.chunks = chunks
+        self.wid = wid
+
+    @property
+    def value(self) -> int:
+        return self.chunks.get(self.wid, -1)
+
+    @value.setter
+    def value(self, i: int):
+        self.chunks[self.wid] = i
+
+
+class DistributedFunctorPool(FunctorPool):
+    """
+    A pool which workers run in :class:`WorkerAgent` processes that might be on other machines.
+
+    The pool starts a broker (multiprocessing manager listening on TCP) with its work and results queues. Agents
+    connect to it and their workers take chunks from the work queue and send results back, so the imap keeps
+    the order of results as with the local workers. Agents might connect and disconnect any time, an agent that
+    is not able to reach the broker tries to reconnect.
+
+    Agents send heartbeats to the broker. When an agent does not send it for agent_timeout seconds, its workers are
+    considered as crashed. When fault tolerance is enabled by max_retries, chunks of crashed workers are sent again.
+
+    Example:
+        On the machine with data:
+        >>> with DistributedFunctorPool(("0.0.0.0", 5000), b"secret") as pool:
+        ...     pool.wait_for_workers(8)
+        ...     results = list(pool.imap(data))
+
+        On each machine with workers:
+        >>> WorkerAgent(("data-machine", 5000), b"secret", MyWorkerFactory(), workers=4).run()
+    """
+
+    STOP_CHECK_INTERVAL = 0.1
+    """How often in seconds it checks whether the remote workers stopped when the pool exits."""
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes, context: Optional[BaseContext] = None,
+                 work_queue_maxsize: Optional[int] = 64, results_queue_maxsize: Optional[int] = None,
+                 verbose: bool = False, join_timeout: Optional[int] = None, metrics: Optional[PoolMetrics] = None,
+                 max_retries: Optional[int] = None, error_policy: str = "raise", agent_timeout: float = 30.0,
+                 serializer: Optional[Serializer] = None):
+        """
+        Initialization of pool. The broker is started immediately, so the agents can connect before the pool
+        is entered.
+
+        :param address: address (host, port) where the broker listens
+            Port 0 means arbitrary free port, see :attr:`address`.
+        :param authkey: key that is used for authentication of agents
+        :param context: On which multiprocessing context this pool should operate.
+        :param work_queue_maxsize: Max size of queue that is used for sending work to workers.
+            If None all work will be passed to queue at once.
+        :param results_queue_maxsize: Max size of queue that is used to deliver results to this process.
+            None means unlimited.
+        :param verbose: Determines whether information messages should be shown.
+        :param join_timeout: Timeout for stopping of remote workers.
+        :param metrics: Optional metrics that will be filled with measurements of workers and the pool.
+        :param max_retries: Enables fault tolerance when it is not None. Chunks of crashed workers and workers of
+            dead agents are sent again at most max_retries times. See :class:`FunctorPool` for more information.
+        :param error_policy: What to do when a worker raises an exception while it processes an item.
+            See :class:`FunctorPool` for more information.
+        :param agent_timeout: Number of seconds without heartbeat after which an agent is considered as dead.
+        :param serializer: Serializer of chunks of work and results that is used also by the remote workers.
+            See :class:`FunctorPool` for more information.
+        :raise ValueError: when the error policy is unknown
+        """
+        self._broker_address = address
+        self._authkey = authkey
+        self.agent_timeout = agent_timeout
+        self._agent_beats = {}  # agent id -> (last seen heartbeat, time.monotonic when it was seen)
+
+        super().__init__([], context, None, None, verbose, join_timeout, "manager", metrics=metrics,
+                         max_retries=max_retries, error_policy=error_policy, serializer=serializer)
+
+        self._work_queue = self._manager.get_queue("work", 0 if work_queue_maxsize is None else work_queue_maxsize)
+        self._results_queue = self._manager.get_queue("results",
+                                                      0 if results_queue_maxsize is None else results_queue_maxsize)
+        self._results_queue_maxsize = math.inf if results_queue_maxsize is None else results_queue_maxsize
+        self._remote_workers = self._manager.get_dict("workers")  # worker id -> agent id
+        self._remote_chunks = self._manager.get_dict("chunks")  # worker id -> index of its last chunk
+        self._remote_crashed = self._manager.get_dict("crashed")  # worker id -> index of its last chunk
+        self._agents = self._manager.get_dict("agents")  # agent id -> heartbeat counter
+        self._config = self._manager.get_dict("config")
+        self._config.update(error_policy=error_policy, track_chunks=max_retries is not None, serializer=serializer,
+                            closing=False)
+        # agents do not touch the queues before the pool is ready
+        self._config["ready"] = True
+
+    def _create_manager(self) -> SyncManager:
+        broker = WorkBroker(self._broker_address, self._authkey, ctx=self._context)
+        # connections of this process to a previous broker on the same address were dropped when it was shut down
+        broker.start()
+        return broker
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """
+        Address where the broker listens.
+        """
+        return self._manager.address
+
+    @property
+    def remote_workers(self) -> int:
+        """
+        Number of workers that are registered by agents.
+        """
+        return len(self._remote_workers)
+
+    def wait_for_workers(self, workers: int, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until given number of workers is registered by agents.
+
+        :param workers: number of workers
+        :param timeout: maximal time in seconds to wait
+            None means no limit.
+        :return: False when the timeout expired before the workers were registered
+        """
+        start = time.monotonic()
+        while self.remote_workers < workers:
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return False
+            time.sleep(self.STOP_CHECK_INTERVAL)
+        return True
+
+    def _unregister_dead_agents(self) -> List[Tuple[str, int]]:
+        """
+        Finds agents that stopped sending heartbeats and unregisters them with their workers.
+
+        :return: ids of workers of dead agents together with indices of their last chunks
+        """
+        now = time.monotonic()
+        dead = set()
+        for agent_id, beat in self._agents.items():
+            seen = self._agent_beats.get(agent_id)
+            if seen is None or seen[0] != beat:
+                self._agent_beats[agent_id] = (beat, now)
+            elif now - seen[1] >= self.agent_timeout:
+                dead.add(agent_id)
+
+        lost = []
+        if len(dead) > 0:
+            for agent_id in dead:
+                if self.verbose:
+                    print(f"Agent {agent_id} is dead.", file=sys.stderr)
+                self._agents.pop(agent_id, None)
+                del self._agent_beats[agent_id]
+
+            for wid, agent_id in self._remote_workers.items():
+                if agent_id in dead:
+                    self._remote_workers.pop(wid, None)
+                    lost.append((wid, self._remote_chunks.pop(wid, -1)))
+        return lost
+
+    def _check_workers(self, results: List[Tuple[int, Any, Tuple]]) -> List[int]:
+        """
+        Checks whether remote workers are alive. Chunks of crashed workers and of workers of dead agents are sent
+        again.
+
+        :param results: list where results that were received during the check are appended
+            Results are not received by this check, as the remote workers report chunks they lost.
+        :return: indices of chunks that were poisoned during this check
+        """
+        self._last_liveness_check = time.monotonic()
+        lost = self._unregister_dead_agents()
+        for wid in self._remote_crashed.keys():
+            lost.append((wid, self._remote_crashed.pop(wid)))
+
+        poisoned = []
+        for wid, chunk_i in lost:
+            if self.verbose:
+                print(f"Remote worker {wid} crashed.", file=sys.stderr)
+            if self.metrics is not None:
+                self.metrics.crashed(wid)
+            if chunk_i in self._in_flight and self._retry(self._work_queue, chunk_i):
+                poisoned.append(chunk_i)
+
+        self._flush_resend()
+        return poisoned
+
+    def _stop_workers(self):
+        """
+        Sends stop orders to remote workers and waits until their agents report that they finished.
+        """
+        self._config["closing"] = True
+        self._unregister_dead_agents()
+        for _ in range(self.remote_workers):
+            self._work_queue.put(None)
+
+        start = time.monotonic()
+        while self.remote_workers > 0:
+            if self.join_timeout is not None and time.monotonic() - start >= self.join_timeout:
+                if self.verbose:
+                    print(f"{self.remote_workers} remote workers did not stop.", file=sys.stderr)
+                break
+            time.sleep(self.STOP_CHECK_INTERVAL)
+            self._unregister_dead_agents()
+
+
+class WorkerAgent:
+    """
+    Runs workers of :class:`DistributedFunctorPool` on a machine.
+
+    It connects to the broker of the pool, starts workers that process chunks from the work queue of the pool and
+    sends heartbeats to the broker. Crashed workers and workers that stopped because of max_chunks_per_worker are
+    replaced by new ones from the factory. When the connection to the broker is lost (or it can not be established
+    yet), the agent stops its workers and tries to reconnect.
+
+    Example:
+        >>> WorkerAgent(("data-machine", 5000), b"secret", MyWorkerFactory(), workers=4).run()
+
+    :ivar agent_id: unique id of this agent
+    :vartype agent_id: str
+    """
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes, workers_factory: FunctorWorkerFactory,
+                 workers: int = -1, context: Optional[BaseContext] = None, heartbeat_interval: float = 1.0,
+                 reconnect_interval: float = 1.0, reconnect_timeout: Optional[float] = 60.0,
+                 persistent: bool = False, verbose: bool = False):
+        """
+        :param address: address (host, port) of the broker
+        :param authkey: key that is used for authentication
+        :param workers_factory: factory that is used for creating workers
+        :param workers: number of workers
+            Values <=0 will create number of workers that will be same as number of cpus.
+        :param context: multiprocessing context for communication between the agent and its workers
+        :param heartbeat_interval: how often in seconds the agent sends heartbeat and checks its workers
+            It should be considerably smaller than agent_timeout of the pool.
+        :param reconnect_interval: how long in seconds it waits between attempts to connect
+        :param reconnect_timeout: for how long in seconds it tries to connect before it gives up
+            None means that it tries forever.
+        :param persistent: When True the agent does not stop when the pool stops its workers. It waits for a next pool
+            on the same address.
+        :param verbose: Determines whether information messages should be shown.
+        """
+        self.address = tuple(address)
+        self.authkey = authkey
+        self.workers_factory = workers_factory
+        self.workers = multiprocessing.cpu_count() if workers <= 0 else workers
+        self.context = multiprocessing.get_context() if context is None else context
+        self.heartbeat_interval = heartbeat_interval
+        self.reconnect_interval = reconnect_interval
+        self.reconnect_timeout = reconnect_timeout
+        self.persistent = persistent
+        self.verbose = verbose
+        self.agent_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self._wid_counter = 0
+
+    def run(self) -> int:
+        """
+        Serves pools until the workers are stopped by a pool (when it is not persistent) or until it is not able to
+        connect to the broker for reconnect_timeout seconds.
+
+        :return: number of pools that stopped the workers of this agent
+        """
+        served = 0
+        while True:
+            connection = self._connect()
+            if connection is None:
+                return served
+
+            try:
+                self._serve(*connection)
+                served += 1
+                if not self.persistent:
+                    return served
+            except (OSError, EOFError) as e:
+                if self.verbose:
+                    print(f"Agent {self.agent_id} lost connection to broker: {e}", file=sys.stderr)
+            finally:
+                # Proxies share one connection per broker address and thread, which is closed when the last of them
+                # is released. Nothing of the previous broker may be kept when a new one is connected on the same
+                # address, otherwise the new proxies would use the connection to the previous one.
+                del connection
+
+    def _connect(self) -> Optional[Tuple[WorkBroker, DictProxy]]:
+        """
+        Connects to the broker of a pool that is ready for work.
+
+        :return: connected broker and configuration of the pool or None when it was not able to connect in time
+        """
+        start = time.monotonic()
+        while True:
+            try:
+                connection = self._connect_ready()
+                if connection is not None:
+                    return connection
+            except (OSError, EOFError):
+                ...
+
+            if self.reconnect_timeout is not None and time.monotonic() - start >= self.reconnect_timeout:
+                return None
+            time.sleep(self.reconnect_interval)
+
+    def _connect_ready(self) -> Optional[Tuple[WorkBroker, DictProxy]]:
+        """
+        Makes one attempt to connect to the broker with new client and proxies. They are released when the attempt
+        fails, so the next attempt does not use their connection.
+
+        :return: connected broker and configuration of the pool or None when the pool is not ready for work
+        :raise OSError: when it is not able to connect to the broker
+        :raise EOFError: when the connection to broker is lost
+        """
+        broker = WorkBroker(self.address, self.authkey, ctx=self.context)
+        broker.connect()
+        config = broker.get_dict("config")
+        if config.get("ready", False) and not config.get("closing", False):
+            return broker, config
+        return None
+
+    def _serve(self, broker: WorkBroker, config: DictProxy):
+        """
+        Runs workers for the pool until they are stopped.
+
+        :param broker: connected broker of the pool
+        :param config: configuration of the pool
+        :raise OSError: when the connection to broker is lost
+        :raise EOFError: when the connection to broker is lost
+        """
+        work_queue = broker.get_queue("work")
+        results_queue = broker.get_queue("results")
+        workers_registry = broker.get_dict("workers")
+        chunks = broker.get_dict("chunks")
+        crashed = broker.get_dict("crashed")
+        agents = broker.get_dict("agents")
+        error_policy = config["error_policy"]
+        track_chunks = config["track_chunks"]
+        serializer = config["serializer"]
+        replace_queue = self.context.Queue()
+
+        def start_worker():
+            p = self.workers_factory.create()
+            p.wid = f"{self.agent_id}/{self._wid_counter}"
+            self._wid_counter += 1
+            p.work_queue = work_queue
+            p.results_queue = results_queue
+            p.replace_queue = replace_queue
+            p.error_policy = error_policy
+            p.serializer = serializer
+            if track_chunks:
+                p.current_chunk = RemoteChunkIndex(chunks, p.wid)
+            workers_registry[p.wid] = self.agent_id
+            p.start()
+            procs[p.wid] = p
+
+        beat = 0
+        agents[self.agent_id] = beat
+        procs: Dict[str, BaseFunctorWorker] = {}
+        replace = set()  # ids of workers that requested replacement
+        try:
+            for _ in range(self.workers):
+                start_worker()
+
+            while len(procs) > 0:
+                time.sleep(self.heartbeat_interval)
+                beat += 1
+                agents[self.agent_id] = beat
+
+                exited = [p for p in procs.values() if p.exitcode is not None]
+                # worker puts its request before it exits, so requests of all exited workers are already there
+                try:
+                    while True:
+                        replace.add(replace_queue.get(block=False))
+                except queue.Empty:
+                    ...
+
+                for p in exited:
+                    # joined process is no longer kept by multiprocessing, so its proxies are released with it
+                    p.join()
+                    wid = p.wid
+                    del procs[wid]
+                    if p.exitcode != 0:
+                        if self.verbose:
+                            print(f"Worker {wid} crashed with exit code {p.exitcode}.", file=sys.stderr)
+                        # the pool sends its chunk again
+                        crashed[wid] = chunks.pop(wid, -1)
+                    workers_registry.pop(wid, None)
+                    if (p.exitcode != 0 or wid in replace) and not config["closing"]:
+                        # a closing pool would not send stop order to the new worker
+                        start_worker()
+                    else:
+                        chunks.pop(wid, None)
+                    replace.discard(wid)
+
+            agents.pop(self.agent_id, None)
+        finally:
+            for p in procs.values():
+                if p.exitcode is None:
+                    p.terminate()
+                p.join()
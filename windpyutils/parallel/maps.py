@@ -5,63 +5,175 @@ Module with mapping functions.
 
 :author:     Martin Dočekal
 """
-import multiprocessing
-import queue
-from typing import TypeVar, Callable, Iterable, List
+import atexit
+import contextlib
+import threading
+from collections import OrderedDict
+from typing import TypeVar, Callable, Iterable, List, Generator, Union, Optional, Dict, Tuple
 
-from windpyutils.parallel.workers import FunRunner
+from windpyutils.parallel.chunks import AdaptiveChunkSize
+from windpyutils.parallel.pools import FunctorMap
+from windpyutils.parallel.serializers import Serializer
 
 T = TypeVar('T')
 R = TypeVar('R')
 
+MAX_PERSISTENT_POOLS = 8
+"""
+Maximal number of persistent pools. When it is exceeded the least recently used pools that are not in use are stopped.
+"""
+
+_persistent_pools: "OrderedDict[Tuple, FunctorMap]" = OrderedDict()
+_persistent_pools_users: Dict[FunctorMap, int] = {}
+_persistent_pools_lock = threading.Lock()
 
-def mul_p_map(f: Callable[[T], R], data: Iterable[T], workers: int = -1) -> List[R]:
+
+def _evict_persistent_pools() -> List[FunctorMap]:
     """
-    Runs function f with arguments X
+    Removes the least recently used pools that are not in use until the number of persistent pools is within the
+    limit. Must be called with the lock acquired.
 
-    :param f: Function you want to run in data-parallel way
-    :type f: Callable[[T], R]
-    :param data: The data that will be processed.
-    :type data:Iterable[T]
-    :param workers: Number of parallel workers.
-        Values <=0 will create number of workers that will be same as number of cpus.
-    :type workers: int
-    :return: Processed input.
-    :rtype:
+    :return: removed pools that should be stopped
+    """
+    evicted = []
+    for key in list(_persistent_pools):
+        if len(_persistent_pools) <= MAX_PERSISTENT_POOLS:
+            break
+        if _persistent_pools_users.get(_persistent_pools[key], 0) == 0:
+            fm = _persistent_pools.pop(key)
+            _persistent_pools_users.pop(fm, None)
+            evicted.append(fm)
+    return evicted
+
+
+@contextlib.contextmanager
+def _persistent_pool(f: Callable[[T], R], workers: int, backend: str,
+                     serializer: Optional[Serializer] = None) -> Generator[FunctorMap, None, None]:
     """
-    if workers <= 0:
-        workers = multiprocessing.cpu_count()
+    Gets persistent pool for given function or creates a new one.
+    The pool is marked as used until the context is left, so it is not stopped by eviction in the meantime.
+
+    :param f: function of the pool
+    :param workers: number of workers
+    :param backend: backend of workers
+    :param serializer: serializer of chunks
+    :return: the pool
+    """
+    key = (f, workers, backend) if serializer is None else (f, workers, backend, serializer)
+    with _persistent_pools_lock:
+        if key not in _persistent_pools:
+            _persistent_pools[key] = FunctorMap(f, workers, backend, serializer).__enter__()
+        _persistent_pools.move_to_end(key)
+        fm = _persistent_pools[key]
+        _persistent_pools_users[fm] = _persistent_pools_users.get(fm, 0) + 1
+        evicted = _evict_persistent_pools()
+
+    for e in evicted:
+        e.__exit__()
+
+    try:
+        yield fm
+    finally:
+        with _persistent_pools_lock:
+            if fm in _persistent_pools_users:
+                _persistent_pools_users[fm] -= 1
+            evicted = _evict_persistent_pools()
+
+        for e in evicted:
+            e.__exit__()
+
+
+def close_persistent_pools():
+    """
+    Stops workers of all persistent pools that were created by :func:`mul_p_imap` and :func:`mul_p_map`.
+    It is called automatically at exit.
+    """
+    with _persistent_pools_lock:
+        pools = list(_persistent_pools.values())
+        _persistent_pools.clear()
+        _persistent_pools_users.clear()
+
+    for fm in pools:
+        fm.__exit__()
 
-    procs = [FunRunner(pf=f) for _ in range(workers)]
 
-    for p in procs:
-        p.daemon = True
-        p.start()
+atexit.register(close_persistent_pools)
 
-    data_cnt = 0
 
-    res = []
+def mul_p_imap(f: Callable[[T], R], data: Iterable[T], workers: int = -1,
+               chunk_size: Optional[Union[int, AdaptiveChunkSize]] = None, backend: str = "process",
+               persistent: bool = False, max_in_flight: Optional[Union[int, float]] = None,
+               serializer: Optional[Serializer] = None) -> Generator[R, None, None]:
+    """
+    Runs function f on each element of data in parallel and streams the results in order as soon as they are ready.
 
-    for i, d in enumerate(data):
-        FunRunner.WORK_QUEUE.put((i, [d]))
-        data_cnt += 1
+    The data are read lazily and only bounded number of chunks is in flight, so it runs in constant memory
+    (with respect to the number of elements) even for infinite generators.
 
-        try:
-            # read the results
-            while True:
-                act = FunRunner.RESULTS_QUEUE.get(False)
-                res.append((act[0], act[1][0]))
-        except queue.Empty:
-            pass
+    :param f: Function you want to run in data-parallel way
+    :param data: The data that will be processed.
+    :param workers: Number of parallel workers.
+        Values <=0 will create number of workers that will be same as number of cpus.
+    :param chunk_size: size of a chunk that is sent to a worker
+        None means adaptive chunk size.
+    :param backend: Whether the workers are processes or threads.
+        See :data:`windpyutils.parallel.backends.BACKENDS`.
+    :param persistent: If True the workers are not stopped at the end and they are reused by following calls with
+        the same function, number of workers and backend, so the processes are not started again.
+        They are stopped by :func:`close_persistent_pools` or at exit.
+        The pool might be used by multiple calls at the same time.
+        The pools are cached by the function object, so a new lambda or closure in each call creates a new pool. At
+        most :data:`MAX_PERSISTENT_POOLS` pools are kept, the least recently used ones that are not in use are
+        stopped when the limit is exceeded.
+    :param max_in_flight: Maximal number of chunks that were sent to workers, but were not generated yet.
+        None means four chunks per worker. Use math.inf for no limit.
+    :param serializer: Serializer of chunks of data and results that are sent to and from workers.
+        None means default pickling. Persistent pools are shared only by calls with the same serializer.
+        See :class:`windpyutils.parallel.serializers.Serializer`.
+    :return: generator of results
+    :raise ValueError: when the backend is unknown or max_in_flight is not positive
+    """
+    if chunk_size is None:
+        chunk_size = AdaptiveChunkSize()
+
+    if persistent:
+        with _persistent_pool(f, workers, backend, serializer) as fm:
+            yield from fm(data, chunk_size, max_in_flight)
+        return
 
-    for _ in range(workers):
-        FunRunner.WORK_QUEUE.put(None)
+    with FunctorMap(f, workers, backend, serializer) as fm:
+        yield from fm(data, chunk_size, max_in_flight)
 
-    while len(res) < data_cnt:
-        act = FunRunner.RESULTS_QUEUE.get()
-        res.append((act[0], act[1][0]))
 
-    for p in procs:
-        p.join()
+def mul_p_map(f: Callable[[T], R], data: Iterable[T], workers: int = -1,
+              chunk_size: Optional[Union[int, AdaptiveChunkSize]] = None, backend: str = "process",
+              persistent: bool = False, max_in_flight: Optional[Union[int, float]] = None,
+              serializer: Optional[Serializer] = None) -> List[R]:
+    """
+    Runs function f with arguments X
 
-    return [r for i, r in sorted(res, key=lambda x: x[0])]
+    :param f: Function you want to run in data-parallel way
+    :type f: Callable[[T], R]
+    :param data: The data that will be processed.
+    :type data:Iterable[T]
+    :param workers: Number of parallel workers.
+        Values <=0 will create number of workers that will be same as number of cpus.
+    :type workers: int
+    :param chunk_size: size of a chunk that is sent to a worker
+        None means adaptive chunk size.
+    :type chunk_size: Optional[Union[int, AdaptiveChunkSize]]
+    :param backend: Whether the workers are processes or threads.
+        See :data:`windpyutils.parallel.backends.BACKENDS`.
+    :type backend: str
+    :param persistent: If True the workers are reused by following calls. See :func:`mul_p_imap`.
+    :type persistent: bool
+    :param max_in_flight: Maximal number of chunks that were sent to workers, but were not returned yet.
+        See :func:`mul_p_imap`.
+    :type max_in_flight: Optional[Union[int, float]]
+    :param serializer: Serializer of chunks. See :func:`mul_p_imap`.
+    :type serializer: Optional[Serializer]
+    :return: Processed input.
+    :rtype: List[R]
+    :raise ValueError: when the backend is unknown
+    """
+    return list(mul_p_imap(f, data, workers, chunk_size, backend, persistent, max_in_flight, serializer))
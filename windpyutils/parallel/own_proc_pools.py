@@ -5,24 +5,329 @@ This module contains multiprocessing pool that allows to use own process classes
 
 :author:     Martin Dočekal
 """
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
 import math
+import mmap
 import multiprocessing
+import os
+import pickle
 import queue
 import sys
+import tempfile
 import threading
+import time
+import traceback
 from abc import abstractmethod, ABC
-from multiprocessing import Process
+from multiprocessing import Process, resource_tracker
 from multiprocessing.context import BaseContext
+from multiprocessing.managers import SyncManager
 from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from multiprocessing.shared_memory import SharedMemory
 from threading import Thread
-from typing import TypeVar, Iterable, Generator, List, Generic, Optional, Union, Tuple
+from typing import TypeVar, Iterable, Generator, List, Generic, Optional, Union, Tuple, Callable, Hashable, \
+    AsyncIterable, AsyncGenerator, Any, Dict, Iterator
 
 from windpyutils.buffers import Buffer
+from windpyutils.parallel.backends import BACKENDS, resolve_backend
+from windpyutils.parallel.chunks import AdaptiveChunkSize, chunking
+from windpyutils.parallel.pool_metrics import PoolMetrics
+from windpyutils.parallel.serializers import Serializer, SerializedChunk, _AttachedSharedMemory, unlink_segments
 
 T = TypeVar('T')
 R = TypeVar('R')
 
 
+class WorkerError(Exception):
+    """
+    Error of a worker that was raised when it processed an item.
+    It is transported to the pool together with formatted traceback.
+    When it is raised from imap, results of other chunks of that call may still be on their way, so the pool should
+    not be used for another call.
+
+    :ivar exception: the original exception
+        When the original exception is not picklable it is replaced with RuntimeError with its representation.
+    :vartype exception: Exception
+    :ivar traceback: formatted traceback from worker
+    :vartype traceback: str
+    :ivar chunk_index: index of chunk that contains the item
+    :vartype chunk_index: int
+    :ivar item_index: index of the item in the chunk
+    :vartype item_index: int
+    """
+
+    def __init__(self, exception: Exception, traceback: str, chunk_index: int, item_index: int):
+        super().__init__(exception, traceback, chunk_index, item_index)
+        self.exception = exception
+        self.traceback = traceback
+        self.chunk_index = chunk_index
+        self.item_index = item_index
+
+    @classmethod
+    def from_exception(cls, exception: Exception, chunk_index: int, item_index: int) -> "WorkerError":
+        """
+        Creates error from exception that is being handled.
+
+        :param exception: the exception
+        :param chunk_index: index of chunk that contains the item
+        :param item_index: index of the item in the chunk
+        :return: the error
+        """
+        try:
+            pickle.dumps(exception)
+        except Exception:
+            exception = RuntimeError(repr(exception))
+        return cls(exception, traceback.format_exc(), chunk_index, item_index)
+
+    def __str__(self):
+        return f"{self.exception!r} in chunk {self.chunk_index} at item {self.item_index}\n{self.traceback}"
+
+
+class DeadlineExpiredError(Exception):
+    """
+    Error of an item that was dropped by :class:`PriorityScheduler`, because its deadline expired before it was sent
+    to workers.
+
+    :ivar deadline: the expired deadline (in time.monotonic clock)
+    :vartype deadline: float
+    """
+
+    def __init__(self, deadline: float):
+        super().__init__(deadline)
+        self.deadline = deadline
+
+    def __str__(self):
+        return f"The deadline {self.deadline} expired before the item was sent to workers."
+
+
+class SharedMemoryChunk:
+    """
+    Descriptor of a chunk of results that was written into a shared memory segment.
+    Only the descriptor is sent through the results queue.
+
+    The segment contains the chunk pickled with protocol 5 followed by its out-of-band buffers.
+    """
+
+    __slots__ = ("name", "data_len", "buffers_lens")
+
+    def __init__(self, name: str, data_len: int, buffers_lens: List[int]):
+        """
+        :param name: name of shared memory segment
+        :param data_len: length of pickled chunk at the beginning of the segment
+        :param buffers_lens: lengths of out-of-band buffers that follow the pickled chunk
+        """
+        self.name = name
+        self.data_len = data_len
+        self.buffers_lens = buffers_lens
+
+    @classmethod
+    def write(cls, chunk: List[R], threshold: int) -> Union["SharedMemoryChunk", List[R]]:
+        """
+        Writes chunk of results into a new shared memory segment.
+
+        :param chunk: chunk of results
+        :param threshold: minimal size in bytes of pickled chunk (including out-of-band buffers) that is written
+            into shared memory
+        :return: descriptor of written chunk or the chunk itself when it is smaller than the threshold
+        """
+        buffers = []
+        data = pickle.dumps(chunk, protocol=5, buffer_callback=buffers.append)
+        buffers = [b.raw() for b in buffers]
+        size = len(data) + sum(b.nbytes for b in buffers)
+
+        if size < threshold:
+            return chunk
+
+        shm = SharedMemory(create=True, size=size)
+        try:
+            shm.buf[:len(data)] = data
+            offset = len(data)
+            for b in buffers:
+                shm.buf[offset:offset + b.nbytes] = b
+                offset += b.nbytes
+            return cls(shm.name, len(data), [b.nbytes for b in buffers])
+        finally:
+            shm.close()
+
+    def read(self) -> List[R]:
+        """
+        Reads the chunk from shared memory and unlinks the segment.
+
+        Out-of-band buffers (e.g. of NumPy arrays or pickle.PickleBuffer) are not copied, they are views
+        to the shared memory that is released when all of them are garbage collected.
+
+        :return: chunk of results
+        """
+        shm = _AttachedSharedMemory(self.name)
+        shm.unlink()
+        try:
+            buffers = []
+            offset = self.data_len
+            for buffer_len in self.buffers_lens:
+                buffers.append(shm.buf[offset:offset + buffer_len])
+                offset += buffer_len
+
+            return pickle.loads(shm.buf[:self.data_len], buffers=buffers)
+        finally:
+            shm.close()
+
+    def unlink(self):
+        """
+        Releases the shared memory segment without reading it.
+        """
+        shm = _AttachedSharedMemory(self.name)
+        shm.unlink()
+        shm.close()
+
+
+class SharedData:
+    """
+    Read-only data that are published once by the parent process and attached by workers without copying.
+
+    The data are pickled with protocol 5 and written, together with their out-of-band buffers, into a shared memory
+    segment or into a file that is memory mapped by workers. Only the small handle is sent to workers.
+
+    Out-of-band buffers (NumPy arrays, pickle.PickleBuffer) are not copied when the data are loaded, they are
+    read-only views to the shared mapping, so the pages are shared by all workers. Other objects (e.g. dict) are
+    unpickled, so each worker has its own copy of them. Big data should thus be stored in a compact form, e.g. a dict
+    could be represented by sorted NumPy arrays of keys and values. A byte buffer wrapped in pickle.PickleBuffer is
+    loaded as read-only memoryview.
+
+    Example:
+        >>> tables = SharedData.publish({"ids": numpy.arange(10)})
+        >>> tables.load()["ids"]
+        array([0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+        >>> tables.unlink()
+    """
+
+    def __init__(self, name: Optional[str], path: Optional[str], data_len: int, buffers_lens: List[int]):
+        """
+        :param name: name of shared memory segment or None when the data are in a file
+        :param path: path to memory mapped file or None when the data are in shared memory
+        :param data_len: length of pickled data at the beginning of the segment
+        :param buffers_lens: lengths of out-of-band buffers that follow the pickled data
+        """
+        self.name = name
+        self.path = path
+        self.data_len = data_len
+        self.buffers_lens = buffers_lens
+        self._data = None
+        self._loaded = False
+
+    def __getstate__(self):
+        # loaded data are not sent, each process attaches on its own
+        return self.name, self.path, self.data_len, self.buffers_lens
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @classmethod
+    def publish(cls, data: Any, path: Optional[str] = None) -> "SharedData":
+        """
+        Writes data into a new shared memory segment or file.
+
+        :param data: the data
+        :param path: Path to a file that will be created and memory mapped by workers.
+            It is useful when the data are bigger than the shared memory of the system allows.
+            None means that shared memory is used.
+        :return: handle of published data
+        """
+        buffers = []
+        pickled = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+        buffers = [b.raw() for b in buffers]
+
+        if path is None:
+            shm = SharedMemory(create=True, size=len(pickled) + sum(b.nbytes for b in buffers))
+            try:
+                shm.buf[:len(pickled)] = pickled
+                offset = len(pickled)
+                for b in buffers:
+                    shm.buf[offset:offset + b.nbytes] = b
+                    offset += b.nbytes
+                return cls(shm.name, None, len(pickled), [b.nbytes for b in buffers])
+            finally:
+                shm.close()
+
+        with open(path, "wb") as f:
+            f.write(pickled)
+            for b in buffers:
+                f.write(b)
+        return cls(None, path, len(pickled), [b.nbytes for b in buffers])
+
+    def load(self) -> Any:
+        """
+        Attaches to published data. The data are loaded only once in each process, following calls return the
+        same object.
+
+        :return: the data
+        """
+        if not self._loaded:
+            if self.path is None:
+                shm = _AttachedSharedMemory(self.name)
+                try:
+                    self._data = self._unpickle(shm.buf.toreadonly())
+                finally:
+                    shm.close()
+            else:
+                with open(self.path, "rb") as f:
+                    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._data = self._unpickle(memoryview(mapping))
+                try:
+                    mapping.close()
+                except BufferError:
+                    # views are still in use, the mapping lives with them
+                    ...
+            self._loaded = True
+        return self._data
+
+    def _unpickle(self, buf: memoryview) -> Any:
+        """
+        Unpickles data from mapped memory.
+
+        :param buf: the mapped memory
+        :return: the data with out-of-band buffers that are views to the memory
+        """
+        buffers = []
+        offset = self.data_len
+        for buffer_len in self.buffers_lens:
+            buffers.append(buf[offset:offset + buffer_len])
+            offset += buffer_len
+        with buf[:self.data_len] as pickled:
+            return pickle.loads(pickled, buffers=buffers)
+
+    def unlink(self):
+        """
+        Removes the published data. Processes that already loaded them can still use them.
+        """
+        try:
+            if self.path is None:
+                shm = _AttachedSharedMemory(self.name)
+                shm.unlink()
+                shm.close()
+            else:
+                os.remove(self.path)
+        except FileNotFoundError:
+            ...
+
+
+def resident_memory() -> Optional[int]:
+    """
+    Resident set size of this process read from /proc.
+
+    :return: size in bytes or None when it is not available (e.g. on other systems than Linux)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
 class BaseFunctorWorker(BaseProcess, Generic[T, R]):
     """
     Functor worker for pools.
@@ -36,9 +341,53 @@ class BaseFunctorWorker(BaseProcess, Generic[T, R]):
     :ivar results_queue: queue that is used for sending results
         If None then the default from pool will be used.
     :vartype results_queue: Optional[Queue]
+    :ivar shared_memory_threshold: minimal size in bytes of pickled chunk of results that is sent through shared
+        memory instead of the results queue
+        None means that shared memory is not used.
+    :vartype shared_memory_threshold: Optional[int]
+    :ivar steal_queues: work queues of other workers from which this worker steals work when its own queue is empty
+        None means that stealing is not used.
+    :vartype steal_queues: Optional[List[Queue]]
+    :ivar current_chunk: shared value with index of the last chunk this worker took from a queue
+        It is used by fault tolerant pool to find out which chunk was lost when this worker crashed.
+        None means that it is not tracked.
+    :vartype current_chunk: Optional[Value]
+    :ivar taken_chunks: shared array with number of chunks this worker took from queues followed by a ring of indices
+        of the last taken chunks
+        It is used by fault tolerant pool with queue transport to find out which chunks were lost together with
+        unsent results when this worker crashed.
+        None means that it is not tracked.
+    :vartype taken_chunks: Optional[Array]
+    :ivar error_policy: what to do when processing of an item raises an exception
+        raise       the :class:`WorkerError` is sent instead of results of whole chunk and the pool raises it
+        skip        the item is skipped
+        sentinel    the :class:`WorkerError` is returned as result of the item
+    :vartype error_policy: str
+    :ivar shared_data: read-only data published by the pool, use :meth:`SharedData.load` in :meth:`begin` to
+        attach them
+        If None then the default from pool will be used.
+    :vartype shared_data: Optional[Dict[str, SharedData]]
+    :ivar backend: whether the worker runs in a new process or in a new thread of the current process
+        process     the worker is started as a process
+        thread      the worker is started as a thread, which is useful for work that releases GIL
+    :vartype backend: str
+    :ivar serializer: serializer of chunks of work and results
+        None means that they are pickled by the transport as they are.
+        If None then the default from pool will be used.
+    :vartype serializer: Optional[Serializer]
+    :ivar retire: Event that is set by pool when pre-spawned replacement of this worker is ready.
+        When it is not None, a worker that exceeded max_rss keeps working until the event is set.
+        None means that the worker stops immediately when it exceeds max_rss.
+    :vartype retire: Optional[Event]
+    :ivar activate: Event that is set by pool when warm standby worker should start working.
+        When it is not None, the worker waits after its begin method until the event is set.
+    :vartype activate: Optional[Event]
     """
 
-    def __init__(self, context: BaseContext, max_chunks_per_worker: float = math.inf):
+    STEAL_INTERVAL = 0.01
+    """How long in seconds a worker waits for its own work before it tries to steal work."""
+
+    def __init__(self, context: BaseContext, max_chunks_per_worker: float = math.inf, max_rss: Optional[int] = None):
         """
         Initialization of parallel worker.
 
@@ -48,16 +397,33 @@ class BaseFunctorWorker(BaseProcess, Generic[T, R]):
 
             This is particular useful when you observe increasing memory, as it seems there is a known problem
                 with that: https://stackoverflow.com/questions/21485319/high-memory-usage-using-python-multiprocessing
+        :param max_rss: Maximal resident memory in bytes. The worker checks its resident memory after each chunk and
+            when it is exceeded, it asks for replacement and stops.
+            It is used only with pool that supports replace queue and on systems with /proc. It is ignored by thread
+            backend, as threads share memory of the whole process.
         """
         super().__init__()
 
         self.wid = None
         self.work_queue = None
         self.results_queue = None
-        self.results_queue_lock = None
         self.replace_queue = None
+        self.shared_memory_threshold = None
+        self.steal_queues = None
+        self.current_chunk = None
+        self.taken_chunks = None
+        self.error_policy = "raise"
+        self.shared_data = None
+        self.backend = "process"
+        self.serializer = None
         self.begin_finished = context.Event()
         self.max_chunks_per_worker = max_chunks_per_worker
+        self.max_rss = max_rss
+        self.retire = None
+        self.activate = None
+        self._replacement_requested = False
+        self._thread = None
+        self._thread_exitcode = None
 
     @abstractmethod
     def __call__(self, inp: T) -> R:
@@ -81,34 +447,203 @@ class BaseFunctorWorker(BaseProcess, Generic[T, R]):
         """
         pass
 
+    def start(self):
+        """
+        Starts the worker in a new process or in a new thread according to the backend.
+        """
+        if self.backend == "thread":
+            self._thread = Thread(target=self._run_thread, name=self.name)
+            self._thread.start()
+        else:
+            super().start()
+
+    def _run_thread(self):
+        """
+        Runs the worker in a thread and sets its exit code in the same way as a process would.
+        """
+        try:
+            self.run()
+            self._thread_exitcode = 0
+        except BaseException:
+            traceback.print_exc()
+            self._thread_exitcode = 1
+
+    def join(self, timeout: Optional[float] = None):
+        """
+        Waits until the worker finishes.
+
+        :param timeout: maximal time in seconds to wait
+        """
+        if self._thread is None:
+            super().join(timeout)
+        else:
+            self._thread.join(timeout)
+
+    def is_alive(self) -> bool:
+        """
+        Whether the worker is running.
+        """
+        if self._thread is None:
+            return super().is_alive()
+        return self._thread.is_alive()
+
+    @property
+    def exitcode(self) -> Optional[int]:
+        """
+        Exit code of the worker or None when it is still running or was not started yet.
+        """
+        if self._thread is None:
+            return super().exitcode
+        return None if self._thread.is_alive() else self._thread_exitcode
+
+    def _get_work(self) -> Tuple[Optional[Tuple[int, List[T]]], bool]:
+        """
+        Gets work from own work queue. If stealing is used and own queue is empty it tries to steal work from
+        the others.
+
+        :return: work item from queue and whether it was stolen
+            The work item is None when the worker should stop.
+        """
+        if not self.steal_queues and not self._replacement_requested:
+            return self.work_queue.get(), False
+
+        while True:
+            try:
+                return self.work_queue.get(timeout=self.STEAL_INTERVAL), False
+            except queue.Empty:
+                ...
+
+            if self._replacement_requested and self.retire.is_set():
+                return None, False
+
+            for q in self.steal_queues or []:
+                try:
+                    q_item = q.get(block=False)
+                except queue.Empty:
+                    continue
+
+                if q_item is None:
+                    # stop order for other worker
+                    q.put(None)
+                    continue
+
+                return q_item, True
+
+    def _memory_exceeded(self) -> bool:
+        """
+        Checks whether the worker should be recycled because of its resident memory.
+
+        :return: True when max_rss is exceeded
+        """
+        if self.max_rss is None or self.replace_queue is None or self.backend == "thread":
+            return False
+        rss = resident_memory()
+        return rss is not None and rss >= self.max_rss
+
+    def _process(self, i: int, data_list: List[T]) -> Tuple[Union[List[R], WorkerError], int]:
+        """
+        Processes a chunk with respect to the error policy.
+
+        :param i: index of the chunk
+        :param data_list: items of the chunk
+        :return: results or error when the chunk failed and number of errors
+        """
+        res = []
+        append = res.append
+        errors = 0
+        for item_i, x in enumerate(data_list):
+            if isinstance(x, WorkerError):
+                # sentinel of previous pipeline stage
+                append(x)
+                continue
+            try:
+                append(self(x))
+            except Exception as e:
+                errors += 1
+                error = WorkerError.from_exception(e, i, item_i)
+                if self.error_policy == "raise":
+                    return error, errors
+                if self.error_policy == "sentinel":
+                    append(error)
+
+        return res, errors
+
     def run(self) -> None:
         """
         Run the process.
         """
         try:
             self.begin_finished.clear()
+            begin_start = time.perf_counter()
             self.begin()
+            begin_time = time.perf_counter() - begin_start
             self.begin_finished.set()
 
+            if self.activate is not None:
+                # warm standby waits until it replaces other worker
+                self.activate.wait()
+
+            wait_start = None
+            blocked_time = 0.0
             while self.max_chunks_per_worker > 0:
-                q_item = self.work_queue.get()
+                q_item, stolen = self._get_work()
+                processing_start = time.perf_counter()
+                wait_time = 0.0 if wait_start is None else processing_start - wait_start
 
                 if q_item is None:
                     # all done
                     break
 
-                i, data_list = q_item
-
-                res = (i, [self(x) for x in data_list])
+                # work from previous pipeline stage also contains its statistics
+                i, data_list = q_item[0], q_item[1]
+                if self.current_chunk is not None:
+                    self.current_chunk.value = i
+                if self.taken_chunks is not None:
+                    taken_cnt = self.taken_chunks[0]
+                    self.taken_chunks[1 + taken_cnt % (len(self.taken_chunks) - 1)] = i
+                    self.taken_chunks[0] = taken_cnt + 1
+
+                if isinstance(data_list, WorkerError):
+                    # chunk failed in previous pipeline stage
+                    res, errors = data_list, 0
+                else:
+                    if isinstance(data_list, SharedMemoryChunk):
+                        data_list = data_list.read()
+                    elif isinstance(data_list, SerializedChunk):
+                        data_list = self.serializer.deserialize(data_list)
+                    res, errors = self._process(i, data_list)
+                if self.shared_memory_threshold is not None and not isinstance(res, WorkerError):
+                    res = SharedMemoryChunk.write(res, self.shared_memory_threshold)
+                if self.serializer is not None and isinstance(res, list):
+                    res = self.serializer.serialize(res)
+                # statistics for pool are: wid, processing time, wait time, blocked time, begin time, stolen, errors
+                res = (i, res, (self.wid, time.perf_counter() - processing_start, wait_time, blocked_time, begin_time,
+                                stolen, errors))
+                begin_time = None
+                blocked_time = 0.0
                 try:
-                    with self.results_queue_lock:
-                        self.results_queue.put(res, block=False)
+                    self.results_queue.put(res, block=False)
                 except queue.Full:
+                    blocked_start = time.perf_counter()
                     self.results_queue.put(res)
+                    blocked_time = time.perf_counter() - blocked_start
+                wait_start = time.perf_counter()
 
                 self.max_chunks_per_worker -= 1
+
+                if self._replacement_requested:
+                    if self.retire.is_set():
+                        # pre-spawned replacement took over
+                        break
+                elif self._memory_exceeded():
+                    if self.retire is None:
+                        self.max_chunks_per_worker = 0
+                    else:
+                        # keeps working until the replacement is ready
+                        self._replacement_requested = True
+                        self.replace_queue.put(self.wid)
             else:
-                if self.replace_queue is not None:
+                if self.replace_queue is not None and not self._replacement_requested:
                     self.replace_queue.put(self.wid)
 
         finally:
@@ -130,7 +665,7 @@ class FunctorWorker(Process, BaseFunctorWorker, ABC):
     :vartype results_queue: Optional[Queue]
     """
 
-    def __init__(self, max_chunks_per_worker: float = math.inf):
+    def __init__(self, max_chunks_per_worker: float = math.inf, max_rss: Optional[int] = None):
         """
 
         :param max_chunks_per_worker: Defines maximal number of chunks that a worker will do before it will stop
@@ -138,9 +673,11 @@ class FunctorWorker(Process, BaseFunctorWorker, ABC):
 
             This is particular useful when you observe increasing memory, as it seems there is a known problem
                 with that: https://stackoverflow.com/questions/21485319/high-memory-usage-using-python-multiprocessing
+        :param max_rss: Maximal resident memory in bytes after which the worker asks for replacement.
+            See :class:`BaseFunctorWorker` for more information.
         """
         Process.__init__(self)
-        BaseFunctorWorker.__init__(self, multiprocessing.get_context(), max_chunks_per_worker)
+        BaseFunctorWorker.__init__(self, multiprocessing.get_context(), max_chunks_per_worker, max_rss)
 
 
 class CMThread(Thread):
@@ -156,6 +693,7 @@ class CMThread(Thread):
 
     def stop(self):
         self.stop_event.set()
+        self.run_event.set()
         self.join()
 
     def __enter__(self):
@@ -176,7 +714,10 @@ class FunctorPool:
         Thread for sending work to workers.
         """
 
-        def __init__(self, pool: "FunctorPool", data: Iterable[T], chunk_size: int = 1):
+        STOP_CHECK_INTERVAL = 0.1
+        """How often in seconds it checks whether it should stop while it is waiting for space in work queue."""
+
+        def __init__(self, pool: "FunctorPool", data: Iterable[T], chunk_size: Union[int, AdaptiveChunkSize] = 1):
             """
             :param pool: pool that is using this thread to send work
             :param data: iterable of data that should be passed to functor
@@ -186,23 +727,40 @@ class FunctorPool:
             self.data = data
             self.chunk_size = chunk_size
             self.pool = pool
+            # set before the thread starts, so the results loop does not end before the sending begins
+            self.pool._sending_work = True
 
         def run(self) -> None:
             self.pool._sending_work = True
             self.pool._data_cnt = 0
-
-            def chunking(d):
-                ch = []
-                for x in d:
-                    ch.append(x)
-                    if len(ch) == self.chunk_size:
-                        yield ch
-                        ch = []
-                if len(ch) > 0:
-                    yield ch
-
-            for i, chunk in enumerate(chunking(self.data)):
-                self.pool._work_queue.put((i, chunk))
+            self.pool._in_flight = {}
+            self.pool._retries = {}
+            self.pool._resend.clear()
+            self.pool.poisoned = {}
+
+            metrics = self.pool.metrics
+            affinity = self.pool.affinity
+            serializer = self.pool.serializer
+            shared_memory_threshold = self.pool.shared_memory_threshold
+            work_queues = self.pool._work_queues
+            work_queue = self.pool._work_queue
+            for i, chunk in enumerate(chunking(self.data, self.chunk_size, affinity)):
+                if affinity is not None:
+                    work_queue = work_queues[hash(affinity(chunk[0])) % len(work_queues)]
+                if self.pool.max_retries is not None:
+                    self.pool._in_flight[i] = chunk
+
+                if serializer is None:
+                    work = chunk
+                else:
+                    # names of shared memory segments are kept until results of the chunk are received
+                    segments = None if shared_memory_threshold is None else self.pool._segments.setdefault(i, [])
+                    work = serializer.serialize(chunk, shared_memory_threshold, segments)
+                put_start = time.perf_counter()
+                if not self._put(work_queue, (i, work)):
+                    break
+                if metrics is not None:
+                    metrics.chunk_sent(len(chunk), time.perf_counter() - put_start)
                 self.pool._data_cnt += 1
                 if self.stop_event.is_set():
                     break
@@ -210,10 +768,126 @@ class FunctorPool:
 
             self.pool._sending_work = False
 
+        def _put(self, work_queue: Queue, item: Tuple[int, List[T]]) -> bool:
+            """
+            Puts work into queue. When the queue is full it waits until there is a space or this thread is stopped.
+
+            :param work_queue: queue for the work
+            :param item: the work
+            :return: False when the thread was stopped before the work was put into queue
+            """
+            while True:
+                try:
+                    work_queue.put(item, timeout=self.STOP_CHECK_INTERVAL)
+                    return True
+                except queue.Full:
+                    if self.stop_event.is_set():
+                        return False
+
+    class AsyncResultsThread(CMThread):
+        """
+        Thread that runs synchronous imap of a pool and passes its results to an event loop.
+        """
+
+        STOP_CHECK_INTERVAL = 0.1
+        """How often in seconds it checks whether it should stop while it is waiting for the event loop."""
+
+        def __init__(self, imap: Callable[[Iterable[T]], Iterable[R]], data: Union[Iterable[T], AsyncIterable[T]],
+                     loop: asyncio.AbstractEventLoop, max_pending: int):
+            """
+            Must be created in the event loop.
+
+            :param imap: synchronous imap of a pool that is called with data
+            :param data: iterable or async iterable of data that should be passed to functor
+                The async iterable is iterated in the event loop.
+            :param loop: the event loop
+            :param max_pending: maximal number of results that are waiting for the event loop
+            """
+            super().__init__()
+            self.imap = imap
+            self.data = data
+            self.loop = loop
+            self.results = asyncio.Queue()
+            self.slots = threading.Semaphore(max_pending)
+
+        def run(self) -> None:
+            results = self.imap(self._iterate_data())
+            try:
+                for x in results:
+                    while not self.slots.acquire(timeout=self.STOP_CHECK_INTERVAL):
+                        if self.stop_event.is_set():
+                            return
+                    self._send(("result", x))
+                self._send(("end", None))
+            except BaseException as e:
+                self._send(("error", e))
+            finally:
+                results.close()
+
+        def _iterate_data(self) -> Generator[T, None, None]:
+            """
+            Iterates data. The async iterable is iterated in the event loop.
+
+            :return: generator of data
+            """
+            if not isinstance(self.data, AsyncIterable):
+                yield from self.data
+                return
+
+            iterator = self.data.__aiter__()
+            while not self.stop_event.is_set():
+                future = asyncio.run_coroutine_threadsafe(iterator.__anext__(), self.loop)
+                while True:
+                    try:
+                        x = future.result(timeout=self.STOP_CHECK_INTERVAL)
+                        break
+                    except StopAsyncIteration:
+                        return
+                    except concurrent.futures.TimeoutError:
+                        if self.stop_event.is_set():
+                            future.cancel()
+                            return
+                yield x
+
+        def _send(self, message: Tuple[str, Any]):
+            """
+            Sends message to the event loop.
+
+            :param message: tuple of message type and its value
+            """
+            try:
+                self.loop.call_soon_threadsafe(self.results.put_nowait, message)
+            except RuntimeError:
+                # the event loop is closed so there is no one to receive the message
+                ...
+
+    TRANSPORTS = ("manager", "queue")
+    """Supported transports of work and results between the pool and workers."""
+
+    BACKENDS = BACKENDS
+    """Supported backends of workers."""
+
+    ERROR_POLICIES = ("raise", "skip", "sentinel")
+    """Supported policies for exceptions raised by workers when they process items."""
+
+    LIVENESS_INTERVAL = 1.0
+    """How often in seconds a fault tolerant pool checks whether its workers are alive."""
+
+    RESULTS_CHECK_INTERVAL = 0.1
+    """How often in seconds it checks whether the sending of work finished while it is waiting for results."""
+
+    TAKEN_CHUNKS = 64
+    """How many last taken chunks each worker of fault tolerant pool with queue transport remembers."""
+
     def __init__(self, workers: List[BaseFunctorWorker[T, R]], context: Optional[BaseContext] = None,
                  work_queue_maxsize: Optional[Union[int, float]] = 1.0,
                  results_queue_maxsize: Optional[Union[int, float]] = None, verbose: bool = False,
-                 join_timeout: Optional[int] = None):
+                 join_timeout: Optional[int] = None, transport: str = "manager",
+                 shared_memory_threshold: Optional[int] = None, metrics: Optional[PoolMetrics] = None,
+                 affinity: Optional[Callable[[T], Hashable]] = None, max_retries: Optional[int] = None,
+                 error_policy: str = "raise", shared_data: Optional[Dict[str, Any]] = None,
+                 shared_data_dir: Optional[str] = None, backend: str = "process",
+                 serializer: Optional[Serializer] = None):
         """
         Initialization of pool.
 
@@ -228,11 +902,72 @@ class FunctorPool:
             int the max size is just results_queue_maxsize
         :param verbose: Determines whether information messages should be shown.
         :param join_timeout: Timout for process joining.
+        :param transport: Determines queues that are used for sending work and results.
+            manager     queues are proxies of queues living in a multiprocessing manager process,
+                        so each put and get is a round trip to the manager process
+            queue       queues of given multiprocessing context (pipes) directly between this process and workers
+        :param shared_memory_threshold: Chunks of results which pickled size (including out-of-band buffers) is at
+            least this number of bytes are written by workers into shared memory and only their descriptor is sent
+            through the results queue.
+            Out-of-band buffers (NumPy arrays, pickle.PickleBuffer) are not copied when results are read, they are
+            views to the shared memory. Be aware that each chunk, which views are still in use, keeps one file
+            descriptor open.
+            With serializer, out-of-band frames of serialized chunks of work are also sent through shared memory, when
+            their total size is at least this number of bytes.
+            None means that shared memory is not used. It is not supported on Windows.
+        :param metrics: Optional metrics that will be filled with measurements of workers and the pool.
+        :param affinity: Optional affinity key function. When it is used, each worker has its own work queue and
+            chunks with the same key are sent to the same worker, so it can reuse its warm caches (e.g. loaded
+            model or opened file). A chunk contains only items with the same key. A worker, which queue is empty,
+            steals work from queues of the others.
+            The work queue max size is divided among the workers.
+        :param max_retries: Enables fault tolerance when it is not None. The pool monitors its workers and when
+            a worker crashes (non-zero exit code, e.g. OOM kill or exception), it is replaced by a new one (if the
+            pool is able to create it) and its chunk is sent again. A chunk that crashed a worker more than
+            max_retries times is considered as poisoned. It is skipped and reported in :attr:`poisoned`.
+            It is more reliable with manager transport, as a process killed while it is using a context queue
+            might corrupt it.
+        :param error_policy: What to do when a worker raises an exception while it processes an item. The worker
+            continues with the next chunk in all cases.
+            raise       :class:`WorkerError` with the original exception and traceback is raised in this process
+            skip        the item is skipped
+            sentinel    :class:`WorkerError` is returned as result of the item
+        :param shared_data: Read-only data that are published once for all workers. They are published when the pool
+            is entered and released when it exits. Workers get handles of them in :attr:`BaseFunctorWorker.shared_data`
+            under the same names and attach them without copying in begin method with :meth:`SharedData.load`.
+        :param shared_data_dir: Directory where the shared data are written into memory mapped files.
+            None means that shared memory is used.
+        :param backend: Determines how workers are started.
+            process     each worker runs in its own process
+            thread      each worker runs in a thread of this process and plain queues are used, so nothing is
+                        pickled and the transport is ignored
+                        It is useful for work that releases GIL (e.g. NumPy, zlib, hashlib), as it avoids the process
+                        and pickling overhead.
+            auto        thread on free-threaded (no GIL) interpreter, process otherwise
+            The resolved backend is in :attr:`backend`.
+        :param serializer: Serializer of chunks of work and results (e.g. :class:`PickleSerializer` with out-of-band
+            buffers for large arrays or :class:`MsgpackSerializer` for plain data). The transport pickles only
+            the serialized frames. Out-of-band frames are copied into its pickle stream, unless they are sent through
+            shared memory (see shared_memory_threshold).
+            None means that the chunks are pickled by the transport as they are. It is ignored by thread backend, as
+            nothing is pickled there. Chunks of results that are sent through shared memory are not serialized.
+        :raise ValueError: when the transport, error policy or backend is unknown or shared memory is not supported
         """
 
         if context is None:
             context = multiprocessing.get_context()
 
+        if transport not in self.TRANSPORTS:
+            raise ValueError(f"Unknown transport {transport}. Use one of {self.TRANSPORTS}.")
+
+        if error_policy not in self.ERROR_POLICIES:
+            raise ValueError(f"Unknown error policy {error_policy}. Use one of {self.ERROR_POLICIES}.")
+
+        backend = resolve_backend(backend)
+
+        if shared_memory_threshold is not None and os.name == "nt":
+            raise ValueError("Shared memory for results is not supported on Windows.")
+
         if isinstance(work_queue_maxsize, float):
             work_queue_maxsize = int(len(workers) * work_queue_maxsize)
 
@@ -241,11 +976,39 @@ class FunctorPool:
 
         self._results_queue_maxsize = math.inf if results_queue_maxsize is None else results_queue_maxsize
         self._wid_counter = 0
-        self._manager = context.Manager()
-        self._work_queue = self._manager.Queue() if work_queue_maxsize is None else self._manager.Queue(work_queue_maxsize)
-        self._results_queue = self._manager.Queue() if results_queue_maxsize is None else self._manager.Queue(results_queue_maxsize)
-        self._results_queue_lock = context.Lock()
+        self._context = context
+        self.transport = transport
+        self.backend = backend
+        self._manager = self._create_manager() if transport == "manager" and backend == "process" else None
+        self.affinity = affinity
+        if affinity is None:
+            self._work_queue = self._create_queue(work_queue_maxsize)
+            self._work_queues = None
+        else:
+            if work_queue_maxsize is not None:
+                work_queue_maxsize = max(1, math.ceil(work_queue_maxsize / len(workers)))
+            self._work_queue = None
+            self._work_queues = [self._create_queue(work_queue_maxsize) for _ in workers]
+        self._results_queue = self._create_queue(results_queue_maxsize)
+        self.shared_memory_threshold = shared_memory_threshold
+        self.metrics = metrics
+        self.serializer = None if backend == "thread" else serializer
+        self.max_retries = max_retries
+        self.error_policy = error_policy
+        self.poisoned = {}  # poisoned chunks of the last run, maps chunk index to its items
+        # the data are published when the pool is entered, workers share this dictionary
+        self.shared_data = {}
+        self._shared_data_values = {} if shared_data is None else shared_data
+        self._shared_data_dir = shared_data_dir
         self.procs = workers
+        self._procs_lock = threading.Lock()
+        self._in_flight = {}
+        self._retries = {}
+        self._resend = collections.deque()  # chunks of crashed workers that wait for space in work queue
+        self._crashed = set()
+        self._received_cnt = {}  # number of received results per worker
+        self._segments = {}  # shared memory segments of serialized chunks of work which results were not received
+        self._last_liveness_check = 0.0
 
         self._sending_work = False
         self._data_cnt = 0
@@ -256,6 +1019,28 @@ class FunctorPool:
         self.verbose = verbose
         self.join_timeout = join_timeout
 
+    def _create_manager(self) -> SyncManager:
+        """
+        Creates and starts manager for the manager transport.
+
+        :return: started manager
+        """
+        return self._context.Manager()
+
+    def _create_queue(self, maxsize: Optional[int] = None) -> Queue:
+        """
+        Creates queue for communication with workers according to the transport.
+
+        :param maxsize: Max size of queue. None means unlimited.
+        :return: the queue
+        """
+        maxsize = 0 if maxsize is None else maxsize
+        if self.backend == "thread":
+            return queue.Queue(maxsize)
+        if self._manager is not None:
+            return self._manager.Queue(maxsize)
+        return self._context.Queue(maxsize)
+
     def _init_process(self, p: BaseFunctorWorker):
         """
         initialization of a process
@@ -266,29 +1051,133 @@ class FunctorPool:
         p.wid = self._wid_counter
         self._wid_counter += 1
         if p.work_queue is None:
-            p.work_queue = self._work_queue
+            p.work_queue = self._work_queue if self._work_queues is None else self._work_queues[p.wid]
+        if p.steal_queues is None and self._work_queues is not None:
+            others = [q for q in self._work_queues if q is not p.work_queue]
+            # each worker starts stealing from different queue
+            offset = p.wid % len(others) if others else 0
+            p.steal_queues = others[offset:] + others[:offset]
         if p.results_queue is None:
             p.results_queue = self._results_queue
-        if p.results_queue_lock is None:
-            p.results_queue_lock = self._results_queue_lock
+        if p.shared_memory_threshold is None:
+            p.shared_memory_threshold = self.shared_memory_threshold
+        p.error_policy = self.error_policy
+        p.backend = self.backend
+        if p.serializer is None:
+            p.serializer = self.serializer
+        if p.shared_data is None:
+            p.shared_data = self.shared_data
+        if p.current_chunk is None and self.max_retries is not None:
+            p.current_chunk = self._context.Value("q", -1, lock=False)
+        if p.taken_chunks is None and self.max_retries is not None and self._manager is None and \
+                self.backend == "process":
+            p.taken_chunks = self._context.Array("q", 1 + self.TAKEN_CHUNKS, lock=False)
 
     def __enter__(self) -> "FunctorPool":
-        self._manager.__enter__()
-        for p in self.procs:
-            p.start()
+        self._publish_shared_data()
+        try:
+            if self.shared_memory_threshold is not None:
+                # workers and manager must share the tracker with this process, as segments are created and unlinked
+                # in different processes
+                resource_tracker.ensure_running()
+            if self._manager is not None:
+                self._manager.__enter__()
+            if self.metrics is not None:
+                self.metrics.start()
+            for p in self.procs:
+                p.start()
+        except BaseException:
+            self._unlink_shared_data()
+            raise
         return self
 
     def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
-        for _ in range(len(self.procs)):
-            self._work_queue.put(None)
-        for p in self.procs:
+        self._stop_workers()
+
+        self._unlink_shared_data()
+
+        # release shared memory of chunks of work that were not received by workers
+        unlink_segments(itertools.chain.from_iterable(self._segments.values()))
+        self._segments.clear()
+
+        if self.shared_memory_threshold is not None:
+            # release shared memory of results that were not read
+            try:
+                while not self._results_queue.empty():
+                    res_chunk = self._results_queue.get(block=False)[1]
+                    if isinstance(res_chunk, SharedMemoryChunk):
+                        res_chunk.unlink()
+            except queue.Empty:
+                ...
+
+        if self._manager is not None:
+            self._manager.__exit__(exc_type, exc_val, exc_tb)
+
+        if self.metrics is not None:
+            self.metrics.stop()
+
+    def _publish_shared_data(self):
+        """
+        Publishes the shared data for workers. Already published data are released when the publishing fails.
+        """
+        try:
+            for name, value in self._shared_data_values.items():
+                path = None
+                if self._shared_data_dir is not None:
+                    fd, path = tempfile.mkstemp(prefix=f"{name}_", suffix=".shared", dir=self._shared_data_dir)
+                    os.close(fd)
+                try:
+                    self.shared_data[name] = SharedData.publish(value, path)
+                except BaseException:
+                    if path is not None:
+                        os.remove(path)
+                    raise
+        except BaseException:
+            self._unlink_shared_data()
+            raise
+
+    def _unlink_shared_data(self):
+        """
+        Releases the published shared data.
+        """
+        for d in self.shared_data.values():
+            d.unlink()
+        self.shared_data.clear()
+
+    def _stop_workers(self):
+        """
+        Sends stop orders to workers and waits until they finish.
+        """
+        self._send_stop_orders(self.procs)
+        self._join_workers(self.procs)
+
+    def _send_stop_orders(self, procs: List[BaseFunctorWorker]):
+        """
+        Sends stop order for each given worker that is still running.
+
+        :param procs: workers to stop
+        """
+        # crashed workers are not able to receive stop orders
+        alive = [p for p in procs if p.exitcode is None]
+        if self._work_queues is None:
+            for _ in alive:
+                self._work_queue.put(None)
+        else:
+            for p in alive:
+                p.work_queue.put(None)
+
+    def _join_workers(self, procs: List[BaseFunctorWorker]):
+        """
+        Waits until given workers finish.
+
+        :param procs: workers to join
+        """
+        for p in procs:
             if p.exitcode is None:
                 p.join(timeout=self.join_timeout)
                 if p.exitcode is None and self.verbose:
                     print(f"Process with wid {p.wid} was not joined and is still running.", file=sys.stderr)
 
-        self._manager.__exit__(exc_type, exc_val, exc_tb)
-
     def until_all_ready(self):
         """
         Waits until all process are ready for receiving data.
@@ -297,80 +1186,336 @@ class FunctorPool:
         for p in self.procs:
             p.begin_finished.wait()
 
-    def _get_results(self) -> Tuple[List[int], List[R]]:
+    def _get_results(self, chunk_size: Union[int, AdaptiveChunkSize] = 1) -> Tuple[List[int], List[R]]:
         """
-        Gets all results from results queue if there are no results it will wait until there are some.
+        Gets all results from results queue if there are no results it will wait until there are some or until the
+        sending of work is finished.
 
+        :param chunk_size: size of chunks that are sent to workers
+            Adaptive chunk size is updated with measurements of received chunks.
         :return: tuple of list of indexes and list of results
         """
+        results = []
+        # No lock is shared with workers, so a worker that is killed while it puts its results can not block others.
+        # As the workers may put new results as fast as they are read, at most one result per worker is taken.
+        try:
+            for _ in range(max(len(self.procs), 1)):
+                if self._results_queue.empty():
+                    break
+                results.append(self._results_queue.get(block=False))
+        except queue.Empty:
+            ...
+
+        poisoned = []
+        if self.max_retries is not None:
+            self._flush_resend()
+        while len(results) == 0:
+            if self.max_retries is not None and \
+                    time.monotonic() - self._last_liveness_check >= self.LIVENESS_INTERVAL:
+                poisoned = self._check_workers(results)
+                if len(poisoned) > 0 or len(results) > 0:
+                    break
+
+            # the sending may finish while waiting, after all results were already received
+            sending = self._sending_work
+            try:
+                results.append(self._results_queue.get(timeout=self.RESULTS_CHECK_INTERVAL))
+            except queue.Empty:
+                if not sending:
+                    break
 
-        if self._results_queue.qsize() > 0:
-            chunks = []
-            indexes = []
+        indexes = []
+        chunks = []
+        for res_i, res_chunk, stats in results:
+            self._segments.pop(res_i, None)
+            if self.max_retries is not None:
+                self._received_cnt[stats[0]] = self._received_cnt.get(stats[0], 0) + 1
+                if res_i not in self._in_flight:
+                    # duplicate result of chunk that was sent again
+                    if isinstance(res_chunk, SharedMemoryChunk):
+                        res_chunk.unlink()
+                    continue
+                del self._in_flight[res_i]
+
+            wid, processing_time, wait_time, blocked_time, begin_time, stolen, errors = stats
+            if isinstance(res_chunk, WorkerError):
+                if self.metrics is not None:
+                    self.metrics.errored(errors)
+                raise res_chunk
+
+            res_chunk = self._read_chunk(res_chunk)
+            if isinstance(chunk_size, AdaptiveChunkSize):
+                chunk_size.update(len(res_chunk), processing_time, wait_time)
+            if self.metrics is not None:
+                self.metrics.chunk_received(wid, len(res_chunk), processing_time, wait_time, blocked_time, begin_time,
+                                            stolen)
+                self.metrics.errored(errors)
+            indexes.append(res_i)
+            chunks.append(res_chunk)
+
+        for i in poisoned:
+            indexes.append(i)
+            chunks.append([])
+
+        return indexes, chunks
+
+    def _create_replacement(self) -> Optional[BaseFunctorWorker]:
+        """
+        Creates a worker that replaces a crashed one.
 
-            with self._results_queue_lock:
-                try:
-                    while self._results_queue.qsize() > 0:
-                        res_i, res_chunk = self._results_queue.get(block=False)
-                        chunks.append(res_chunk)
-                        indexes.append(res_i)
-                except queue.Empty:
-                    ...
+        :return: new worker or None when this pool is not able to create it
+        """
+        return None
+
+    def _check_workers(self, results: List[Tuple[int, Any, Tuple]]) -> List[int]:
+        """
+        Checks whether workers are alive. Crashed workers are replaced and their chunks are sent again.
 
-            if len(chunks) > 0:
-                return indexes, chunks
+        :param results: list where results that were received while looking for lost chunks are appended
+        :return: indices of chunks that were poisoned during this check
+        :raise RuntimeError: when all workers are dead
+        """
+        self._last_liveness_check = time.monotonic()
+        poisoned = []
+        with self._procs_lock:
+            for index, p in enumerate(self.procs):
+                if p.exitcode is None or p.exitcode == 0 or p.wid in self._crashed:
+                    continue
+
+                self._crashed.add(p.wid)
+                if self.verbose:
+                    print(f"Process with wid {p.wid} crashed with exit code {p.exitcode}.", file=sys.stderr)
+                if self.metrics is not None:
+                    self.metrics.crashed(p.wid)
+
+                new_p = self._create_replacement()
+                if new_p is not None:
+                    if new_p.work_queue is None:
+                        # new worker takes over the queue of crashed one
+                        new_p.work_queue = p.work_queue
+                        new_p.steal_queues = p.steal_queues
+                    self._init_process(new_p)
+                    self.procs[index] = new_p
+                    new_p.start()
+
+                chunk_i = p.current_chunk.value
+                if p.taken_chunks is not None:
+                    for lost_i in self._lost_chunks(p, results):
+                        if lost_i != chunk_i and lost_i in self._in_flight:
+                            self._resend.append((p.work_queue, (lost_i, self._in_flight[lost_i])))
+
+                if chunk_i in self._in_flight and self._retry(p.work_queue, chunk_i):
+                    poisoned.append(chunk_i)
+
+            if all(p.exitcode is not None for p in self.procs):
+                raise RuntimeError("All workers are dead.")
+
+        self._flush_resend()
+        return poisoned
+
+    def _lost_chunks(self, p: BaseFunctorWorker, results: List[Tuple[int, Any, Tuple]]) -> List[int]:
+        """
+        Finds chunks that crashed worker took, but their results were not received.
+        Results in context queue are sent by a feeder thread of the worker, so the ones that were not flushed before
+        the crash are lost together with the current chunk. The ones that were flushed are received first.
 
-        res_i, res_chunk = self._results_queue.get()
-        return [res_i], [res_chunk]
+        :param p: the crashed worker
+        :param results: list where the received results are appended
+        :return: indices of lost chunks
+        """
+        try:
+            while True:
+                results.append(self._results_queue.get(block=False))
+        except queue.Empty:
+            ...
+
+        taken_cnt = p.taken_chunks[0]
+        ring = p.taken_chunks[1:]
+        received_cnt = self._received_cnt.get(p.wid, 0) + sum(1 for r in results if r[2][0] == p.wid)
+        if taken_cnt - received_cnt > len(ring):
+            # the oldest chunks are no longer remembered
+            return list(self._in_flight)
+        return [ring[s % len(ring)] for s in range(received_cnt, taken_cnt)]
+
+    def _retry(self, work_queue: Queue, chunk_i: int) -> bool:
+        """
+        Sends lost chunk again or marks it as poisoned when it exceeded max_retries.
 
-    def imap(self, data: Iterable[T], chunk_size: int = 1) -> Generator[R, None, None]:
+        :param work_queue: queue where the chunk is sent
+        :param chunk_i: index of the lost chunk
+        :return: True when the chunk is poisoned
+        """
+        self._retries[chunk_i] = self._retries.get(chunk_i, 0) + 1
+        if self._retries[chunk_i] > self.max_retries:
+            if self.verbose:
+                print(f"Chunk {chunk_i} is poisoned.", file=sys.stderr)
+            self.poisoned[chunk_i] = self._in_flight.pop(chunk_i)
+            return True
+
+        self._resend.append((work_queue, (chunk_i, self._in_flight[chunk_i])))
+        return False
+
+    def _flush_resend(self):
+        """
+        Sends chunks of crashed workers again while there is a space in work queues.
+        It never blocks, as workers might be blocked on full results queue.
+        """
+        while len(self._resend) > 0:
+            work_queue, item = self._resend[0]
+            try:
+                work_queue.put(item, block=False)
+            except queue.Full:
+                break
+            self._resend.popleft()
+
+    def _read_chunk(self, chunk: Union[List[R], SharedMemoryChunk, SerializedChunk]) -> List[R]:
+        """
+        Reads chunk of results that might be in shared memory or serialized.
+
+        :param chunk: chunk of results, its shared memory descriptor or serialized chunk
+        :return: chunk of results
+        """
+        if isinstance(chunk, SharedMemoryChunk):
+            return chunk.read()
+        if isinstance(chunk, SerializedChunk):
+            return self.serializer.deserialize(chunk)
+        return chunk
+
+    @contextlib.contextmanager
+    def _send_work(self, data: Iterable[T],
+                   chunk_size: Union[int, AdaptiveChunkSize] = 1) -> Iterator["FunctorPool.SendWorkThread"]:
+        """
+        Runs the threads that are needed for processing of given data, while the results are read.
+
+        :param data: iterable of data that should be passed to functor
+        :param chunk_size: size of a chunk that is sent to a process
+        :return: thread that sends the work
+        """
+        with self.SendWorkThread(self, data, chunk_size) as send_thread:
+            yield send_thread
+
+    def imap(self, data: Iterable[T], chunk_size: Union[int, AdaptiveChunkSize] = 1) -> Generator[R, None, None]:
         """
         Applies functors on each element in iterable.
         honors the order
 
         :param data: iterable of data that should be passed to functor
         :param chunk_size: size of a chunk that is sent to a process
+            Use :class:`AdaptiveChunkSize` to adapt the size to measured processing times.
         :return: generator of results
         """
 
         buffer = Buffer()
         finished_cnt = 0
 
-        with self.SendWorkThread(self, data, chunk_size) as send_thread:
+        with self._send_work(data, chunk_size) as send_thread:
             while self._sending_work or finished_cnt < self._data_cnt:
-                indices, chunks = self._get_results()
+                indices, chunks = self._get_results(chunk_size)
                 for res_i, res_chunk in zip(indices, chunks):
                     for ch in buffer(res_i, res_chunk):
                         finished_cnt += 1
                         for x in ch:
                             yield x
 
+                if self.metrics is not None:
+                    self.metrics.buffered(len(buffer))
+
                 # if buffer is full, stop sending work
                 if len(buffer) >= self._results_queue_maxsize:
                     send_thread.run_event.clear()
+                    if self.metrics is not None:
+                        self.metrics.paused()
                 elif not send_thread.run_event.is_set():
                     send_thread.run_event.set()
+                    if self.metrics is not None:
+                        self.metrics.resumed()
 
-    def imap_unordered(self, data: Iterable[T], chunk_size: int = 1) -> Generator[R, None, None]:
+    def imap_unordered(self, data: Iterable[T],
+                       chunk_size: Union[int, AdaptiveChunkSize] = 1) -> Generator[R, None, None]:
         """
         Applies functors on each element in iterable.
         does not honors the order
 
         :param data: iterable of data that should be passed to functor
         :param chunk_size: size of a chunk that is sent to a process
+            Use :class:`AdaptiveChunkSize` to adapt the size to measured processing times.
         :return: generator of results
         """
         finished_cnt = 0
 
-        with self.SendWorkThread(self, data, chunk_size):
+        with self._send_work(data, chunk_size):
             while self._sending_work or finished_cnt < self._data_cnt:
 
-                indices, chunks = self._get_results()
+                indices, chunks = self._get_results(chunk_size)
                 for res_i, res_chunk in zip(indices, chunks):
                     finished_cnt += 1
                     for x in res_chunk:
                         yield x
 
+    async def aimap(self, data: Union[Iterable[T], AsyncIterable[T]], chunk_size: Union[int, AdaptiveChunkSize] = 1,
+                    max_pending: int = 1024) -> AsyncGenerator[R, None]:
+        """
+        Applies functors on each element in iterable without blocking the event loop.
+        honors the order
+
+        :param data: iterable or async iterable of data that should be passed to functor
+            Items of async iterable are read only when there is a space in work queue.
+        :param chunk_size: size of a chunk that is sent to a process
+            Use :class:`AdaptiveChunkSize` to adapt the size to measured processing times.
+        :param max_pending: maximal number of results that are waiting for reading
+            When it is reached the pool stops reading the results queue, which also stops sending of new work once
+            the queues are full.
+        :return: async generator of results
+        """
+        async for x in self._aiterate(self.imap, data, chunk_size, max_pending):
+            yield x
+
+    async def aimap_unordered(self, data: Union[Iterable[T], AsyncIterable[T]],
+                              chunk_size: Union[int, AdaptiveChunkSize] = 1,
+                              max_pending: int = 1024) -> AsyncGenerator[R, None]:
+        """
+        Applies functors on each element in iterable without blocking the event loop.
+        does not honors the order
+
+        :param data: iterable or async iterable of data that should be passed to functor
+            Items of async iterable are read only when there is a space in work queue.
+        :param chunk_size: size of a chunk that is sent to a process
+            Use :class:`AdaptiveChunkSize` to adapt the size to measured processing times.
+        :param max_pending: maximal number of results that are waiting for reading
+            When it is reached the pool stops reading the results queue, which also stops sending of new work once
+            the queues are full.
+        :return: async generator of results
+        """
+        async for x in self._aiterate(self.imap_unordered, data, chunk_size, max_pending):
+            yield x
+
+    async def _aiterate(self, imap: Callable[[Iterable[T], Union[int, AdaptiveChunkSize]], Iterable[R]],
+                        data: Union[Iterable[T], AsyncIterable[T]], chunk_size: Union[int, AdaptiveChunkSize],
+                        max_pending: int) -> AsyncGenerator[R, None]:
+        """
+        Runs synchronous imap in a thread and passes its results to the event loop.
+
+        :param imap: synchronous imap of this pool
+        :param data: iterable or async iterable of data that should be passed to functor
+        :param chunk_size: size of a chunk that is sent to a process
+        :param max_pending: maximal number of results that are waiting for reading
+        :return: async generator of results
+        """
+        loop = asyncio.get_running_loop()
+        thread = self.AsyncResultsThread(lambda d: imap(d, chunk_size), data, loop, max_pending)
+        thread.start()
+        try:
+            while True:
+                kind, value = await thread.results.get()
+                if kind == "end":
+                    break
+                if kind == "error":
+                    raise value
+                thread.slots.release()
+                yield value
+        finally:
+            await loop.run_in_executor(None, thread.stop)
+
 
 class FunctorWorkerFactory(ABC):
     """
@@ -396,6 +1541,9 @@ class FactoryFunctorPool(FunctorPool):
         Thread for replacing workers.
         """
 
+        STOP_CHECK_INTERVAL = 0.1
+        """How often in seconds it checks whether it should stop while it is waiting for pre-spawned worker."""
+
         def __init__(self, pool: "FactoryFunctorPool", verbose: bool = False):
             """
             :param pool: pool that is using this thread to send work
@@ -406,24 +1554,49 @@ class FactoryFunctorPool(FunctorPool):
             self.verbose = verbose
 
         def run(self) -> None:
-            while not self.stop_event.is_set():
+            while True:
+                # it ends only on the stop order, as it would remain in the queue for the next thread otherwise
                 replace_id = self.pool._replace_queue.get()
                 if replace_id is None:
                     break
-                for i, p in enumerate(self.pool.procs):
-                    if p.wid == replace_id:
-                        replace_index = i
-                        p.join(timeout=self.pool.join_timeout)
-                        if p.exitcode is None and self.verbose:
-                            print(f"Process with wid {p.wid} was not joined and is still running.", file=sys.stderr)
-                        break
-                else:
-                    raise RuntimeError(f"Unknown world id {replace_id}. I am not able to replace this process.")
-
-                p = self.pool._workers_factory.create()
-                self.pool._init_process(p)
-                self.pool.procs[replace_index] = p
-                self.pool.procs[replace_index].start()
+                with self.pool._procs_lock:
+                    for i, p in enumerate(self.pool.procs):
+                        if p.wid == replace_id:
+                            replace_index = i
+                            old = p
+                            if old.retire is None:
+                                p.join(timeout=self.pool.join_timeout)
+                                if p.exitcode is None and self.verbose:
+                                    print(f"Process with wid {p.wid} was not joined and is still running.",
+                                          file=sys.stderr)
+                            break
+                    else:
+                        raise RuntimeError(f"Unknown world id {replace_id}. I am not able to replace this process.")
+
+                    if self.pool.metrics is not None:
+                        self.pool.metrics.replaced(replace_id)
+
+                    p = self.pool._take_standby()
+                    if p is None:
+                        p = self.pool._workers_factory.create()
+                        if self.pool._work_queues is not None and p.work_queue is None:
+                            # new worker takes over the queue of replaced one
+                            p.work_queue = self.pool.procs[replace_index].work_queue
+                            p.steal_queues = self.pool.procs[replace_index].steal_queues
+                        self.pool._init_process(p)
+                        p.start()
+                    else:
+                        p.activate.set()
+                    self.pool.procs[replace_index] = p
+                    if old.retire is not None:
+                        self.pool._retiring.append(old)
+
+                if old.retire is not None:
+                    # the old worker keeps working until the new one is ready
+                    while not p.begin_finished.wait(self.STOP_CHECK_INTERVAL):
+                        if self.stop_event.is_set() or p.exitcode is not None:
+                            break
+                    old.retire.set()
 
         def stop(self):
             self.pool._replace_queue.put(None)
@@ -432,7 +1605,12 @@ class FactoryFunctorPool(FunctorPool):
     def __init__(self, workers: int, workers_factory: FunctorWorkerFactory, context: Optional[BaseContext] = None,
                  work_queue_maxsize: Optional[Union[int, float]] = 1.0,
                  results_queue_maxsize: Optional[Union[int, float]] = None, verbose: bool = False,
-                 join_timeout: Optional[int] = None):
+                 join_timeout: Optional[int] = None, transport: str = "manager",
+                 shared_memory_threshold: Optional[int] = None, metrics: Optional[PoolMetrics] = None,
+                 affinity: Optional[Callable[[T], Hashable]] = None, max_retries: Optional[int] = None,
+                 error_policy: str = "raise", shared_data: Optional[Dict[str, Any]] = None,
+                 shared_data_dir: Optional[str] = None, backend: str = "process", prespawn: bool = False,
+                 standby: int = 0, serializer: Optional[Serializer] = None):
         """
         Initialization of pool.
 
@@ -453,44 +1631,384 @@ class FactoryFunctorPool(FunctorPool):
             will never be full which causes that all the results will be read at the end.
         :param verbose: Determines whether information messages should be shown.
         :param join_timeout: Timout for process joining.
+        :param transport: Determines queues that are used for sending work and results.
+            See :class:`FunctorPool` for more information.
+        :param shared_memory_threshold: Minimal size in bytes of pickled chunk of results that is sent through shared
+            memory instead of the results queue. See :class:`FunctorPool` for more information.
+        :param metrics: Optional metrics that will be filled with measurements of workers and the pool.
+            Replacements of workers are also counted.
+        :param affinity: Optional affinity key function that enables per worker work queues with work stealing.
+            See :class:`FunctorPool` for more information. A new worker takes over the queue of replaced worker.
+        :param max_retries: Enables fault tolerance when it is not None. Crashed workers are replaced by new ones from
+            the factory and their chunks are sent again at most max_retries times.
+            See :class:`FunctorPool` for more information.
+        :param error_policy: What to do when a worker raises an exception while it processes an item.
+            See :class:`FunctorPool` for more information.
+        :param shared_data: Read-only data that are published once for all workers, including the replacements.
+            See :class:`FunctorPool` for more information.
+        :param shared_data_dir: Directory where the shared data are written into memory mapped files.
+            None means that shared memory is used.
+        :param backend: Determines whether workers run in processes or threads.
+            See :class:`FunctorPool` for more information.
+        :param prespawn: When a worker exceeds its max_rss, its replacement is started while the worker keeps
+            working. The worker stops once the replacement finishes its begin method, so the handover does not
+            decrease throughput. It does not apply to max_chunks_per_worker.
+        :param standby: Number of warm standby workers. They are started with the pool and run their begin method,
+            but they do not take any work until they replace a worker that stopped because of max_chunks_per_worker
+            or max_rss. So the replacement is instant even when the begin method takes long. Each used standby worker
+            is replaced by a new one.
+            It can not be used together with affinity. Crashed workers are replaced by new workers.
+        :param serializer: Serializer of chunks of work and results.
+            See :class:`FunctorPool` for more information.
         :raise ValueError: when attributes are invalid
         """
         if context is None:
             context = multiprocessing.get_context()
 
+        if standby > 0 and affinity is not None:
+            raise ValueError("Standby workers can not be used with affinity.")
+
         workers = [workers_factory.create() for _ in range(workers)]
 
         self._workers_factory = workers_factory
         self._replace_queue = context.Queue()
+        self.prespawn = prespawn
+        self._retiring = []  # workers that were replaced by pre-spawned workers, but might still run
+        self.standby = standby
+        self._standby = []
 
-        super().__init__(workers, context, work_queue_maxsize, results_queue_maxsize, verbose, join_timeout)
+        super().__init__(workers, context, work_queue_maxsize, results_queue_maxsize, verbose, join_timeout, transport,
+                         shared_memory_threshold, metrics, affinity, max_retries, error_policy, shared_data,
+                         shared_data_dir, backend, serializer)
 
     def _init_process(self, p: BaseFunctorWorker):
         super()._init_process(p)
         p.replace_queue = self._replace_queue
+        if self.prespawn and p.retire is None:
+            p.retire = self._context.Event()
 
-    def imap(self, data: Iterable[T], chunk_size: int = 1) -> Generator[R, None, None]:
+    def __enter__(self) -> "FactoryFunctorPool":
+        super().__enter__()
+        for _ in range(self.standby):
+            self._standby.append(self._start_standby())
+        return self
+
+    def _stop_workers(self):
+        for p in self._standby:
+            p.activate.set()
+        # retiring workers stop on their own, but they might take a stop order before they notice it, so they must be
+        # counted together with the others
+        procs = self.procs + self._retiring + self._standby
+        self._send_stop_orders(procs)
+        self._join_workers(procs)
+        self._retiring = []
+        self._standby = []
+
+    def _start_standby(self) -> BaseFunctorWorker:
         """
-        Applies functors on each element in iterable.
-        honors the order
+        Creates and starts a warm standby worker.
 
-        :param data: iterable of data that should be passed to functor
-        :param chunk_size: size of a chunk that is sent to a process
-        :return: generator of results
+        :return: the standby worker
         """
+        p = self._workers_factory.create()
+        p.activate = self._context.Event()
+        self._init_process(p)
+        p.start()
+        return p
 
-        with self.ReplaceWorkerThread(self, self.verbose):
-            yield from super().imap(data, chunk_size)
+    def _take_standby(self) -> Optional[BaseFunctorWorker]:
+        """
+        Takes a warm standby worker and starts a new one instead of it.
 
-    def imap_unordered(self, data: Iterable[T], chunk_size: int = 1) -> Generator[R, None, None]:
+        :return: The standby worker that is not activated yet. The ones that already finished their begin method are
+            preferred. None when there are no standby workers.
         """
-        Applies functors on each element in iterable.
-        does not honors the order
+        self._standby = [p for p in self._standby if p.exitcode is None]
+        while len(self._standby) < self.standby:
+            self._standby.append(self._start_standby())
+
+        if len(self._standby) == 0:
+            return None
+
+        ready = [p for p in self._standby if p.begin_finished.is_set()]
+        p = ready[0] if len(ready) > 0 else self._standby[0]
+        self._standby.remove(p)
+        self._standby.append(self._start_standby())
+        return p
+
+    def _create_replacement(self) -> Optional[BaseFunctorWorker]:
+        return self._workers_factory.create()
+
+    @contextlib.contextmanager
+    def _send_work(self, data: Iterable[T],
+                   chunk_size: Union[int, AdaptiveChunkSize] = 1) -> Iterator["FunctorPool.SendWorkThread"]:
+        """
+        Runs the threads that are needed for processing of given data, while the results are read.
+        Workers that stop are replaced in the meantime.
 
         :param data: iterable of data that should be passed to functor
         :param chunk_size: size of a chunk that is sent to a process
-        :return: generator of results
+        :return: thread that sends the work
+        """
+        with self.ReplaceWorkerThread(self, self.verbose), super()._send_work(data, chunk_size) as send_thread:
+            yield send_thread
+
+
+class FunctorPipeline(FunctorPool):
+    """
+    A pipeline of stages. Each stage is a group of workers with its own parallelism. Workers of a stage send
+    their results directly to the work queue of the next stage, so intermediate results never pass through this
+    process. Only the results of the last stage are delivered here.
+
+    The chunks keep their index through all stages, so imap preserves the order end-to-end and imap_unordered
+    yields the chunks as they leave the last stage.
+
+    Example:
+        >>> with FunctorPipeline([[Parser() for _ in range(2)], [Featurizer() for _ in range(4)]]) as pipeline:
+        ...     features = list(pipeline.imap(documents, chunk_size=16))
+
+    :ivar stages: workers of individual stages
+    :vartype stages: List[List[BaseFunctorWorker]]
+    """
+
+    def __init__(self, stages: List[List[BaseFunctorWorker]], context: Optional[BaseContext] = None,
+                 work_queue_maxsize: Optional[Union[int, float]] = 1.0,
+                 stage_queue_maxsize: Optional[Union[int, float]] = 1.0,
+                 results_queue_maxsize: Optional[Union[int, float]] = None,
+                 verbose: bool = False, join_timeout: Optional[float] = None, transport: str = "manager",
+                 shared_memory_threshold: Optional[int] = None, metrics: Optional[PoolMetrics] = None,
+                 error_policy: str = "raise", shared_data: Optional[Dict[str, Any]] = None,
+                 shared_data_dir: Optional[str] = None, backend: str = "process",
+                 serializer: Optional[Serializer] = None):
+        """
+        Initialization of pipeline.
+
+        :param stages: workers of individual stages in processing order
+        :param context: On which multiprocessing context this pipeline should operate.
+        :param work_queue_maxsize: Max size of queue that is used to send work to the first stage.
+            float the max size will be: int(workers of the first stage * work_queue_maxsize)
+            int the max size is just work_queue_maxsize
+        :param stage_queue_maxsize: Max size of queues between stages. It bounds the number of chunks that are
+            waiting for the next stage.
+            float the max size will be: int(workers of the next stage * stage_queue_maxsize)
+            int the max size is just stage_queue_maxsize
+        :param results_queue_maxsize: Max size of queue that is used to deliver results of the last stage to main
+            process.
+            float the max size will be: int(workers of the last stage * results_queue_maxsize)
+            int the max size is just results_queue_maxsize
+        :param verbose: Determines whether information messages should be shown.
+        :param join_timeout: Timout for process joining.
+        :param transport: Determines queues that are used for sending work and results.
+            See :class:`FunctorPool`.
+        :param shared_memory_threshold: Chunks of results which pickled size is at least this number of bytes are
+            sent through shared memory, also between stages.
+            See :class:`FunctorPool`.
+        :param metrics: Optional metrics that will be filled with measurements of the last stage workers and the
+            pipeline.
+        :param error_policy: What to do when a worker raises an exception while it processes an item.
+            Errors are passed through the following stages without processing.
+            See :class:`FunctorPool`.
+        :param shared_data: Read-only data that are published once for workers of all stages.
+            See :class:`FunctorPool`.
+        :param shared_data_dir: Directory where the shared data are written into memory mapped files.
+            None means that shared memory is used.
+        :param backend: Determines whether workers run in processes or threads.
+            See :class:`FunctorPool`.
+        :param serializer: Serializer of chunks of work and results, also between stages.
+            See :class:`FunctorPool`.
+        :raise ValueError: when there are no stages, a stage is empty or the transport or error policy is unknown
         """
+        if len(stages) == 0 or any(len(stage) == 0 for stage in stages):
+            raise ValueError("The pipeline must have at least one stage and every stage must have a worker.")
+
+        if isinstance(work_queue_maxsize, float):
+            work_queue_maxsize = int(len(stages[0]) * work_queue_maxsize)
 
-        with self.ReplaceWorkerThread(self, self.verbose):
-            yield from super().imap_unordered(data, chunk_size)
+        if isinstance(results_queue_maxsize, float):
+            results_queue_maxsize = int(len(stages[-1]) * results_queue_maxsize)
+
+        super().__init__([p for stage in stages for p in stage], context, work_queue_maxsize, results_queue_maxsize,
+                         verbose, join_timeout, transport, shared_memory_threshold, metrics, error_policy=error_policy,
+                         shared_data=shared_data, shared_data_dir=shared_data_dir, backend=backend,
+                         serializer=serializer)
+
+        self.stages = stages
+        self._stage_queues = []
+        for stage in stages[1:]:
+            maxsize = stage_queue_maxsize
+            if isinstance(maxsize, float):
+                maxsize = int(len(stage) * maxsize)
+            self._stage_queues.append(self._create_queue(maxsize))
+
+        for k, stage in enumerate(stages):
+            for p in stage:
+                if k > 0:
+                    p.work_queue = self._stage_queues[k - 1]
+                if k < len(self._stage_queues):
+                    p.results_queue = self._stage_queues[k]
+
+    def _stop_workers(self):
+        # a stage is stopped when all work from previous stage was sent to it
+        for k, stage in enumerate(self.stages):
+            work_queue = self._work_queue if k == 0 else self._stage_queues[k - 1]
+            # alive workers must be collected before the first stop order is sent as any worker of the stage may take
+            # it and exit before the others are checked
+            alive = [p for p in stage if p.exitcode is None]
+            for _ in alive:
+                work_queue.put(None)
+            self._join_workers(stage)
+
+
+class PriorityScheduler:
+    """
+    Scheduler that shares workers of a pool among submitted items with different priorities.
+
+    Items are sent to workers in order of their priority (lower value first) and in order of submission within the
+    same priority, so latency-sensitive requests jump ahead of bulk work that waits in the scheduler. Items which
+    deadline expired before they were sent are dropped.
+
+    Only the items waiting in the scheduler are reordered, not the ones that are already in work queue of the pool,
+    so use small work_queue_maxsize for low latency.
+    The pool should use sentinel or skip error policy, as with the raise policy the first error fails all pending
+    items and closes the scheduler. The pool must not be used for other calls while the scheduler is running.
+
+    Times the items waited in the scheduler and numbers of dropped items are reported for each priority to metrics of
+    the pool, if it has any.
+
+    Example:
+        >>> with FunctorPool(workers, work_queue_maxsize=1, error_policy="sentinel") as pool, \\
+        ...         PriorityScheduler(pool) as scheduler:
+        ...     backfill = [scheduler.submit(x, priority=10) for x in bulk_data]
+        ...     response = scheduler.submit(request, priority=0, deadline=time.monotonic() + 0.5)
+        ...     response.result()
+    """
+
+    def __init__(self, pool: FunctorPool):
+        """
+        :param pool: pool which workers are used
+        """
+        self.pool = pool
+        self._heap = []  # (priority, sequence number, submission time, deadline, future, item)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._futures = {}  # futures of items that were sent to workers, maps chunk index to future
+        self._thread = None
+
+    def __enter__(self) -> "PriorityScheduler":
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
+        self.close()
+
+    def submit(self, item: T, priority: Any = 0, deadline: Optional[float] = None) -> concurrent.futures.Future:
+        """
+        Submits item for processing.
+
+        :param item: item that should be passed to functor
+        :param priority: priority of the item, lower values are sent to workers first
+            Items with the same priority form a priority class in metrics.
+        :param deadline: Optional deadline (in time.monotonic clock) until which the item must be sent to workers.
+            When it expires sooner, the item is dropped and its future is resolved with :class:`DeadlineExpiredError`.
+        :return: future of the result
+            It is resolved with :class:`WorkerError` when the worker raised an exception and the sentinel policy is
+            used, and with RuntimeError when the item was skipped or poisoned.
+            It might be cancelled until the item is sent to workers.
+        :raise RuntimeError: when the scheduler is closed
+        """
+        future = concurrent.futures.Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The scheduler is closed.")
+            heapq.heappush(self._heap, (priority, next(self._seq), time.monotonic(), deadline, future, item))
+            self._cond.notify()
+        return future
+
+    def close(self):
+        """
+        Stops accepting new items and waits until all submitted items are processed.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _work(self) -> Generator[T, None, None]:
+        """
+        Generates submitted items in order of priority until the scheduler is closed and all items are generated.
+        Cancelled items and items with expired deadline are dropped.
+
+        :return: generator of items for the pool
+        """
+        metrics = self.pool.metrics
+        index = 0
+        while True:
+            with self._cond:
+                while len(self._heap) == 0 and not self._closed:
+                    self._cond.wait()
+                if len(self._heap) == 0:
+                    return
+
+                priority, _, submitted, deadline, future, item = heapq.heappop(self._heap)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                now = time.monotonic()
+                if deadline is not None and now > deadline:
+                    future.set_exception(DeadlineExpiredError(deadline))
+                    if metrics is not None:
+                        metrics.dropped(priority)
+                    continue
+
+                # each item is in its own chunk, so the chunk index is the index of item
+                self._futures[index] = future
+                index += 1
+
+            if metrics is not None:
+                metrics.dispatched(priority, now - submitted)
+            yield item
+
+    def _run(self):
+        """
+        Sends the submitted items to workers and resolves their futures with results.
+        """
+        pool = self.pool
+        finished_cnt = 0
+        with pool._send_work(self._work()):
+            try:
+                while pool._sending_work or finished_cnt < pool._data_cnt:
+                    indices, chunks = pool._get_results()
+                    for res_i, res_chunk in zip(indices, chunks):
+                        finished_cnt += 1
+                        future = self._futures.pop(res_i)
+                        if len(res_chunk) == 0:
+                            future.set_exception(RuntimeError("The item was skipped or it is poisoned."))
+                        elif isinstance(res_chunk[0], WorkerError):
+                            future.set_exception(res_chunk[0])
+                        else:
+                            future.set_result(res_chunk[0])
+            except BaseException as e:
+                # must be done before the sending thread is stopped, as it might wait for new items
+                self._fail(e)
+
+    def _fail(self, error: BaseException):
+        """
+        Closes the scheduler and resolves futures of all unfinished items with given error.
+
+        :param error: the error
+        """
+        with self._cond:
+            self._closed = True
+            futures = list(self._futures.values())
+            self._futures.clear()
+            for entry in self._heap:
+                if entry[4].set_running_or_notify_cancel():
+                    futures.append(entry[4])
+            self._heap.clear()
+            self._cond.notify_all()
+
+        for future in futures:
+            future.set_exception(error)
@@ -0,0 +1,417 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+Module with metrics of parallel pools.
+
+:author:     Martin Dočekal
+"""
+import bisect
+import statistics
+import threading
+import time
+from typing import Optional, Callable, Dict, Any, List
+
+
+class Histogram:
+    """
+    Histogram of durations with logarithmic buckets.
+
+    Example:
+        >>> h = Histogram()
+        >>> h.observe(0.5)
+        >>> h.observe(1.5)
+        >>> h.count, h.sum
+        (2, 2.0)
+        >>> h.quantile(0.5)
+        0.524288
+    """
+
+    BOUNDS = [1e-6 * 2 ** i for i in range(31)]
+    """Upper bounds of buckets in seconds. The last bucket is unbounded."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        """
+        Adds new value into histogram.
+
+        :param value: the value
+        """
+        self.buckets[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self) -> Optional[float]:
+        """
+        Mean of observed values or None when there are no values.
+        """
+        return self.sum / self.count if self.count > 0 else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Approximates quantile by upper bound of bucket that contains it.
+
+        :param q: quantile in [0, 1]
+        :return: approximate quantile or None when there are no values
+        """
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+        for i, c in enumerate(self.buckets):
+            cumulative += c
+            if c > 0 and cumulative >= rank:
+                return min(self.BOUNDS[i], self.max) if i < len(self.BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Summary of the histogram.
+
+        :return: dictionary with count, sum, min, max, mean and approximate median, 90 and 99 percentiles
+        """
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class WorkerMetrics:
+    """
+    Metrics of a single worker.
+
+    :ivar begin_time: how long the begin method of worker took
+        None if it was not reported yet.
+    :vartype begin_time: Optional[float]
+    :ivar chunks: number of processed chunks
+    :vartype chunks: int
+    :ivar items: number of processed items
+    :vartype items: int
+    :ivar compute: histogram of chunk processing times
+    :vartype compute: Histogram
+    :ivar wait: histogram of times the worker waited for a chunk in the work queue
+    :vartype wait: Histogram
+    :ivar stolen: number of chunks the worker stole from queues of other workers
+    :vartype stolen: int
+    :ivar blocked_time: total time the worker was blocked on full results queue
+    :vartype blocked_time: float
+    :ivar last_report: time (time.monotonic) of the last received chunk from this worker
+    :vartype last_report: Optional[float]
+    :ivar replacements: number of times the worker was replaced
+    :vartype replacements: int
+    :ivar crashes: number of times the worker crashed
+    :vartype crashes: int
+    """
+
+    def __init__(self):
+        self.begin_time = None
+        self.chunks = 0
+        self.items = 0
+        self.compute = Histogram()
+        self.wait = Histogram()
+        self.stolen = 0
+        self.blocked_time = 0.0
+        self.last_report = None
+        self.replacements = 0
+        self.crashes = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Summary of worker metrics.
+
+        :return: dictionary with worker metrics
+        """
+        return {
+            "begin_time": self.begin_time,
+            "chunks": self.chunks,
+            "items": self.items,
+            "compute": self.compute.to_dict(),
+            "wait": self.wait.to_dict(),
+            "stolen": self.stolen,
+            "blocked_time": self.blocked_time,
+            "last_report": self.last_report,
+            "replacements": self.replacements,
+            "crashes": self.crashes,
+        }
+
+
+class PoolMetrics:
+    """
+    Opt-in metrics of a pool. Workers report their measurements together with results and the pool aggregates them
+    here.
+
+    It is thread safe, so it is possible to take a snapshot while the pool is working.
+
+    Example:
+        >>> metrics = PoolMetrics(callback=print, interval=10)
+        >>> with FunctorPool(workers, metrics=metrics) as pool:
+        ...     results = list(pool.imap(data))
+        >>> metrics.snapshot()["items_received"]
+        1000
+
+    :ivar workers: metrics of individual workers
+    :vartype workers: Dict[Any, WorkerMetrics]
+    :ivar priority_wait: histograms of times items waited in priority scheduler for each priority class
+    :vartype priority_wait: Dict[Any, Histogram]
+    :ivar priority_dropped: number of items with expired deadline for each priority class
+    :vartype priority_dropped: Dict[Any, int]
+    """
+
+    def __init__(self, callback: Optional[Callable[[Dict[str, Any]], None]] = None, interval: float = 60.0):
+        """
+        :param callback: Optional callback that is periodically called with snapshot of metrics while the pool is
+            active and once more when it is closed.
+        :param interval: interval in seconds between calls of callback
+        """
+        self.callback = callback
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._report_thread = None
+        self._start_time = time.monotonic()
+
+        self.workers = {}
+        self.chunks_sent = 0
+        self.items_sent = 0
+        self.send_blocked_time = 0.0
+        self.chunks_received = 0
+        self.items_received = 0
+        self.stolen_chunks = 0
+        self.compute = Histogram()
+        self.wait = Histogram()
+        self.pauses = 0
+        self.paused_time = 0.0
+        self._paused_since = None
+        self.max_buffered_chunks = 0
+        self.replacements = 0
+        self.crashes = 0
+        self.errors = 0
+        self.priority_wait = {}
+        self.priority_dropped = {}
+
+    def chunk_sent(self, items: int, blocked_time: float):
+        """
+        Records chunk that was sent to workers.
+
+        :param items: number of items in the chunk
+        :param blocked_time: time the sender was blocked on full work queue
+        """
+        with self._lock:
+            self.chunks_sent += 1
+            self.items_sent += items
+            self.send_blocked_time += blocked_time
+
+    def chunk_received(self, wid: Any, items: int, processing_time: float, wait_time: float, blocked_time: float,
+                       begin_time: Optional[float] = None, stolen: bool = False):
+        """
+        Records chunk of results that was received from a worker.
+
+        :param wid: id of worker that processed the chunk
+        :param items: number of items in the chunk
+        :param processing_time: time the worker spent processing the chunk
+        :param wait_time: time the worker waited for the chunk in the work queue
+        :param blocked_time: time the worker was blocked on full results queue since its last report
+        :param begin_time: how long the begin method of worker took if it is reported with this chunk
+        :param stolen: whether the worker stole the chunk from queue of other worker
+        """
+        with self._lock:
+            worker = self._worker(wid)
+            if begin_time is not None:
+                worker.begin_time = begin_time
+            worker.chunks += 1
+            worker.items += items
+            worker.compute.observe(processing_time)
+            worker.wait.observe(wait_time)
+            worker.stolen += stolen
+            worker.blocked_time += blocked_time
+            worker.last_report = time.monotonic()
+
+            self.chunks_received += 1
+            self.items_received += items
+            self.stolen_chunks += stolen
+            self.compute.observe(processing_time)
+            self.wait.observe(wait_time)
+
+    def _worker(self, wid: Any) -> WorkerMetrics:
+        """
+        Gets metrics of given worker or creates new ones. The lock must be held.
+
+        :param wid: id of worker
+        :return: metrics of the worker
+        """
+        worker = self.workers.get(wid)
+        if worker is None:
+            worker = self.workers[wid] = WorkerMetrics()
+        return worker
+
+    def buffered(self, chunks: int):
+        """
+        Records number of chunks waiting in ordering buffer.
+
+        :param chunks: number of chunks in buffer
+        """
+        with self._lock:
+            self.max_buffered_chunks = max(self.max_buffered_chunks, chunks)
+
+    def paused(self):
+        """
+        Records that sending of work was paused because of too many results waiting for reading.
+        """
+        with self._lock:
+            if self._paused_since is None:
+                self.pauses += 1
+                self._paused_since = time.monotonic()
+
+    def resumed(self):
+        """
+        Records that sending of work was resumed.
+        """
+        with self._lock:
+            if self._paused_since is not None:
+                self.paused_time += time.monotonic() - self._paused_since
+                self._paused_since = None
+
+    def replaced(self, wid: Any):
+        """
+        Records replacement of a worker.
+
+        :param wid: id of replaced worker
+        """
+        with self._lock:
+            self.replacements += 1
+            self._worker(wid).replacements += 1
+
+    def crashed(self, wid: Any):
+        """
+        Records crash of a worker.
+
+        :param wid: id of crashed worker
+        """
+        with self._lock:
+            self.crashes += 1
+            self._worker(wid).crashes += 1
+
+    def errored(self, errors: int):
+        """
+        Records errors of items that were raised in workers.
+
+        :param errors: number of errors
+        """
+        if errors > 0:
+            with self._lock:
+                self.errors += errors
+
+    def dispatched(self, priority: Any, wait_time: float):
+        """
+        Records item that was sent to workers by priority scheduler.
+
+        :param priority: priority class of the item
+        :param wait_time: time the item waited in the scheduler
+        """
+        with self._lock:
+            histogram = self.priority_wait.get(priority)
+            if histogram is None:
+                histogram = self.priority_wait[priority] = Histogram()
+            histogram.observe(wait_time)
+
+    def dropped(self, priority: Any):
+        """
+        Records item that was dropped by priority scheduler, because its deadline expired.
+
+        :param priority: priority class of the item
+        """
+        with self._lock:
+            self.priority_dropped[priority] = self.priority_dropped.get(priority, 0) + 1
+
+    def stragglers(self, factor: float = 2.0) -> List[Any]:
+        """
+        Finds workers which mean processing time of an item is at least factor times greater than median of all
+        workers.
+
+        :param factor: how many times slower a worker must be to be considered as straggler
+        :return: ids of straggling workers
+        """
+        with self._lock:
+            item_times = {wid: w.compute.sum / w.items for wid, w in self.workers.items() if w.items > 0}
+
+        if len(item_times) == 0:
+            return []
+
+        median = statistics.median(item_times.values())
+        return [wid for wid, t in item_times.items() if t > factor * median]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Snapshot of actual metrics.
+
+        :return: dictionary with metrics
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self._start_time
+            paused_time = self.paused_time
+            if self._paused_since is not None:
+                paused_time += time.monotonic() - self._paused_since
+
+            return {
+                "elapsed": elapsed,
+                "chunks_sent": self.chunks_sent,
+                "items_sent": self.items_sent,
+                "send_blocked_time": self.send_blocked_time,
+                "chunks_received": self.chunks_received,
+                "items_received": self.items_received,
+                "stolen_chunks": self.stolen_chunks,
+                "throughput": self.items_received / elapsed if elapsed > 0 else 0.0,
+                "compute": self.compute.to_dict(),
+                "wait": self.wait.to_dict(),
+                "pauses": self.pauses,
+                "paused_time": paused_time,
+                "max_buffered_chunks": self.max_buffered_chunks,
+                "replacements": self.replacements,
+                "crashes": self.crashes,
+                "errors": self.errors,
+                "priority_wait": {p: h.to_dict() for p, h in self.priority_wait.items()},
+                "priority_dropped": dict(self.priority_dropped),
+                "workers": {wid: w.to_dict() for wid, w in self.workers.items()},
+            }
+
+    def start(self):
+        """
+        Starts periodic reporting to callback if there is any.
+        """
+        if self.callback is not None and self._report_thread is None:
+            self._stop_event.clear()
+            self._report_thread = threading.Thread(target=self._report, daemon=True)
+            self._report_thread.start()
+
+    def stop(self):
+        """
+        Stops periodic reporting and calls the callback with the final snapshot.
+        """
+        if self._report_thread is not None:
+            self._stop_event.set()
+            self._report_thread.join()
+            self._report_thread = None
+            self.callback(self.snapshot())
+
+    def _report(self):
+        """
+        Periodically calls the callback with snapshot until it is stopped.
+        """
+        while not self._stop_event.wait(self.interval):
+            self.callback(self.snapshot())
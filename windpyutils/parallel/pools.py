@@ -5,12 +5,18 @@ Contains parallel functor map.
 
 :author:     Martin Dočekal
 """
+import itertools
 import multiprocessing
 import queue
+import threading
+import time
 from multiprocessing import Process, Queue
-from typing import TypeVar, Iterable, Generator, Callable
+from typing import TypeVar, Iterable, Generator, Callable, Union, Optional
 
 from windpyutils.buffers import Buffer
+from windpyutils.parallel.backends import BACKENDS, resolve_backend
+from windpyutils.parallel.chunks import AdaptiveChunkSize, chunking
+from windpyutils.parallel.serializers import Serializer
 
 T = TypeVar('T')
 R = TypeVar('R')
@@ -21,63 +27,117 @@ class FunctorWorker(Process):
     Functor worker for FunctorMap.
     """
 
-    def __init__(self, pf: Callable[[T], R], work_queue: Queue, results_queue: Queue):
+    def __init__(self, pf: Callable[[T], R], work_queue: Queue, results_queue: Queue,
+                 serializer: Optional[Serializer] = None):
         """
         Initialization of parallel worker.
 
         :param pf: Function you want to run in data-parallel way.
         :param work_queue: queue that is used for receiving work and stop orders
         :param results_queue: queue that is used for sending results
+        :param serializer: serializer of chunks of work and results
+            None means that they are pickled by the queues as they are.
         """
         super().__init__()
         self.pf = pf
         self._work_queue = work_queue
         self._results_queue = results_queue
+        self.serializer = serializer
 
     def run(self) -> None:
         """
         Run the process.
         """
 
+        wait_start = None
         while True:
             q_item = self._work_queue.get()
+            processing_start = time.perf_counter()
+            wait_time = 0.0 if wait_start is None else processing_start - wait_start
 
             if q_item is None:
                 # all done
                 break
 
-            i, data_list = q_item
+            tag, data_list = q_item
+            if self.serializer is not None:
+                data_list = self.serializer.deserialize(data_list)
 
-            self._results_queue.put((i, [self.pf(x) for x in data_list]))
+            res = [self.pf(x) for x in data_list]
+            if self.serializer is not None:
+                res = self.serializer.serialize(res)
+            wait_start = time.perf_counter()
+            self._results_queue.put((tag, res, wait_start - processing_start, wait_time))
 
 
 class FunctorMap:
     """
     A parallel map that uses given function.
+
+    The workers stay warm for its whole lifetime, so it can be called many times, even concurrently from multiple
+    threads. Each chunk is tagged with id of call it belongs to and results are routed back to that call.
+
+    Example:
+        >>> with FunctorMap(f, workers=4) as fm:
+        ...     first = fm(data)
+        ...     second = fm(other_data)
+        ...     list(first), list(second)
     """
 
-    def __init__(self, pf: Callable[[T], R], workers: int = -1):
+    BACKENDS = BACKENDS
+    """Supported backends of workers."""
+
+    def __init__(self, pf: Callable[[T], R], workers: int = -1, backend: str = "process",
+                 serializer: Optional[Serializer] = None):
         """
         Initialization of parallel functor map.
 
         :param pf: Function you want to run in data-parallel way.
         :param workers: Number of parallel workers.
             Values <=0 will create number of workers that will be same as number of cpus.
+        :param backend: Determines how workers are started.
+            process     each worker runs in its own process
+            thread      each worker runs in a thread of this process, which is useful for functions that release
+                        GIL (e.g. NumPy, zlib, hashlib), as nothing is pickled
+            auto        thread on free-threaded (no GIL) interpreter, process otherwise
+        :param serializer: Serializer of chunks of work and results.
+            None means that they are pickled by the queues as they are. It is ignored by thread backend.
+            See :class:`windpyutils.parallel.serializers.Serializer`.
+        :raise ValueError: when the backend is unknown
         """
         super().__init__()
+        backend = resolve_backend(backend)
+        self.serializer = None if backend == "thread" else serializer
+
         if workers <= 0:
             workers = multiprocessing.cpu_count()
 
-        self._work_queue = Queue(workers)
-        self._results_queue = Queue()
+        if backend == "thread":
+            self._work_queue = queue.Queue(workers)
+            self._results_queue = queue.Queue()
+        else:
+            self._work_queue = Queue(workers)
+            self._results_queue = Queue()
+
         self.procs = [
-            FunctorWorker(pf=pf, work_queue=self._work_queue, results_queue=self._results_queue) for _ in range(workers)
+            FunctorWorker(pf=pf, work_queue=self._work_queue, results_queue=self._results_queue,
+                          serializer=self.serializer)
+            for _ in range(workers)
         ]
+        if backend == "thread":
+            self.procs = [threading.Thread(target=p.run) for p in self.procs]
+
+        self._call_ids = itertools.count()
+        self._calls = {}
+        self._calls_lock = threading.Lock()
+        self._dispatcher = None
 
     def __enter__(self) -> "FunctorMap":
         for p in self.procs:
             p.daemon = True
             p.start()
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
         return self
 
     def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
@@ -85,50 +145,95 @@ class FunctorMap:
             self._work_queue.put(None)
         for p in self.procs:
             p.join()
+        self._results_queue.put(None)
+        self._dispatcher.join()
 
-    def __call__(self, data: Iterable[T], chunk_size: int = 1) -> Generator[R, None, None]:
+    def _dispatch(self):
+        """
+        Routes results from workers to queues of calls they belong to.
+        Results of calls that are no longer active (e.g. abandoned generator) are dropped.
+        """
+        while True:
+            res = self._results_queue.get()
+            if res is None:
+                break
+
+            call_id, _ = res[0]
+            with self._calls_lock:
+                call_queue = self._calls.get(call_id)
+            if call_queue is not None:
+                call_queue.put(res)
+
+    def __call__(self, data: Iterable[T], chunk_size: Union[int, AdaptiveChunkSize] = 1,
+                 max_in_flight: Optional[Union[int, float]] = None) -> Generator[R, None, None]:
         """
         Applies functor on each element in iterable.
         honors the order
 
+        The data are read lazily and the memory is bounded by the number of chunks in flight, so it is possible to
+        map over a generator of any length.
+
         :param data: iterable of data that should be passed to functor
         :param chunk_size: size of a chunk that is send to a process
+            Use :class:`AdaptiveChunkSize` to adapt the size to measured processing times.
+        :param max_in_flight: Maximal number of chunks that were sent to workers, but were not generated yet. It
+            bounds also the number of results waiting in buffer for a straggling chunk.
+            None means four chunks per worker. Use math.inf for no limit.
         :return: generator of results
+        :raise ValueError: when max_in_flight is not positive
         """
+        if max_in_flight is None:
+            max_in_flight = 4 * len(self.procs)
+        if max_in_flight < 1:
+            raise ValueError("The max_in_flight must be positive.")
 
         buffer = Buffer()
-
-        def chunking(d):
-            ch = []
-            for x in d:
-                ch.append(x)
-                if len(ch) == chunk_size:
-                    yield ch
-                    ch = []
-            if len(ch) > 0:
-                yield ch
-
-        data_cnt = 0
-        finished_cnt = 0
-        for i, chunk in enumerate(chunking(data)):
-            self._work_queue.put((i, chunk))
-            data_cnt += 1
-
-            try:
-                # read the results
-                while True:
-                    res_i, res_chunk = self._results_queue.get(False)
+        with self._calls_lock:
+            call_id = next(self._call_ids)
+            results_queue = self._calls[call_id] = queue.Queue()
+
+        def receive(block: bool):
+            (_, res_i), res_chunk, processing_time, wait_time = results_queue.get(block)
+            if self.serializer is not None:
+                res_chunk = self.serializer.deserialize(res_chunk)
+            if isinstance(chunk_size, AdaptiveChunkSize):
+                chunk_size.update(len(res_chunk), processing_time, wait_time)
+            return res_i, res_chunk
+
+        try:
+            data_cnt = 0
+            finished_cnt = 0
+            for i, chunk in enumerate(chunking(data, chunk_size)):
+                while data_cnt - finished_cnt >= max_in_flight:
+                    res_i, res_chunk = receive(True)
                     for ch in buffer(res_i, res_chunk):
                         finished_cnt += 1
                         for x in ch:
                             yield x
 
-            except queue.Empty:
-                pass
-
-        while finished_cnt < data_cnt:
-            res_i, res_chunk = self._results_queue.get()
-            for ch in buffer(res_i, res_chunk):
-                finished_cnt += 1
-                for x in ch:
-                    yield x
+                if self.serializer is not None:
+                    chunk = self.serializer.serialize(chunk)
+                self._work_queue.put(((call_id, i), chunk))
+                data_cnt += 1
+
+                try:
+                    # read the results
+                    while True:
+                        res_i, res_chunk = receive(False)
+                        for ch in buffer(res_i, res_chunk):
+                            finished_cnt += 1
+                            for x in ch:
+                                yield x
+
+                except queue.Empty:
+                    pass
+
+            while finished_cnt < data_cnt:
+                res_i, res_chunk = receive(True)
+                for ch in buffer(res_i, res_chunk):
+                    finished_cnt += 1
+                    for x in ch:
+                        yield x
+        finally:
+            with self._calls_lock:
+                del self._calls[call_id]
@@ -0,0 +1,252 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+Module with serializers of chunks that are transported between pools and their workers.
+
+:author:     Martin Dočekal
+"""
+import os
+import pickle
+from abc import ABC, abstractmethod
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Any, Callable, Union, Optional, Iterable
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+Frame = Union[bytes, memoryview]
+
+
+class _AttachedSharedMemory(SharedMemory):
+    """
+    Shared memory that can be closed while views to it are still in use.
+    The memory is unmapped when the last view is garbage collected.
+    """
+
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            # views are still in use, the mapping lives with them, but the descriptor is not needed anymore
+            self._mmap = None
+            if getattr(self, "_fd", -1) >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+
+class SerializedChunk:
+    """
+    Chunk serialized by a :class:`Serializer`. Only its frames are pickled by the transport.
+
+    The transports do not pickle with out-of-band buffers, so all frames are copied into their pickle stream, unless
+    the frames after the first one (out-of-band buffers) are written into shared memory. It is done when their total
+    size is at least shared_memory_threshold. Then only the name of the segment is pickled and the frames are loaded
+    as views to the segment, which is unlinked when the chunk is unpickled.
+    """
+
+    __slots__ = ("frames", "shared_memory_threshold", "segments")
+
+    def __init__(self, frames: List[Frame], shared_memory_threshold: Optional[int] = None,
+                 segments: Optional[List[str]] = None):
+        """
+        :param frames: serialized chunk
+        :param shared_memory_threshold: Minimal total size in bytes of out-of-band frames that are written into shared
+            memory when the chunk is pickled. It must be used only with transports between processes on the same
+            machine.
+            None means that shared memory is not used.
+        :param segments: List where names of shared memory segments created by pickling are appended, so the sender
+            can unlink the ones that were never unpickled (see :func:`unlink_segments`).
+        """
+        self.frames = frames
+        self.shared_memory_threshold = shared_memory_threshold
+        self.segments = segments
+
+    def __reduce__(self):
+        if self.shared_memory_threshold is not None and len(self.frames) > 1:
+            buffers = [memoryview(f).cast("B") for f in self.frames[1:]]
+            size = sum(b.nbytes for b in buffers)
+            if size >= self.shared_memory_threshold:
+                shm = SharedMemory(create=True, size=size)
+                if self.segments is not None:
+                    self.segments.append(shm.name)
+                try:
+                    offset = 0
+                    for b in buffers:
+                        shm.buf[offset:offset + b.nbytes] = b
+                        offset += b.nbytes
+                    return _attach_frames, (self._in_band(self.frames[0]), shm.name, [b.nbytes for b in buffers])
+                finally:
+                    shm.close()
+
+        return SerializedChunk, ([self._in_band(f) for f in self.frames],)
+
+    @staticmethod
+    def _in_band(frame: Frame) -> bytes:
+        """
+        Converts frame to bytes that are pickled in-band.
+
+        :param frame: the frame
+        :return: frame as bytes
+        """
+        return frame if isinstance(frame, bytes) else bytes(frame)
+
+
+def _attach_frames(first: bytes, name: str, buffers_lens: List[int]) -> SerializedChunk:
+    """
+    Loads chunk which out-of-band frames were written into shared memory by :meth:`SerializedChunk.__reduce__`.
+    The segment is unlinked and the frames are views to it.
+
+    :param first: the first frame
+    :param name: name of shared memory segment
+    :param buffers_lens: lengths of out-of-band frames in the segment
+    :return: the chunk
+    """
+    shm = _AttachedSharedMemory(name)
+    shm.unlink()
+    try:
+        frames = [first]
+        offset = 0
+        for buffer_len in buffers_lens:
+            frames.append(shm.buf[offset:offset + buffer_len])
+            offset += buffer_len
+        return SerializedChunk(frames)
+    finally:
+        shm.close()
+
+
+def unlink_segments(names: Iterable[str]):
+    """
+    Unlinks shared memory segments of chunks that were pickled, but might not be unpickled. The ones that were already
+    unlinked by a receiver are skipped.
+
+    :param names: names of the segments
+    """
+    for name in names:
+        try:
+            shm = _AttachedSharedMemory(name)
+        except FileNotFoundError:
+            continue
+        shm.unlink()
+        shm.close()
+
+
+class Serializer(ABC):
+    """
+    Serializer of chunks of work and results that are sent between a pool and its workers.
+    A serialized chunk is a list of frames (bytes), so out-of-band data can be kept apart from the main frame.
+    """
+
+    def serialize(self, chunk: List[Any], shared_memory_threshold: Optional[int] = None,
+                  segments: Optional[List[str]] = None) -> SerializedChunk:
+        """
+        Serializes a chunk.
+
+        :param chunk: the chunk
+        :param shared_memory_threshold: Minimal total size in bytes of out-of-band frames that are written into shared
+            memory when the chunk is pickled by a transport.
+            None means that shared memory is not used.
+        :param segments: list where names of created shared memory segments are appended
+            See :class:`SerializedChunk`.
+        :return: serialized chunk
+        """
+        return SerializedChunk(self.dumps(chunk), shared_memory_threshold, segments)
+
+    def deserialize(self, chunk: SerializedChunk) -> List[Any]:
+        """
+        Deserializes a chunk.
+
+        :param chunk: serialized chunk
+        :return: the chunk
+        """
+        return self.loads(chunk.frames)
+
+    @abstractmethod
+    def dumps(self, chunk: List[Any]) -> List[Frame]:
+        """
+        Converts chunk to frames.
+
+        :param chunk: the chunk
+        :return: frames
+        """
+        pass
+
+    @abstractmethod
+    def loads(self, frames: List[Frame]) -> List[Any]:
+        """
+        Converts frames back to chunk.
+
+        :param frames: frames created by :meth:`dumps`
+        :return: the chunk
+        """
+        pass
+
+
+class PickleSerializer(Serializer):
+    """
+    Serializes chunks with pickle protocol 5. Out-of-band buffers (NumPy arrays, pickle.PickleBuffer) are kept in
+    their own frames, so they are not copied into the pickle stream of the chunk and they are loaded without copying
+    as views to the received frames. The transport copies the frames into its own pickle stream, unless they are sent
+    through shared memory (see :class:`SerializedChunk`).
+    """
+
+    def __init__(self, out_of_band: bool = True):
+        """
+        :param out_of_band: Whether the buffers that support it are sent out-of-band.
+        """
+        self.out_of_band = out_of_band
+
+    def dumps(self, chunk: List[Any]) -> List[Frame]:
+        buffers = []
+        data = pickle.dumps(chunk, protocol=5, buffer_callback=buffers.append if self.out_of_band else None)
+        return [data] + [b.raw() for b in buffers]
+
+    def loads(self, frames: List[Frame]) -> List[Any]:
+        return pickle.loads(frames[0], buffers=frames[1:])
+
+
+class MsgpackSerializer(Serializer):
+    """
+    Serializes chunks of plain data (None, bool, int, float, str, bytes, lists and dictionaries) with msgpack,
+    which is usually faster and more compact than pickle for them. Tuples are loaded as lists.
+
+    It requires msgpack package.
+    """
+
+    def __init__(self):
+        """
+        :raise ImportError: when msgpack is not installed
+        """
+        if msgpack is None:
+            raise ImportError("The MsgpackSerializer requires msgpack package.")
+
+    def dumps(self, chunk: List[Any]) -> List[Frame]:
+        return [msgpack.packb(chunk)]
+
+    def loads(self, frames: List[Frame]) -> List[Any]:
+        return msgpack.unpackb(frames[0])
+
+
+class CodecSerializer(Serializer):
+    """
+    Serializes chunks with user codec. The functions must be picklable (e.g. defined on module level), when they are
+    used with processes that are not forked.
+
+    Example:
+        >>> serializer = CodecSerializer(lambda c: json.dumps(c).encode(), json.loads)
+    """
+
+    def __init__(self, encode: Callable[[List[Any]], bytes], decode: Callable[[bytes], List[Any]]):
+        """
+        :param encode: converts chunk to bytes
+        :param decode: converts bytes back to chunk
+        """
+        self.encode = encode
+        self.decode = decode
+
+    def dumps(self, chunk: List[Any]) -> List[Frame]:
+        return [self.encode(chunk)]
+
+    def loads(self, frames: List[Frame]) -> List[Any]:
+        return self.decode(frames[0])
@@ -0,0 +1,30 @@
+# -*- coding: UTF-8 -*-
+""""
+Created on 19.10.26
+Workers for parallel generation of sorted runs of :func:`windpyutils.files.external_sort`.
+They are in their own module, so importing :mod:`windpyutils.files` does not import the pools.
+
+:author:     Martin Dočekal
+"""
+from typing import Callable, Any, Tuple
+
+from windpyutils.files import BaseRandomLineAccessFile, TmpPool, _spill_sort_run
+from windpyutils.parallel.own_proc_pools import FunctorWorker
+from windpyutils.typing import Comparable
+
+
+class SortRunWorker(FunctorWorker):
+    """
+    Worker for parallel generation of sorted runs. It receives [start, end) ranges of lines.
+    """
+
+    def __init__(self, source: BaseRandomLineAccessFile, key: Callable[[Any], Comparable], reverse: bool,
+                 tmp_pool: TmpPool):
+        super().__init__()
+        self.source = source
+        self.key = key
+        self.reverse = reverse
+        self.tmp_pool = tmp_pool
+
+    def __call__(self, inp: Tuple[int, int]) -> str:
+        return _spill_sort_run(self.source[inp[0]:inp[1]], self.key, self.reverse, self.tmp_pool)
@@ -8,7 +8,12 @@ This module contains classes that are used to store data in parallel processes.
 """
 import multiprocessing
 import os
+import struct
+import threading
+import uuid
 from abc import abstractmethod
+from array import array
+from types import SimpleNamespace
 from multiprocessing import Manager
 from typing import Generic, TypeVar, Optional, List, Tuple, Generator
 
@@ -269,3 +274,335 @@ class TextFileStorage(Storage[str]):
                     pass
 
 
+class ThreadTextFileStorage(TextFileStorage):
+    """
+    Thread safe storage that stores data in files. It is meant to be shared by threads of a single process,
+    e.g. workers of pool with thread backend.
+    It will create file for each thread.
+
+    It uses no manager process nor shared memory, so nothing is pickled. It could not be shared among processes.
+    """
+
+    def __init__(self, path: Optional[str], file_prefix: Optional[str] = "storage",
+                 number_of_data: Optional[int] = None, reader_only: bool = False):
+        """
+        Initialization of file storage.
+
+        :param path: Path to directory where data will be stored.
+        :param file_prefix: Prefix of file names.
+        :param number_of_data: Number of data that will be stored.
+         If you know this number in advance it will be more efficient.
+        :param reader_only: If True then this storage will be used only for reading.
+            It will not create any files.
+        """
+        # state of the thread that is using this storage
+        self._local = threading.local()
+
+        self._path = path
+        self._file_prefix = file_prefix
+        self._file_paths = []
+
+        self._index: List[Optional[Tuple[int, int]]] = []  # (thread_identifier, file_offset)
+        if number_of_data is not None:
+            self._index.extend([None] * number_of_data)
+
+        self._stored_cnt = SimpleNamespace(value=0)
+        self._storage_lock = threading.RLock()
+        self.reader_only = reader_only
+        self._waiting_for = SimpleNamespace(value=0)
+
+    @property
+    def _file(self):
+        return getattr(self._local, "file", None)
+
+    @_file.setter
+    def _file(self, file):
+        self._local.file = file
+
+    @property
+    def _process_identifier(self) -> Optional[int]:
+        return getattr(self._local, "identifier", None)
+
+    @_process_identifier.setter
+    def _process_identifier(self, identifier: Optional[int]):
+        self._local.identifier = identifier
+
+    @property
+    def _opened_files_for_reading(self) -> list:
+        if not hasattr(self._local, "opened_files_for_reading"):
+            self._local.opened_files_for_reading = []
+        return self._local.opened_files_for_reading
+
+    @_opened_files_for_reading.setter
+    def _opened_files_for_reading(self, files: list):
+        self._local.opened_files_for_reading = files
+
+
+class SegmentedTextFileStorage(TextFileStorage):
+    """
+    Storage that stores data in files without any global lock or shared state, so writers do not wait for each other.
+    Each writer (process) appends to its own data file and its own binary index segment with
+    (global_identifier, offset) records.
+
+    The segments are merged lazily into a compact global index when data are read. Data written by a writer
+    are visible to readers once the writer flushes its segment, which happens periodically (see
+    INDEX_BUFFER_SIZE) and on close.
+
+    Unlike :class:`TextFileStorage`, storing data under an identifier that is already used does not raise
+    ValueError in the writer, because the writer does not know what the others stored. The duplicate identifier is
+    detected when the segments are merged and the ValueError is raised by the reading method (len, iteration,
+    is_contiguous or indexing) that triggered the merge.
+    """
+
+    INDEX_RECORD = struct.Struct("<qq")  # (global_identifier, offset)
+    INDEX_BUFFER_SIZE = 64 * 1024  # size of buffered index records after which the segment is flushed
+    INDEX_SUFFIX = ".idx"
+
+    def __init__(self, path: Optional[str], file_prefix: Optional[str] = "storage",
+                 number_of_data: Optional[int] = None, reader_only: bool = False):
+        """
+        Initialization of file storage.
+
+        :param path: Path to directory where data will be stored.
+        :param file_prefix: Prefix of file names.
+        :param number_of_data: Number of data that will be stored.
+         If you know this number in advance it will be more efficient.
+        :param reader_only: If True then this storage will be used only for reading.
+            It will not create any files.
+        """
+        self._path = path
+        self._file_prefix = file_prefix
+        # distinguishes segments of this storage from segments of other storages in the same directory
+        self._storage_identifier = uuid.uuid4().hex[:8]
+        self.reader_only = reader_only
+
+        # writer state
+        self._file = None
+        self._index_file = None
+        self._process_identifier = None
+        self._writer_pid = None
+        self._offset = 0
+        self._index_buffer = bytearray()
+
+        # merged index
+        self._file_paths = []
+        self._segment_ids = {}
+        self._merged_bytes = []
+        self._segments = array("i", [-1] * (number_of_data or 0))
+        self._offsets = array("q", [-1] * (number_of_data or 0))
+        self._stored_cnt = 0
+        self._waiting_for = 0
+        self._opened_files_for_reading = []
+
+    def _segment_path(self, process_identifier: str) -> str:
+        """
+        Path to data file of given writer. The index segment has the same path with INDEX_SUFFIX.
+
+        :param process_identifier: identifier of writer
+        :return: path to data file
+        """
+        return os.path.join(self._path, f"{self._file_prefix}_{self._storage_identifier}_{process_identifier}")
+
+    def open(self):
+        """
+        Opens storage for writing and creates files of this writer.
+        """
+        if self.reader_only:
+            return
+
+        if self._writer_pid != os.getpid():
+            # writer state inherited from parent process belongs to the parent, this process needs own segment
+            self._file = None
+            self._index_file = None
+            self._index_buffer = bytearray()
+            self._process_identifier = None
+            self._writer_pid = os.getpid()
+
+        if self._file is not None:
+            return
+
+        if self._process_identifier is None:
+            self._process_identifier = f"{os.getpid()}_{uuid.uuid4().hex[:8]}"
+
+        path = self._segment_path(self._process_identifier)
+        self._file = open(path, "ab")
+        self._index_file = open(path + self.INDEX_SUFFIX, "ab")
+        self._offset = self._file.tell()
+
+    def _flush_segment(self):
+        """
+        Flushes written data and then their index records, so an index record never points to data that are not
+        in the file.
+        """
+        self._file.flush()
+        self._index_file.write(self._index_buffer)
+        self._index_file.flush()
+        self._index_buffer.clear()
+
+    def close(self):
+        """
+        Closes storage for writing.
+        """
+        if self._file is not None:
+            self._flush_segment()
+            self._file.close()
+            self._index_file.close()
+            self._file = None
+            self._index_file = None
+
+        for f in self._opened_files_for_reading:
+            if f is not None:
+                f.close()
+
+        self._opened_files_for_reading = []
+
+    def flush(self):
+        """
+        Removes all files that are used by this storage and resets it to initial state.
+
+        Make sure that you have closed this storage (in all processes) before calling this method.
+        """
+        prefix = f"{self._file_prefix}_{self._storage_identifier}_"
+        for name in os.listdir(self._path):
+            if name.startswith(prefix):
+                os.remove(os.path.join(self._path, name))
+
+        self._process_identifier = None
+        self._file_paths = []
+        self._segment_ids = {}
+        self._merged_bytes = []
+        self._segments = array("i")
+        self._offsets = array("q")
+        self._stored_cnt = 0
+        self._waiting_for = 0
+
+    def _merge(self):
+        """
+        Merges new records of all index segments into the global index.
+
+        :raise ValueError: When there are data stored under the same identifier.
+        """
+        prefix = f"{self._file_prefix}_{self._storage_identifier}_"
+        for name in os.listdir(self._path):
+            if not name.startswith(prefix) or not name.endswith(self.INDEX_SUFFIX):
+                continue
+
+            process_identifier = name[len(prefix):-len(self.INDEX_SUFFIX)]
+            if process_identifier not in self._segment_ids:
+                self._segment_ids[process_identifier] = len(self._file_paths)
+                self._file_paths.append(self._segment_path(process_identifier))
+                self._merged_bytes.append(0)
+
+            segment = self._segment_ids[process_identifier]
+            with open(os.path.join(self._path, name), "rb") as f:
+                f.seek(self._merged_bytes[segment])
+                records = f.read()
+
+            records = records[:len(records) - len(records) % self.INDEX_RECORD.size]  # only complete records
+            self._merged_bytes[segment] += len(records)
+
+            for global_identifier, offset in self.INDEX_RECORD.iter_unpack(records):
+                if len(self._offsets) <= global_identifier:
+                    missing = max(global_identifier - len(self._offsets) + 1, len(self._offsets))
+                    self._segments.extend([-1] * missing)
+                    self._offsets.extend([-1] * missing)
+
+                if self._offsets[global_identifier] != -1:
+                    raise ValueError(f"Data with identifier {global_identifier} are stored multiple times.")
+
+                self._segments[global_identifier] = segment
+                self._offsets[global_identifier] = offset
+                self._stored_cnt += 1
+
+        while self._waiting_for < len(self._offsets) and self._offsets[self._waiting_for] != -1:
+            self._waiting_for += 1
+
+    def is_contiguous(self) -> bool:
+        """
+        Returns True if there is no gap between stored data.
+        All global identifiers are filling the range [0, len(self)) without any gaps.
+        """
+        self._merge()
+        return self._waiting_for == self._stored_cnt
+
+    def _open_file_for_read(self, process_identifier: int):
+        """
+        Opens file for reading if it is not already opened.
+
+        :param process_identifier: Number of segment.
+        """
+        if process_identifier >= len(self._opened_files_for_reading):
+            self._opened_files_for_reading.extend(
+                [None] * (process_identifier - len(self._opened_files_for_reading) + 1)
+            )
+
+        if self._opened_files_for_reading[process_identifier] is None:
+            self._opened_files_for_reading[process_identifier] = open(self._file_paths[process_identifier], "rb")
+
+    def _is_merged(self, global_identifier: int) -> bool:
+        """
+        Checks whether data with given identifier are in the global index.
+
+        :param global_identifier: identifier that is unique for this data among all processes
+        :return: True if the data are in the global index
+        """
+        return 0 <= global_identifier < len(self._offsets) and self._offsets[global_identifier] != -1
+
+    def __setitem__(self, global_identifier: int, data: str):
+        """
+        Stores given data.
+
+        :param global_identifier: identifier that is unique for this data among all processes
+            Duplicates are not checked here, they are reported when the segments are merged.
+        :param data: Data to be stored in form of text line.
+            Line separator will be added automatically.
+        """
+        self.open()
+
+        line = (data + "\n").encode("utf-8")
+        self._index_buffer += self.INDEX_RECORD.pack(global_identifier, self._offset)
+        self._file.write(line)
+        self._offset += len(line)
+
+        if len(self._index_buffer) >= self.INDEX_BUFFER_SIZE:
+            self._flush_segment()
+
+    def __getitem__(self, global_identifier: int) -> str:
+        """
+        Returns data stored under given identifier.
+
+        :param global_identifier: identifier that is unique for this data among all processes
+        :return: Data stored under given identifier.
+        :raise IndexError: When there is no data stored under given identifier.
+        """
+        if not self._is_merged(global_identifier):
+            self._merge()
+            if not self._is_merged(global_identifier):
+                raise IndexError(f"There is no data stored under {global_identifier} identifier.")
+
+        segment = self._segments[global_identifier]
+        if not self._is_file_open_for_read(segment):
+            self._open_file_for_read(segment)
+
+        f = self._opened_files_for_reading[segment]
+        f.seek(self._offsets[global_identifier])
+        return f.readline().decode("utf-8").rstrip("\n").rstrip("\r")
+
+    def __len__(self) -> int:
+        """
+        Returns number of stored data.
+
+        :return: Number of stored data.
+        """
+        self._merge()
+        return self._stored_cnt
+
+    def __iter__(self) -> Generator[str, None, None]:
+        """
+        Returns generator that yields all stored data and skips gaps.
+        Data that were not merged when the iteration started are not yielded.
+        """
+        self._merge()
+        for i in range(len(self._offsets)):
+            if self._offsets[i] != -1:
+                yield self[i]
@@ -8,12 +8,32 @@ This module contains classes that represents parallel workers a.k.a. processes.
 import multiprocessing
 from multiprocessing.context import Process
 from multiprocessing import Queue
-from typing import TypeVar, Callable
+from typing import TypeVar, Callable, Optional, Type
 
 T = TypeVar('T')
 R = TypeVar('R')
 
 
+class _LazyQueue:
+    """
+    Class attribute with a queue that is created on the first access, so importing a module does not create any
+    multiprocessing resources.
+    """
+
+    def __init__(self, maxsize: Optional[Callable[[], int]] = None):
+        """
+        :param maxsize: function that returns max size of the queue
+            None means unlimited.
+        """
+        self._maxsize = maxsize
+        self._queue = None
+
+    def __get__(self, obj, owner: Type) -> Queue:
+        if self._queue is None:
+            self._queue = Queue(0 if self._maxsize is None else self._maxsize())
+        return self._queue
+
+
 class FunRunner(Process):
     """
     Representation of one parallel process that runs given function on data from shared queue :py:attr:`~WORK_QUEUE`
@@ -23,6 +43,9 @@ class FunRunner(Process):
 
     The results are put into the :py:attr:`~RESULTS_QUEUE`.
 
+    The shared queues are created on the first access. Own queues could be given to each runner instead, which is
+    needed when multiple groups of runners are used at the same time.
+
     Example:
         procs = [FunRunner(pf=f) for _ in range(workers)]
 
@@ -57,28 +80,38 @@ class FunRunner(Process):
             p.join()
     """
 
-    WORK_QUEUE = Queue(multiprocessing.cpu_count())
+    WORK_QUEUE = _LazyQueue(multiprocessing.cpu_count)
     """Queue for work that needs to be done."""
 
-    RESULTS_QUEUE = Queue()
+    RESULTS_QUEUE = _LazyQueue()
     """Completed work."""
 
-    def __init__(self, pf: Callable[[T], R]):
+    def __init__(self, pf: Callable[[T], R], work_queue: Optional[Queue] = None,
+                 results_queue: Optional[Queue] = None):
         """
         Initialization of parallel worker.
 
         :param pf: Function you want to run in data-parallel way.
         :type pf: Callable[[T], R]
+        :param work_queue: queue that is used for receiving work and stop orders
+            None means the shared :py:attr:`~WORK_QUEUE`.
+        :type work_queue: Optional[Queue]
+        :param results_queue: queue that is used for sending results
+            None means the shared :py:attr:`~RESULTS_QUEUE`.
+        :type results_queue: Optional[Queue]
         """
         super().__init__()
         self.pf = pf
+        # the queues are obtained here, so they are created in the parent and passed to the process
+        self.work_queue = self.WORK_QUEUE if work_queue is None else work_queue
+        self.results_queue = self.RESULTS_QUEUE if results_queue is None else results_queue
 
     def run(self) -> None:
         """
         Run the process.
         """
         while True:
-            q_item = self.WORK_QUEUE.get()
+            q_item = self.work_queue.get()
 
             if q_item is None:
                 # all done
@@ -86,5 +119,5 @@ class FunRunner(Process):
 
             i, data_list = q_item
 
-            self.RESULTS_QUEUE.put((i, [self.pf(x) for x in data_list]))
+            self.results_queue.put((i, [self.pf(x) for x in data_list]))
 